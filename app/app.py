@@ -1,11 +1,12 @@
 """Main application file"""
 
 from flask_api import FlaskAPI
-from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
 from flask_mail import Mail
 
 from config import app_config
+from app.database import SQLAlchemy
+from app.serializers import JSONEncoder
 
 db = SQLAlchemy()
 jwt = JWTManager()
@@ -19,7 +20,7 @@ def create_app(config_name):
     app.config.from_object(app_config[config_name])
     app_config[config_name].init_app(app)
     app.url_map.strict_slashes = False
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.json_encoder = JSONEncoder
     db.init_app(app)
     jwt.init_app(app)
     mail.init_app(app)
@@ -30,6 +31,20 @@ def create_app(config_name):
 
         return app.send_static_file('index.html')
 
+    from app import search  # registers the search index maintenance
+    from app.revocation import blacklist
+    from app.cache import catalogue_cache
+    from app import identity
+    from app.instrumentation import instrumentation
+    from app.replicas import replicas
+    from app.passwords import hasher
+    replicas.init_app(app)
+    hasher.init_app(app)
+    blacklist.init_app(app)
+    catalogue_cache.init_app(app)
+    identity.init_app(app)
+    instrumentation.init_app(app)
+
     from app.auth import auth
     from app.main import main
     app.register_blueprint(auth)
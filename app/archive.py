@@ -0,0 +1,40 @@
+"""Moving returned loans from borrow_log to the borrow_log_archive table.
+
+Open loans and recently returned ones stay in borrow_log, so borrowing,
+returning and the overdue scan keep working on a small table. Borrowing
+history reads both tables (see ``BorrowLog.history_rows``).
+"""
+
+import datetime
+from flask import current_app
+from sqlalchemy import select, true
+from app.app import db
+from app.models import ArchivedLoan, BorrowLog
+
+
+def archive_loans(now, older_than_days=None, batch_size=None):
+    """Move the loans returned more than older_than_days before now to the
+    archive, one batch per transaction. Returns the number of loans moved"""
+
+    config = current_app.config
+    older_than_days = config['ARCHIVE_AFTER_DAYS'] if older_than_days is None else older_than_days
+    batch_size = batch_size or config['ARCHIVE_BATCH_SIZE']
+    cutoff = now - datetime.timedelta(days=older_than_days)
+    log, archive = BorrowLog.__table__, ArchivedLoan.__table__
+    columns = [column.key for column in log.columns]
+
+    moved = 0
+    while True:
+        # SKIP LOCKED keeps two archivers from moving the same records
+        ids = [borrow_id for borrow_id, in db.session.query(BorrowLog.borrow_id).filter(
+            BorrowLog.returned == true(), BorrowLog.return_timestamp < cutoff
+        ).order_by(BorrowLog.return_timestamp).limit(batch_size).with_for_update(
+            skip_locked=True)]
+        if ids:
+            db.session.execute(archive.insert().from_select(
+                columns, select([log.c[name] for name in columns]).where(log.c.borrow_id.in_(ids))))
+            db.session.execute(log.delete().where(log.c.borrow_id.in_(ids)))
+        db.session.commit()
+        moved += len(ids)
+        if len(ids) < batch_size:
+            return moved
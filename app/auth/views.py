@@ -5,19 +5,19 @@ import datetime
 from flask import request, jsonify, current_app
 from flask_jwt_extended import (create_access_token,
                                 jwt_required, get_jwt_identity,
-                                get_raw_jwt, create_refresh_token)
-from werkzeug.security import generate_password_hash
+                                get_raw_jwt, create_refresh_token, get_jti)
 from flask_mail import Message
 
-from app.models import User
-from app.app import jwt, mail
+from app.models import User, PasswordReset
+from app.app import jwt
 from . import auth
 from app.endpoints import Auth
 from app.decorators import admin_required, validate_email_password
 from app.jwt_extensions import refresh_jwt_optional
-
-blacklist = set()
-temp = []
+from app.revocation import blacklist
+from app.mailer import enqueue
+from app.identity import load_user
+from app.passwords import HashingBusy, hasher
 
 
 @auth.route(Auth.REGISTER, methods=['POST'])
@@ -95,9 +95,16 @@ def login_user():
         password = request.data.get('password')
         if not email or not password:
             return jsonify(msg='Please provide an email and a password'), 400
-        user = User.get_by_email(email)
+        user = load_user(email)
 
         if user and user.check_password(password):
+            if user.password_needs_rehash():
+                try:
+                    user.set_password(password)
+                except HashingBusy:
+                    pass  # keep the old hash, the next login upgrades it
+                else:
+                    user.save()
             access_token = create_access_token(identity=email)
             response = {'msg': 'Successful login', 'access_token': access_token}
             return jsonify(response), 200
@@ -118,16 +125,13 @@ def reset_password():
 
     if token_id:
         user = User.get_by_email(token_id)
-        if not user:
+        reset = PasswordReset.pop(get_raw_jwt()['jti']) if user else None
+        if not reset or reset.email != user.email:
             return jsonify(msg='The reset code provided is invalid'), 400
         else:
-            pass_hash = [item for item in temp if item[0] == user.email][0][1]
-            user.password = pass_hash
+            user.password = reset.password
             user.save()
             revoke_token()
-            for record in temp:
-                if record[0] == user.email:
-                    temp.remove(record)
             return jsonify(msg='Your password has been reset'), 200
     else:
         if not email:
@@ -135,16 +139,19 @@ def reset_password():
         if not new_pass:
             return jsonify(msg='You must provide a new password'), 400
 
-        reset_token = create_refresh_token(identity=email,
-                                           expires_delta=datetime.timedelta(minutes=10))
-        temp.append((email, generate_password_hash(new_pass)))
+        expires_delta = current_app.config['PASSWORD_RESET_EXPIRES']
+        reset_token = create_refresh_token(identity=email, expires_delta=expires_delta)
+        password_hash = hasher.hash(new_pass)
+        PasswordReset.create(email, password_hash, get_jti(reset_token),
+                             datetime.datetime.utcnow() + expires_delta)
         reset_msg = Message(subject='Password Reset')
         reset_msg.add_recipient(email)
         reset_msg.html = '<p>To reset your password, click on the following link: ' \
                          '<a href={}/api/v1/auth/reset-password?token={}>Reset Password' \
                          '</a>. Keep in mind the link is only valid for ' \
-                         '10 minutes</p>'.format(current_app.config['DOMAIN'], reset_token)
-        mail.send(reset_msg)
+                         '{} minutes</p>'.format(current_app.config['DOMAIN'], reset_token,
+                                                 int(expires_delta.total_seconds() // 60))
+        enqueue(reset_msg)
         return jsonify(msg='A reset code has been sent to the email you provided.'), 200
 
 
@@ -161,13 +168,12 @@ def logout():
 def check_if_token_in_blacklist(token):
     """Callback for checking if a token is blacklisted"""
 
-    jti = token['jti']
-    return jti in blacklist
+    return blacklist.is_revoked(token['jti'], token.get('exp'))
 
 @jwt.user_claims_loader
 def add_claims_to_token(identity):
     is_admin = False
-    user = User.get_by_email(identity)
+    user = load_user(identity)
     if user.is_admin:
         is_admin = True
     return {
@@ -178,7 +184,7 @@ def add_claims_to_token(identity):
 
 
 def revoke_token():
-    jti = get_raw_jwt()['jti']
-    blacklist.add(jti)
+    token = get_raw_jwt()
+    blacklist.revoke(token['jti'], token.get('exp'))
     revoked = True
     return revoked
@@ -0,0 +1,183 @@
+"""Caching helpers"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # the redis backend is optional
+    redis = None
+
+
+class TTLCache:
+    """A bounded, thread-safe mapping whose entries expire.
+
+    Entries live for ``ttl`` seconds (or the ttl given to ``set``) and the
+    least recently used entry is evicted once ``maxsize`` is reached.
+    Counters created with ``incr`` never expire and are never evicted, so
+    they are meant for a fixed handful of keys.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._data = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value stored for key, or default if missing or expired"""
+
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                return default
+            if expires is not None and expires <= self.timer():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store value under key for ttl seconds"""
+
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else self.timer() + ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def incr(self, key):
+        """Increment the integer stored under key and return the new value"""
+
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def delete(self, key):
+        """Remove key from the cache if present"""
+
+        with self._lock:
+            self._data.pop(key, None)
+            self._counters.pop(key, None)
+
+    def clear(self):
+        """Remove all entries"""
+
+        with self._lock:
+            self._data.clear()
+            self._counters.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache:
+    """Cache backend shared between workers, storing JSON values in Redis"""
+
+    def __init__(self, url, ttl=None, prefix='hellobooks:'):
+        if redis is None:
+            raise RuntimeError('The redis package is required for the redis cache backend')
+        self.client = redis.StrictRedis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key, default=None):
+        value = self.client.get(self.prefix + key)
+        return default if value is None else json.loads(value.decode())
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+class CatalogueCache:
+    """Cache for serialized catalogue responses.
+
+    Keys embed a catalogue-wide generation number that is incremented on
+    every change to any book. A response computed while a write was in
+    progress is therefore stored under an outdated key and never served, and
+    entries of past generations simply expire.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config['CATALOGUE_CACHE_BACKEND']
+        ttl = app.config['CATALOGUE_CACHE_TTL']
+        if backend == 'memory':
+            self.backend = TTLCache(maxsize=app.config['CATALOGUE_CACHE_SIZE'], ttl=ttl)
+        elif backend == 'redis':
+            self.backend = RedisCache(app.config['CATALOGUE_CACHE_REDIS_URL'], ttl=ttl)
+        else:
+            self.backend = None
+        self.hits = 0
+        self.misses = 0
+        app.extensions['catalogue_cache'] = self
+
+    def key(self, path, book_id=None):
+        """Return the cache key for a single book or for a listing at path"""
+
+        generation = self.backend.get('books:generation', 0)
+        if book_id is not None:
+            return 'book:{}:{}:{}'.format(book_id, generation, path)
+        return 'books:{}:{}'.format(generation, path)
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def get(self, key):
+        if self.backend is None:
+            return None
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.backend is not None:
+            self.backend.set(key, value)
+
+    def invalidate(self):
+        """Drop all cached books and listings after a change"""
+
+        if self.backend is not None:
+            self.backend.incr('books:generation')
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__ if self.backend else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None
+        }
+
+
+catalogue_cache = CatalogueCache()
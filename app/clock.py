@@ -0,0 +1,107 @@
+"""The clock behind the timestamps the application writes.
+
+Everything that stamps or compares borrowing and catalogue times asks
+``clock.now()`` instead of calling ``datetime.utcnow()`` itself, so tests and
+benchmarks can swap in a ``FakeClock``::
+
+    with clock.use(FakeClock(datetime.datetime(2018, 7, 1))) as fake:
+        ...
+        fake.advance(days=15)
+
+``utcnow`` is the same time computed by the database, used for server side
+defaults and with DATABASE_TIMESTAMPS.
+"""
+
+import contextlib
+import datetime
+from sqlalchemy import DateTime
+from sqlalchemy.exc import CompileError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+
+class SystemClock:
+    """The current UTC time"""
+
+    def now(self):
+        return datetime.datetime.utcnow()
+
+
+class FakeClock:
+    """A clock that only moves when told to, or by step on every reading"""
+
+    def __init__(self, start=None, step=None):
+        self.current = start or datetime.datetime(2018, 1, 1)
+        self.step = step
+
+    def now(self):
+        current = self.current
+        if self.step:
+            self.current += self.step
+        return current
+
+    def advance(self, **kwargs):
+        """Move the clock forward by a timedelta given as keyword arguments"""
+
+        self.current += datetime.timedelta(**kwargs)
+
+    def sleep(self, seconds):
+        """A time.sleep replacement that advances the clock instead of waiting"""
+
+        self.advance(seconds=seconds)
+
+
+class Clock:
+    """The application clock, reading the time from a replaceable source"""
+
+    def __init__(self, source=None):
+        self.source = source or SystemClock()
+
+    def now(self):
+        return self.source.now()
+
+    @contextlib.contextmanager
+    def use(self, source):
+        """Read the time from source until the block exits"""
+
+        previous, self.source = self.source, source
+        try:
+            yield source
+        finally:
+            self.source = previous
+
+
+class utcnow(FunctionElement):
+    """The database's current UTC time, optionally offset by a number of days"""
+
+    type = DateTime()
+    name = 'utcnow'
+
+    def __init__(self, days=0):
+        super().__init__()
+        self.days = int(days)
+
+
+@compiles(utcnow)
+def compile_utcnow(element, compiler, **kwargs):
+    if element.days:
+        raise CompileError('utcnow() with an offset is not supported on this database')
+    return 'CURRENT_TIMESTAMP'
+
+
+@compiles(utcnow, 'sqlite')
+def compile_utcnow_sqlite(element, compiler, **kwargs):
+    if element.days:
+        return "DATETIME(CURRENT_TIMESTAMP, '{:+d} days')".format(element.days)
+    return 'CURRENT_TIMESTAMP'
+
+
+@compiles(utcnow, 'postgresql')
+def compile_utcnow_postgresql(element, compiler, **kwargs):
+    sql = "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+    if element.days:
+        sql += " + INTERVAL '{:d} days'".format(element.days)
+    return sql
+
+
+clock = Clock()
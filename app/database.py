@@ -0,0 +1,140 @@
+"""Database engine configuration.
+
+Flask-SQLAlchemy only forwards a few pool settings to ``create_engine``; the
+subclass here also applies SQLALCHEMY_POOL_PRE_PING, SQLALCHEMY_ENGINE_OPTIONS
+and, on PostgreSQL, a default SQLALCHEMY_STATEMENT_TIMEOUT. Views can raise or
+lower the timeout for their own transactions with ``statement_timeout``.
+Sessions are ``RoutingSession`` instances, which send the reads of views
+decorated with ``read_from_replica`` to a replica (see ``app.replicas``).
+"""
+
+import threading
+import time
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy, SignallingSession
+from sqlalchemy import event, exc, orm
+from sqlalchemy.pool import QueuePool
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool counting checkouts and the time spent waiting for them"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+
+    def timed(self, checkout):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return checkout()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            with self.stats_lock:
+                self.checkouts += 1
+                self.timeouts += timed_out
+                self.wait_seconds += time.perf_counter() - start
+
+    def connect(self):
+        return self.timed(super().connect)
+
+    def unique_connection(self):
+        return self.timed(super().unique_connection)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.checkouts, pool.timeouts, pool.wait_seconds = \
+            self.checkouts, self.timeouts, self.wait_seconds
+        return pool
+
+    def stats(self):
+        """Return the pool's gauges and counters"""
+
+        return {
+            'size': self.size(),
+            'checked_out': self.checkedout(),
+            'checked_in': self.checkedin(),
+            'overflow': max(self.overflow(), 0),
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'wait_seconds': self.wait_seconds,
+        }
+
+
+class RoutingSession(SignallingSession):
+    """Session reading from a replica while a read-only view runs.
+
+    Flushes, and so every write, always go to the primary."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_app_context() and g.get('read_replica'):
+            engine = self.app.extensions['replicas'].engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """Flask-SQLAlchemy taking all engine and pool options from the configuration"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        event.listen(self.session, 'after_begin', apply_statement_timeout)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_pool_defaults(self, app, options):
+        super().apply_pool_defaults(app, options)
+        if app.config['SQLALCHEMY_POOL_PRE_PING']:
+            options['pool_pre_ping'] = True
+
+    def apply_driver_hacks(self, app, info, options):
+        for key, value in (app.config['SQLALCHEMY_ENGINE_OPTIONS'] or {}).items():
+            options[key] = dict(value) if isinstance(value, dict) else value
+        super().apply_driver_hacks(app, info, options)
+
+        if info.drivername.startswith('postgresql'):
+            timeout = app.config['SQLALCHEMY_STATEMENT_TIMEOUT']
+            if timeout:
+                connect_args = options.setdefault('connect_args', {})
+                connect_args['options'] = '{} -c statement_timeout={}'.format(
+                    connect_args.get('options', ''), int(timeout)).strip()
+        # sqlite files and in-memory databases get NullPool and StaticPool
+        if 'poolclass' not in options:
+            options['poolclass'] = InstrumentedQueuePool
+
+
+def apply_statement_timeout(session, transaction, connection):
+    """Apply the statement timeout set by the current view to a new transaction"""
+
+    if not has_app_context() or connection.dialect.name != 'postgresql':
+        return
+    timeout = g.get('statement_timeout')
+    if timeout:
+        connection.execute('SET LOCAL statement_timeout = {}'.format(int(timeout)))
+
+
+def set_statement_timeout(session, timeout):
+    """Apply timeout to the transaction session has open, beginning one if needed.
+
+    Views may run queries before their statement timeout is set, e.g. the
+    token checks of their decorators; transactions begun after it is set get
+    it from apply_statement_timeout instead."""
+
+    connection = session.connection()
+    if connection.dialect.name == 'postgresql':
+        connection.execute('SET LOCAL statement_timeout = {}'.format(int(timeout)))
+
+
+def pool_stats(engine):
+    """Return the statistics of engine's connection pool, or None if it does not pool"""
+
+    if isinstance(engine.pool, InstrumentedQueuePool):
+        return engine.pool.stats()
+    return None
@@ -1,49 +1,179 @@
 """Decorators"""
 
-import json
 import re
-from functools import wraps
-from flask import request, jsonify
-from flask_jwt_extended import get_jwt_identity
-from app.models import User
-from app.utils import get_paginated
+from functools import partial, wraps
+from flask import g, request, jsonify, current_app
+from flask_jwt_extended import get_jwt_claims
+from sqlalchemy.exc import OperationalError
+from app.app import db
+from app.cache import catalogue_cache
+from app.database import set_statement_timeout
+from app.replicas import replicas
+from app.identity import get_current_user
+from app.utils import decode_cursor
 
 
 def allow_pagination(func):
-    """Decorator for paginating results. Works on endpoints that return list results"""
+    """Decorator for paginating results. Works on endpoints that return list results.
+
+    Validates the pagination parameters and stores them on ``flask.g`` where
+    they are picked up by ``app.utils.get_paginated``"""
 
     @wraps(func)
     def paginate(*args, **kwargs):
         limit = request.args.get('limit')
-        page = 1 if not request.args.get('page') else request.args.get('page')
-        if limit and not re.match(r'[0-9]', limit):
+        page = request.args.get('page', '1')
+        cursor = request.args.get('cursor')
+        if limit and not (limit.isdigit() and int(limit) > 0):
             return jsonify(msg='Please make sure that the limit parameter is valid'), 400
-        rv = func(*args, **kwargs)[0]
-        results = json.loads(rv.data)
-
-        if limit:
-            paginated = get_paginated(limit, results, request.path, page)
-            if not paginated:
-                return jsonify(msg='The requested page was not found'), 404
-            return jsonify(paginated), 200
+        if not (page.isdigit() and int(page) > 0):
+            return jsonify(msg='Please make sure that the page parameter is valid'), 400
+        try:
+            cursor = decode_cursor(cursor) if cursor else None
+        except ValueError:
+            return jsonify(msg='Please make sure that the cursor parameter is valid'), 400
+
+        g.pagination = {
+            'limit': int(limit) if limit else None,
+            'page': int(page),
+            'cursor': cursor,
+            'count': request.args.get('count') == 'true'
+        }
         return func(*args, **kwargs)
 
     return paginate
 
 
+def conditional_get(func):
+    """Decorator adding an ETag header to catalogue reads and answering 304
+    Not Modified when it matches.
+
+    The tag is a hash of the response body, which the catalogue cache usually
+    serves without a query. Single books also carry the Last-Modified date
+    set by the view; listings have none because deleting a book would not
+    move it forward"""
+
+    @wraps(func)
+    def conditional(*args, **kwargs):
+        response = current_app.make_response(func(*args, **kwargs))
+        if response.status_code != 200 or response.is_streamed:
+            return response
+        response.add_etag()
+        return response.make_conditional(request)
+    return conditional
+
+
+def cache_catalogue(func):
+    """Decorator caching the serialized responses of catalogue reads"""
+
+    @wraps(func)
+    def cached(*args, **kwargs):
+        if not catalogue_cache.enabled:
+            return func(*args, **kwargs)
+        key = catalogue_cache.key(request.full_path, kwargs.get('book_id'))
+        hit = catalogue_cache.get(key)
+        if hit:
+            data, mimetype, last_modified = hit
+            response = current_app.response_class(data, status=200, mimetype=mimetype)
+            if last_modified:
+                response.headers['Last-Modified'] = last_modified
+            return response
+
+        response = current_app.make_response(func(*args, **kwargs))
+        # replicas may lag behind the writes that bumped the generations
+        if response.status_code == 200 and not response.is_streamed and not g.get('replica'):
+            catalogue_cache.set(key, (response.get_data(as_text=True), response.mimetype,
+                                      response.headers.get('Last-Modified')))
+        return response
+    return cached
+
+
 def admin_required(func):
-    """Decorator for protecting admin-only endpoints"""
+    """Decorator for protecting admin-only endpoints.
+
+    Trusts the signed is_admin claim in the access token unless
+    ADMIN_REVALIDATE is set, in which case the user is looked up"""
 
     @wraps(func)
     def check_admin_status(*args, **kwargs):
-        current_user_email = get_jwt_identity()
-        user = User.get_by_email(current_user_email)
-        if not user.is_admin:
+        if current_app.config['ADMIN_REVALIDATE']:
+            user = get_current_user()
+            is_admin = user is not None and user.is_admin
+        else:
+            is_admin = get_jwt_claims().get('is_admin', False)
+        if not is_admin:
             return jsonify(msg='You do not have permission to perform this action'), 403
         return func(*args, **kwargs)
     return check_admin_status
 
 
+def statement_timeout(config_key):
+    """Decorator applying the statement timeout, in milliseconds, configured
+    under config_key to the view's open transaction and every transaction it
+    starts (PostgreSQL only)"""
+
+    def decorator(func):
+        @wraps(func)
+        def apply_timeout(*args, **kwargs):
+            timeout = current_app.config[config_key]
+            if timeout:
+                set_statement_timeout(db.session(), timeout)
+            g.statement_timeout = timeout
+            try:
+                return func(*args, **kwargs)
+            finally:
+                g.pop('statement_timeout', None)
+        return apply_timeout
+    return decorator
+
+
+def release_replica(state, session):
+    """Send the queries of session back to the primary once a replica read is over"""
+
+    if state.pop('replica', None):
+        # end the replica transaction and expire what it loaded
+        session.rollback()
+    state.pop('read_replica', None)
+
+
+def read_from_replica(func):
+    """Decorator running a read-only view on a database replica when one is healthy.
+
+    Users who wrote recently keep reading from the primary. If the replica
+    fails during the view, it is marked unhealthy and the view is run again
+    on the primary. Streamed responses keep reading from the replica until
+    they have been sent, and are not retried if it fails meanwhile"""
+
+    @wraps(func)
+    def route(*args, **kwargs):
+        if not replicas.enabled or replicas.wrote_recently():
+            return func(*args, **kwargs)
+        g.read_replica = True
+        streamed = False
+        try:
+            try:
+                response = current_app.make_response(func(*args, **kwargs))
+            except OperationalError:
+                if not g.get('replica'):
+                    raise
+                current_app.logger.warning('Replica %s failed, reading from the primary',
+                                           g.replica)
+                replicas.mark_unhealthy(g.replica)
+                db.session.rollback()
+                g.replica = None
+                response = current_app.make_response(func(*args, **kwargs))
+            if response.is_streamed:
+                # the rows are only read while the response is sent
+                response.call_on_close(partial(release_replica, g._get_current_object(),
+                                               db.session()))
+                streamed = True
+            return response
+        finally:
+            if not streamed:
+                release_replica(g, db.session)
+    return route
+
+
 def validate_email_password(func):
     """Decorator for validating email and password"""
 
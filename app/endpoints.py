@@ -8,13 +8,21 @@ class Main:
 
     ADD_BOOK = BASE_URL+'/books'
     ALL_BOOKS = BASE_URL+'/books'
+    BULK_ADD_BOOKS = BASE_URL+'/books/bulk'
     MODIFY_BOOK = BASE_URL+'/books/<int:book_id>'
     DELETE_BOOK = BASE_URL+'/books/<int:book_id>'
     GET_BOOK = BASE_URL+'/books/<int:book_id>'
+    SEARCH = BASE_URL+'/books/search'
     BORROW = BASE_URL+'/users/books/<int:book_id>'
     RETURN = BASE_URL+'/users/books/<int:book_id>'
+    BATCH_BORROW = BASE_URL+'/users/books/batch'
+    BATCH_RETURN = BASE_URL+'/users/books/batch'
     BORROWING_HISTORY = BASE_URL+'/users/books'
     UNRETURNED = BASE_URL+'/users/books'
+    OVERDUE = BASE_URL+'/users/overdue'
+    REPORTS = BASE_URL+'/reports/<report>'
+    CACHE_STATS = BASE_URL+'/cache/stats'
+    METRICS = BASE_URL+'/metrics'
 
 
 class Auth:
@@ -0,0 +1,28 @@
+"""Request-scoped resolution of the authenticated user"""
+
+from flask import g
+from flask_jwt_extended import get_jwt_identity
+from app.models import User
+
+
+def init_app(app):
+    """Make sure cached users never outlive the request that loaded them"""
+
+    @app.teardown_request
+    def clear_user_cache(exc):
+        g.pop('users', None)
+
+
+def load_user(email):
+    """Return the user with the given email, looking it up at most once per request"""
+
+    users = g.setdefault('users', {})
+    if email not in users:
+        users[email] = User.get_by_email(email)
+    return users[email]
+
+
+def get_current_user():
+    """Return the user identified by the request's access token"""
+
+    return load_user(get_jwt_identity())
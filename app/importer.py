@@ -0,0 +1,201 @@
+"""Bulk import of books into the catalogue.
+
+Books are written in batches with one commit per batch. On PostgreSQL a batch
+is a single ``INSERT ... ON CONFLICT (isbn) DO UPDATE`` statement which adds
+the copies of already catalogued books to their available count. Other
+databases look the batch's ISBNs up first and issue the updates and inserts
+in the same transaction.
+"""
+
+import csv
+import json
+import os
+from types import SimpleNamespace
+from sqlalchemy import bindparam, literal_column, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import SQLAlchemyError
+from app.app import db
+from app.cache import catalogue_cache
+from app.clock import clock
+from app.models import Book
+from app.search import index_books, uses_full_text
+
+FIELDS = ('title', 'author', 'publisher', 'publication_year', 'edition', 'isbn',
+          'category', 'subcategory', 'description')
+
+# request content types and file extensions of the accepted formats
+MIMETYPES = {
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'text/csv': 'csv',
+}
+EXTENSIONS = {
+    '.json': 'json',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+}
+
+
+def format_for_path(path):
+    """Return the import format implied by a file name, defaulting to JSON"""
+
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower(), 'json')
+
+
+def read_rows(lines, fmt):
+    """Yield (row number, record) pairs from an iterable of text lines.
+
+    CSV and NDJSON are read one line at a time. NDJSON lines are decoded by
+    clean_row so that a malformed line only fails its own row. A JSON array
+    has to be read whole; a body that is not one raises ValueError."""
+
+    if fmt == 'csv':
+        for number, record in enumerate(csv.DictReader(lines), 1):
+            yield number, record
+    elif fmt == 'ndjson':
+        lines = (line for line in lines if line.strip())
+        for number, line in enumerate(lines, 1):
+            yield number, line
+    else:
+        records = json.loads(''.join(lines))
+        if not isinstance(records, list):
+            raise ValueError('Expected a JSON array of books')
+        for number, record in enumerate(records, 1):
+            yield number, record
+
+
+def clean_row(record):
+    """Return the column values to store for a record, or raise ValueError"""
+
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except ValueError:
+            raise ValueError('The row is not valid JSON')
+    if not isinstance(record, dict):
+        raise ValueError('Each book must be an object')
+
+    row = {}
+    for field in FIELDS:
+        value = record.get(field)
+        row[field] = (str(value).strip() or None) if value is not None else None
+    if not row['title']:
+        raise ValueError('You must provide at least the title of the book')
+
+    available = record.get('available')
+    try:
+        row['available'] = 1 if available in (None, '') else int(available)
+    except (TypeError, ValueError):
+        row['available'] = 0
+    if row['available'] < 1:
+        raise ValueError('The available copies must be a positive whole number')
+    return row
+
+
+def import_books(records, batch_size=500):
+    """Add books from (row number, record) pairs, committing once per batch.
+
+    Books whose isbn is already catalogued have their available count raised
+    instead. Rows that are invalid or cannot be written are reported in the
+    returned summary and skipped without stopping the import."""
+
+    summary = {'created': 0, 'updated': 0, 'failed': 0, 'errors': []}
+    batch = []
+    for number, record in records:
+        try:
+            batch.append((number, clean_row(record)))
+        except ValueError as error:
+            summary['errors'].append({'row': number, 'error': str(error)})
+        if len(batch) == batch_size:
+            write_batch(batch, summary)
+            batch = []
+    if batch:
+        write_batch(batch, summary)
+    summary['failed'] = len(summary['errors'])
+    return summary
+
+
+def write_batch(batch, summary):
+    """Store a batch of (row number, row) pairs in one transaction"""
+
+    try:
+        created = upsert_books(db.session.connection(), [row for _, row in batch])[0]
+        db.session.commit()
+    except SQLAlchemyError as error:
+        db.session.rollback()
+        if len(batch) == 1:
+            summary['errors'].append({'row': batch[0][0],
+                                      'error': str(getattr(error, 'orig', error))})
+        else:
+            # find the offending rows by writing the batch one row at a time
+            for item in batch:
+                write_batch([item], summary)
+        return
+
+    summary['created'] += created
+    summary['updated'] += len(batch) - created
+    catalogue_cache.invalidate()
+
+
+def upsert_books(connection, rows):
+    """Insert rows as books, adding copies to books with the same isbn.
+
+    Returns the number of books created and the ids of the updated books."""
+
+    now = clock.now()
+    books = []
+    by_isbn = {}
+    for row in rows:
+        isbn = row['isbn']
+        if isbn is not None and isbn in by_isbn:
+            # a statement may only change each row once, so merge duplicates
+            by_isbn[isbn]['available'] += row['available']
+            continue
+        book = dict(row, added=now)
+        books.append(book)
+        if isbn is not None:
+            by_isbn[isbn] = book
+
+    if connection.dialect.name == 'postgresql':
+        return upsert_postgresql(connection, books, now)
+    return upsert_batched(connection, books, now)
+
+
+def upsert_postgresql(connection, books, now):
+    table = Book.__table__
+    statement = postgresql.insert(table).values(books)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.isbn],
+        set_={'available': table.c.available + statement.excluded.available, 'modified': now}
+    )
+    # xmax is only zero for a freshly inserted row version
+    result = connection.execute(statement.returning(table.c.id, literal_column('xmax = 0')))
+    rows = result.fetchall()
+    return (sum(1 for _, inserted in rows if inserted),
+            [book_id for book_id, inserted in rows if not inserted])
+
+
+def upsert_batched(connection, books, now):
+    table = Book.__table__
+    isbns = [book['isbn'] for book in books if book['isbn'] is not None]
+    existing = {}
+    if isbns:
+        matches = select([table.c.isbn, table.c.id]).where(table.c.isbn.in_(isbns))
+        existing = {isbn: book_id for isbn, book_id in connection.execute(matches)}
+
+    updates = [{'copy_isbn': book['isbn'], 'copies': book['available']}
+               for book in books if book['isbn'] in existing]
+    if updates:
+        connection.execute(
+            table.update().where(table.c.isbn == bindparam('copy_isbn')).values(
+                available=table.c.available + bindparam('copies'), modified=now),
+            updates
+        )
+
+    created = [book for book in books if book['isbn'] not in existing]
+    for book in created:
+        book['id'] = connection.execute(table.insert(), book).inserted_primary_key[0]
+    if created and not uses_full_text(connection):
+        index_books(connection, [SimpleNamespace(**book) for book in created])
+    return len(created), list(existing.values())
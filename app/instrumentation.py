@@ -0,0 +1,251 @@
+"""Opt-in request instrumentation.
+
+When INSTRUMENTATION_ENABLED is set every request records its wall time, the
+number and duration of its SQL statements and the time spent encoding JSON
+and hashing passwords. Slow requests and queries are logged and per endpoint
+aggregates are exposed in the Prometheus text format. Aggregates are kept per
+process, so with several workers each scrape sees the worker that served it.
+
+Admins can profile a request with cProfile by sending an ``X-Profile``
+header; PROFILE_SAMPLE_RATE additionally profiles a fraction of all requests.
+"""
+
+import contextlib
+import cProfile
+import os
+import random
+import tempfile
+import threading
+import time
+from flask import g, has_request_context, request
+from flask_jwt_extended import get_jwt_claims, verify_jwt_in_request_optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# upper bounds, in seconds, of the request duration histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# per request timers and the Prometheus counters they are added to
+TIMERS = (
+    ('sql', 'hellobooks_sql_seconds_total', 'Time spent executing SQL statements'),
+    ('json', 'hellobooks_json_seconds_total', 'Time spent encoding JSON'),
+    ('hashing', 'hellobooks_password_hash_seconds_total', 'Time spent hashing passwords'),
+)
+
+# connection pool statistics (see app.database.InstrumentedQueuePool)
+POOL_METRICS = (
+    ('size', 'hellobooks_db_pool_size', 'gauge', 'Connections kept open by the pool'),
+    ('checked_out', 'hellobooks_db_pool_checked_out', 'gauge', 'Connections currently in use'),
+    ('checked_in', 'hellobooks_db_pool_checked_in', 'gauge', 'Idle connections in the pool'),
+    ('overflow', 'hellobooks_db_pool_overflow', 'gauge',
+     'Connections open beyond the pool size'),
+    ('checkouts', 'hellobooks_db_pool_checkouts_total', 'counter', 'Connections handed out'),
+    ('timeouts', 'hellobooks_db_pool_timeouts_total', 'counter',
+     'Checkouts that timed out waiting for a connection'),
+    ('wait_seconds', 'hellobooks_db_pool_wait_seconds_total', 'counter',
+     'Time spent waiting for a connection'),
+)
+
+
+class EndpointStats:
+    """Aggregated measurements of the requests to one endpoint"""
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.duration = 0.0
+        self.statuses = {}
+        self.statements = 0
+        self.timers = {name: 0.0 for name, _, _ in TIMERS}
+
+    def add(self, duration, status, measurements):
+        for index, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                self.buckets[index] += 1
+        self.count += 1
+        self.duration += duration
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.statements += measurements['statements']
+        for name in self.timers:
+            self.timers[name] += measurements[name]
+
+
+class Instrumentation:
+    """Collects per request measurements for the application"""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['INSTRUMENTATION_ENABLED']
+        self.endpoints = {}
+        app.extensions['instrumentation'] = self
+        if not self.enabled:
+            return
+        self.slow_request = app.config['SLOW_REQUEST_THRESHOLD']
+        self.slow_query = app.config['SLOW_QUERY_THRESHOLD']
+        self.sample_rate = app.config['PROFILE_SAMPLE_RATE']
+        self.profile_dir = app.config['PROFILE_DIR'] or tempfile.gettempdir()
+        self.logger = app.logger
+        # statements are timed on every engine, whichever app created it
+        if not event.contains(Engine, 'before_cursor_execute', start_query):
+            event.listen(Engine, 'before_cursor_execute', start_query)
+            event.listen(Engine, 'after_cursor_execute', finish_query)
+        app.json_encoder = timed_encoder(app.json_encoder)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.teardown_request(self.teardown_request)
+
+    def start_request(self):
+        g.instrument = {'start': time.perf_counter(), 'statements': 0,
+                        'sql': 0.0, 'json': 0.0, 'hashing': 0.0}
+        if self.should_profile():
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def should_profile(self):
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        if 'X-Profile' not in request.headers:
+            return False
+        try:
+            verify_jwt_in_request_optional()
+            return bool(get_jwt_claims().get('is_admin', False))
+        except Exception:
+            return False
+
+    def finish_request(self, response):
+        measurements = g.pop('instrument', None)
+        if measurements is None:
+            return response
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            response.headers['X-Profile-File'] = self.save_profile(profiler)
+
+        duration = time.perf_counter() - measurements['start']
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        with self.lock:
+            stats = self.endpoints.setdefault((endpoint, request.method), EndpointStats())
+            stats.add(duration, response.status_code, measurements)
+        if duration >= self.slow_request:
+            self.logger.warning(
+                'Slow request: %s %s took %.1fms (%d SQL statements in %.1fms)',
+                request.method, request.full_path, duration * 1000,
+                measurements['statements'], measurements['sql'] * 1000)
+        return response
+
+    def teardown_request(self, exc):
+        # requests that failed with an exception never reach finish_request
+        g.pop('instrument', None)
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+    def save_profile(self, profiler):
+        path = os.path.join(self.profile_dir, 'hellobooks-{}-{}.prof'.format(
+            request.endpoint, int(time.time() * 1000)))
+        profiler.dump_stats(path)
+        return path
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        """Add the time spent in the block to the current request's timer"""
+
+        if not (self.enabled and has_request_context() and 'instrument' in g):
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            g.instrument[name] += time.perf_counter() - start
+
+    def record_query(self, statement, duration):
+        if has_request_context() and 'instrument' in g:
+            g.instrument['statements'] += 1
+            g.instrument['sql'] += duration
+        if duration >= self.slow_query:
+            self.logger.warning('Slow query took %.1fms: %s', duration * 1000, statement)
+
+    def render(self, pool=None):
+        """Return the aggregates in the Prometheus text exposition format.
+
+        pool is an optional dictionary of connection pool statistics"""
+
+        lines = []
+
+        def metric(name, kind, description):
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} {}'.format(name, kind))
+
+        def sample(name, labels, value):
+            lines.append('{}{{{}}} {}'.format(
+                name, ','.join('{}="{}"'.format(*label) for label in labels), value))
+
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+
+            metric('hellobooks_request_duration_seconds', 'histogram', 'Request wall time')
+            for (endpoint, method), stats in endpoints:
+                labels = [('endpoint', endpoint), ('method', method)]
+                for bound, count in zip(BUCKETS, stats.buckets):
+                    sample('hellobooks_request_duration_seconds_bucket',
+                           labels + [('le', bound)], count)
+                sample('hellobooks_request_duration_seconds_bucket',
+                       labels + [('le', '+Inf')], stats.count)
+                sample('hellobooks_request_duration_seconds_sum', labels, stats.duration)
+                sample('hellobooks_request_duration_seconds_count', labels, stats.count)
+
+            metric('hellobooks_requests_total', 'counter', 'Requests by response status')
+            for (endpoint, method), stats in endpoints:
+                for status, count in sorted(stats.statuses.items()):
+                    sample('hellobooks_requests_total', [('endpoint', endpoint),
+                                                         ('method', method),
+                                                         ('status', status)], count)
+
+            metric('hellobooks_sql_statements_total', 'counter', 'SQL statements executed')
+            for (endpoint, method), stats in endpoints:
+                sample('hellobooks_sql_statements_total',
+                       [('endpoint', endpoint), ('method', method)], stats.statements)
+
+            for name, counter, description in TIMERS:
+                metric(counter, 'counter', description)
+                for (endpoint, method), stats in endpoints:
+                    sample(counter, [('endpoint', endpoint), ('method', method)],
+                           stats.timers[name])
+
+        if pool is not None:
+            for key, name, kind, description in POOL_METRICS:
+                metric(name, kind, description)
+                lines.append('{} {}'.format(name, pool[key]))
+        return '\n'.join(lines) + '\n'
+
+
+def timed_encoder(encoder):
+    """Return a subclass of a JSON encoder class that times its encoding"""
+
+    class TimedJSONEncoder(encoder):
+        def encode(self, o):
+            with instrumentation.timed('json'):
+                return super().encode(o)
+
+    return TimedJSONEncoder
+
+
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def finish_query(conn, cursor, statement, parameters, context, executemany):
+    if conn.info.get('query_start'):
+        duration = time.perf_counter() - conn.info['query_start'].pop()
+        if instrumentation.enabled:
+            instrumentation.record_query(statement, duration)
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,70 @@
+"""Background jobs run by the scheduler"""
+
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import tuple_
+from app.app import db
+from app.archive import archive_loans
+from app.mailer import outbox_record
+from app.models import BorrowLog, PasswordReset, User
+from app.revocation import blacklist
+from app.scheduler import scheduler
+
+
+def overdue_reminder(email, title, expected_return):
+    """Build the reminder sent for an overdue book"""
+
+    message = Message(subject='Overdue book: {}'.format(title), recipients=[email])
+    message.body = '"{}" was due back on {:%d %B %Y}. Please return it to the library ' \
+                   'as soon as possible.'.format(title, expected_return)
+    return message
+
+
+@scheduler.job('overdue_reminders', 'OVERDUE_SCAN_INTERVAL')
+def queue_overdue_reminders(now, state):
+    """Queue a reminder for every loan that became overdue since the last scan.
+
+    Open loans are read in (expected_return, borrow_id) order, one batch per
+    transaction, and the key of the last one is stored with the batch as the
+    job's high-water mark. Every loan is therefore reminded about once, even
+    if a scan is interrupted. Returns the number of reminders queued."""
+
+    batch_size = current_app.config['OVERDUE_SCAN_BATCH_SIZE']
+    key = tuple_(BorrowLog.expected_return, BorrowLog.borrow_id)
+    queued = 0
+    while True:
+        query = BorrowLog.overdue(now).join(User, User.id == BorrowLog.user_id).with_entities(
+            BorrowLog.expected_return, BorrowLog.borrow_id, BorrowLog.book_title, User.email)
+        if state.mark_time is not None:
+            query = query.filter(key > tuple_(state.mark_time, state.mark_id))
+        rows = query.order_by(BorrowLog.expected_return, BorrowLog.borrow_id).limit(
+            batch_size).all()
+        for expected_return, _, title, email in rows:
+            db.session.add(outbox_record(overdue_reminder(email, title, expected_return), now))
+        if rows:
+            state.mark_time, state.mark_id = rows[-1][:2]
+        db.session.commit()
+        queued += len(rows)
+        if len(rows) < batch_size:
+            return queued
+
+
+@scheduler.job('archive_loans', 'ARCHIVE_INTERVAL')
+def archive_returned_loans(now, state):
+    """Move loans returned long ago out of borrow_log"""
+
+    return archive_loans(now)
+
+
+@scheduler.job('purge_revoked_tokens', 'PURGE_INTERVAL')
+def purge_revoked_tokens(now, state):
+    """Remove revoked tokens that have expired anyway"""
+
+    return blacklist.purge(now)
+
+
+@scheduler.job('purge_password_resets', 'PURGE_INTERVAL')
+def purge_password_resets(now, state):
+    """Remove password resets that were never confirmed"""
+
+    return PasswordReset.purge(now)
@@ -0,0 +1,122 @@
+"""Background delivery of outgoing email through the mail_outbox table"""
+
+import datetime
+import smtplib
+import time
+from flask import current_app
+from flask_mail import Message
+from app.app import db, mail
+from app.models import OutgoingMail
+
+
+def enqueue(message):
+    """Queue a flask_mail Message for delivery and return the outbox record.
+
+    With MAIL_OUTBOX_EAGER set the outbox is drained immediately, which is
+    how the tests see the message without running a worker."""
+
+    record = outbox_record(message)
+    db.session.add(record)
+    db.session.commit()
+    if current_app.config['MAIL_OUTBOX_EAGER']:
+        deliver_pending()
+    return record
+
+
+def outbox_record(message, now=None):
+    """Build the outbox record queueing a flask_mail Message for delivery"""
+
+    now = now or datetime.datetime.utcnow()
+    return OutgoingMail(
+        sender=message.sender,
+        recipients=','.join(message.recipients),
+        subject=message.subject,
+        body=message.body,
+        html=message.html,
+        queued=now,
+        next_attempt=now,
+        attempts=0
+    )
+
+
+def to_message(record):
+    """Build a flask_mail Message from an outbox record"""
+
+    return Message(subject=record.subject,
+                   recipients=record.recipients.split(','),
+                   body=record.body,
+                   html=record.html,
+                   sender=record.sender)
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next delivery attempt (exponential backoff)"""
+
+    backoff = current_app.config['MAIL_RETRY_BACKOFF']
+    return min(backoff * 2 ** (attempts - 1), current_app.config['MAIL_RETRY_MAX_DELAY'])
+
+
+def deliver_pending(now=None):
+    """Send due emails over a single SMTP connection.
+
+    Rows are locked with SKIP LOCKED where the database supports it so that
+    several workers can drain the outbox at the same time. Failed messages
+    are rescheduled with exponential backoff until MAIL_MAX_ATTEMPTS is
+    reached. Returns a (sent, failed) tuple."""
+
+    config = current_app.config
+    now = now or datetime.datetime.utcnow()
+    pending = OutgoingMail.query.filter(
+        OutgoingMail.sent.is_(None),
+        OutgoingMail.attempts < config['MAIL_MAX_ATTEMPTS'],
+        OutgoingMail.next_attempt <= now
+    ).order_by(OutgoingMail.next_attempt).limit(
+        config['MAIL_OUTBOX_BATCH_SIZE']).with_for_update(skip_locked=True).all()
+    if not pending:
+        db.session.commit()
+        return 0, 0
+
+    handled = set()
+    try:
+        with mail.connect() as connection:
+            for record in pending:
+                try:
+                    connection.send(to_message(record))
+                except smtplib.SMTPServerDisconnected:
+                    raise
+                except Exception as e:
+                    record_failure(record, e, now)
+                else:
+                    record.attempts += 1
+                    record.sent = datetime.datetime.utcnow()
+                handled.add(record.id)
+    except (smtplib.SMTPException, OSError) as e:
+        # the connection itself failed, retry everything not yet attempted
+        for record in pending:
+            if record.id not in handled:
+                record_failure(record, e, now)
+    db.session.commit()
+    sent = len([record for record in pending if record.sent])
+    return sent, len(pending) - sent
+
+
+def record_failure(record, error, now):
+    """Schedule another delivery attempt for record"""
+
+    record.attempts += 1
+    record.last_error = str(error)[:255]
+    record.next_attempt = now + datetime.timedelta(seconds=retry_delay(record.attempts))
+
+
+def run_worker(app, interval=None, stop=None):
+    """Keep delivering queued emails until stop (a threading.Event) is set"""
+
+    interval = interval or app.config['MAIL_WORKER_INTERVAL']
+    while not (stop and stop.is_set()):
+        with app.app_context():
+            try:
+                sent, failed = deliver_pending()
+            finally:
+                db.session.remove()
+        if not sent and not failed:
+            time.sleep(interval)
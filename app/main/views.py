@@ -1,13 +1,27 @@
 """Main application views"""
 
-from flask import request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models import Book, User, BorrowLog
-from app.decorators import admin_required, allow_pagination
-import datetime
+from flask import request, jsonify, current_app, Response
+import codecs
+import csv
+from flask_jwt_extended import jwt_required
+from sqlalchemy.exc import IntegrityError
+from app.models import Book, BorrowLog, book_serializer, borrow_history_serializer, \
+    borrow_log_serializer
+from app.decorators import admin_required, allow_pagination, cache_catalogue, \
+    conditional_get, read_from_replica, statement_timeout
 from . import main
 from app.endpoints import Main
-from app.utils import return_book
+from app.utils import return_book, borrow_books, return_books, get_paginated, \
+    page_number_url
+from app.identity import get_current_user
+from app.cache import catalogue_cache
+from app.clock import clock
+from app.instrumentation import instrumentation
+from app.app import db
+from app.database import pool_stats
+from app.search import search
+from app.stats import REPORTS
+from app.importer import MIMETYPES, import_books, read_rows
 
 
 @main.route(Main.ADD_BOOK, methods=['POST'])
@@ -20,29 +34,81 @@ def add_book():
     data = request.data
     if not data or not data.get('title'):
         return jsonify(msg='You must provide at least the title of the book'), 400
-    similar = Book.query.filter_by(isbn=data.get('isbn')).first()
-    if similar and similar.isbn:
-        similar.available += 1
-        similar.save()
+    isbn = data.get('isbn') or None
+    if isbn and Book.add_copy(isbn):
         return jsonify(msg='You have successfully added this book'), 201
     new_book.populate(data)
-    new_book.added = datetime.datetime.utcnow()
-    new_book.save()
+    new_book.isbn = isbn
+    new_book.added = clock.now()
+    try:
+        new_book.save()
+    except IntegrityError:
+        # a concurrent request created the book first, count this one as a copy
+        db.session.rollback()
+        if isbn and Book.add_copy(isbn):
+            return jsonify(msg='You have successfully added this book'), 201
+        return jsonify(msg='Another book already has this ISBN'), 409
     return jsonify(msg='You have successfully added this book',
                    details=new_book.serialize()), 201
 
 
+@main.route(Main.BULK_ADD_BOOKS, methods=['POST'])
+@jwt_required
+@admin_required
+@statement_timeout('BULK_IMPORT_STATEMENT_TIMEOUT')
+def bulk_add_books():
+    """Add many books from a JSON array, NDJSON or CSV request body"""
+
+    fmt = MIMETYPES.get(request.mimetype)
+    if fmt is None:
+        return jsonify(msg='Please send the books as JSON, NDJSON or CSV'), 415
+    lines = codecs.iterdecode(request.stream, 'utf-8')
+    try:
+        summary = import_books(read_rows(lines, fmt),
+                               batch_size=current_app.config['BULK_IMPORT_BATCH_SIZE'])
+    except (ValueError, csv.Error) as error:
+        return jsonify(msg='The books could not be read: {}'.format(error)), 400
+    return jsonify(msg='Added {created} new books and {updated} copies of existing books, '
+                       '{failed} rows failed'.format(**summary), **summary), 200
+
+
 @main.route(Main.ALL_BOOKS, methods=['GET'])
+@read_from_replica
 @allow_pagination
+@conditional_get
+@cache_catalogue
 def get_all_books():
     """Retrieve all books stored in the library"""
 
-    all_books = Book.get_all()
-    if not all_books:
-        return jsonify({'msg': 'There were no books found'}), 404
+    return get_paginated(book_serializer.rows(Book.query), Book.id, book_serializer.from_row,
+                         empty_msg='There were no books found')
 
-    result = [book.serialize() for book in all_books]
-    return jsonify(result), 200
+
+@main.route(Main.SEARCH, methods=['GET'])
+@read_from_replica
+@statement_timeout('SEARCH_STATEMENT_TIMEOUT')
+def search_books():
+    """Search the catalogue by title, author, publisher, category and description"""
+
+    limit = request.args.get('limit', '20')
+    page = request.args.get('page', '1')
+    if not (limit.isdigit() and 0 < int(limit) <= current_app.config['SEARCH_MAX_LIMIT']):
+        return jsonify(msg='Please make sure that the limit parameter is valid'), 400
+    if not (page.isdigit() and int(page) > 0):
+        return jsonify(msg='Please make sure that the page parameter is valid'), 400
+    limit, page = int(limit), int(page)
+
+    books, total, facets = search(request.args.get('q'),
+                                  category=request.args.get('category'),
+                                  subcategory=request.args.get('subcategory'),
+                                  limit=limit, offset=(page - 1) * limit)
+    return jsonify(
+        results=[book.serialize() for book in books],
+        count=total,
+        facets=facets,
+        previous=page_number_url(page - 1) if page > 1 else 'None',
+        next=page_number_url(page + 1) if page * limit < total else 'None'
+    ), 200
 
 
 @main.route(Main.MODIFY_BOOK, methods=['PUT', 'DELETE'])
@@ -62,20 +128,31 @@ def book_update_delete(book_id):
     elif request.method == 'PUT':
         data = request.data
         book.populate(data)
-        book.modified = datetime.datetime.utcnow()
-        book.save()
+        if 'isbn' in data:
+            book.isbn = data.get('isbn') or None
+        book.modified = clock.now()
+        try:
+            book.save()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify(msg='Another book already has this ISBN'), 409
         return jsonify(msg='You have successfully edited this book',
                        details=book.serialize()), 200
 
 
 @main.route(Main.GET_BOOK, methods=['GET'])
+@read_from_replica
+@conditional_get
+@cache_catalogue
 def retrieve_book(book_id):
     """Retrieve a book using its book id"""
 
     book = Book.get_by_id(book_id)
     if not book:
         return jsonify({'msg': 'The requested book was not found'}), 404
-    return jsonify(book.serialize()), 200
+    response = jsonify(book.serialize())
+    response.last_modified = book.modified or book.added
+    return response, 200
 
 
 @main.route(Main.BORROW, methods=['POST', 'PUT'])
@@ -83,8 +160,7 @@ def retrieve_book(book_id):
 def borrow_and_return(book_id):
     """Borrow or return a book from the library"""
 
-    current_user_email = get_jwt_identity()
-    user = User.get_by_email(current_user_email)
+    user = get_current_user()
     book = Book().get_by_id(book_id)
 
     if not book:
@@ -94,10 +170,12 @@ def borrow_and_return(book_id):
     if request.method == 'POST':
         if not book.is_available():
             return jsonify({'msg': 'This book has already been borrowed'}), 409
-        book_record = BorrowLog.query.filter_by(user_id=user.id, book_id=book.id, returned=False).first()
+        book_record = BorrowLog.open_records(book.id, user.id).first()
         if book_record:
             return jsonify(msg='You cannot borrow the same book twice'), 403
         borrow_info = user.borrow_book(book)
+        if not borrow_info:
+            return jsonify({'msg': 'This book has already been borrowed'}), 409
         return jsonify(msg='You have successfully borrowed this book',
                        details=borrow_info), 200
 
@@ -107,35 +185,113 @@ def borrow_and_return(book_id):
         return jsonify(msg=result['message']), result['status_code']
 
 
+@main.route(Main.BATCH_BORROW, methods=['POST', 'PUT'])
+@jwt_required
+def batch_borrow_and_return():
+    """Borrow or return several books in one transaction"""
+
+    book_ids = request.data.get('book_ids') if isinstance(request.data, dict) else None
+    if not (isinstance(book_ids, list) and book_ids and
+            all(isinstance(book_id, int) and not isinstance(book_id, bool)
+                for book_id in book_ids)):
+        return jsonify(msg='Please provide a list of book ids'), 400
+    if len(book_ids) > current_app.config['BATCH_MAX_BOOKS']:
+        return jsonify(msg='You can only process {} books at a time'.format(
+            current_app.config['BATCH_MAX_BOOKS'])), 400
+
+    user = get_current_user()
+    if request.method == 'POST':
+        outcomes = borrow_books(user, book_ids)
+        msg = 'You have successfully borrowed {} of {} books'
+    else:
+        outcomes = return_books(user, book_ids)
+        msg = 'You have successfully returned {} of {} books'
+    done = sum(1 for outcome in outcomes if outcome['status_code'] == 200)
+    return jsonify(msg=msg.format(done, len(outcomes)), results=outcomes), 200
+
+
 @main.route(Main.BORROWING_HISTORY, methods=['GET'])
 @jwt_required
+@read_from_replica
 @allow_pagination
 def borrowing_history():
     """Retrieve borrowing history and un-returned books"""
 
-    current_user_email = get_jwt_identity()
-    user = User().get_by_email(current_user_email)
+    user = get_current_user()
     returned = request.args.get('returned')
 
     # get un-returned books
     if returned == 'false':
-        return jsonify(user.get_unreturned()), 200
+        return get_paginated(book_serializer.rows(user.get_unreturned()), Book.id,
+                             book_serializer.from_row,
+                             empty_msg='You do not have any un-returned books')
 
     # get borrowing history
     else:
-        if not user.get_borrowing_history():
-            return jsonify({'msg': 'You do not have any borrowing history'}), 404
-        else:
-            return jsonify(user.get_borrowing_history()), 200
+        return get_paginated(BorrowLog.history_rows(borrow_history_serializer, user.id),
+                             (BorrowLog.borrow_timestamp, BorrowLog.borrow_id),
+                             borrow_history_serializer.from_row,
+                             empty_msg='You do not have any borrowing history')
 
 
 @main.route('/api/v1/users/all/', methods=['GET'])
 @jwt_required
 @admin_required
+@read_from_replica
 @allow_pagination
 def all_borrowed_books():
     """Returns all borrowed books"""
 
-    borrowed_books = BorrowLog.query.all()
-    results = [book.serialize() for book in borrowed_books]
-    return jsonify(results), 200
+    return get_paginated(BorrowLog.history_rows(borrow_log_serializer),
+                         (BorrowLog.borrow_timestamp, BorrowLog.borrow_id),
+                         borrow_log_serializer.from_row)
+
+
+@main.route(Main.OVERDUE, methods=['GET'])
+@jwt_required
+@admin_required
+@read_from_replica
+@allow_pagination
+def overdue_books():
+    """Returns the borrowed books that are past their expected return date"""
+
+    return get_paginated(borrow_log_serializer.rows(BorrowLog.overdue(clock.now())),
+                         (BorrowLog.expected_return, BorrowLog.borrow_id),
+                         borrow_log_serializer.from_row,
+                         empty_msg='There are no overdue books')
+
+
+@main.route(Main.REPORTS, methods=['GET'])
+@jwt_required
+@admin_required
+@read_from_replica
+def circulation_report(report):
+    """Return one of the circulation reports"""
+
+    if report not in REPORTS:
+        return jsonify(msg='The requested report was not found'), 404
+    limit = request.args.get('limit', '10')
+    if not (limit.isdigit() and 0 < int(limit) <= current_app.config['REPORT_MAX_LIMIT']):
+        return jsonify(msg='Please make sure that the limit parameter is valid'), 400
+    return jsonify(REPORTS[report](int(limit))), 200
+
+
+@main.route(Main.CACHE_STATS, methods=['GET'])
+@jwt_required
+@admin_required
+def cache_stats():
+    """Returns catalogue cache hit and miss counters"""
+
+    return jsonify(catalogue_cache.stats()), 200
+
+
+@main.route(Main.METRICS, methods=['GET'])
+@jwt_required
+@admin_required
+def metrics():
+    """Returns per endpoint request metrics in the Prometheus text format"""
+
+    if not instrumentation.enabled:
+        return jsonify(msg='Instrumentation is not enabled'), 404
+    return Response(instrumentation.render(pool_stats(db.engine)),
+                    mimetype='text/plain; version=0.0.4')
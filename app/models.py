@@ -1,13 +1,16 @@
 """Contains the models used by the application"""
 
-from werkzeug.security import check_password_hash, generate_password_hash
 from flask import current_app
+from sqlalchemy import and_, false, true
+from sqlalchemy.dialects import postgresql
 import datetime
+import hashlib
 import uuid
 from app.app import db
-
-
-now = datetime.datetime.utcnow()
+from app.cache import catalogue_cache
+from app.clock import clock, utcnow
+from app.passwords import hasher
+from app.serializers import Serializer
 
 
 def generate_uuid():
@@ -20,6 +23,7 @@ class Book(db.Model):
     """Class containing all the book information"""
 
     __tablename__ = 'books'
+    __table_args__ = (db.UniqueConstraint('isbn', name='uq_books_isbn'),)
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String)
@@ -31,17 +35,19 @@ class Book(db.Model):
     category = db.Column(db.String)
     subcategory = db.Column(db.String)
     description = db.Column(db.String)
-    added = db.Column(db.DateTime)
-    modified = db.Column(db.DateTime)
+    added = db.Column(db.DateTime, index=True)
+    modified = db.Column(db.DateTime, index=True)
     available = db.Column(db.Integer, default=1)
 
     def save(self):
         db.session.add(self)
         db.session.commit()
+        catalogue_cache.invalidate()
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        catalogue_cache.invalidate()
 
     def populate(self, dict_obj):
         """Populate attributes with dictionary values"""
@@ -68,18 +74,45 @@ class Book(db.Model):
     def get_all():
         return Book.query.all()
 
+    @staticmethod
+    def get_by_isbn(isbn):
+        """Return the book with a given isbn"""
+
+        return Book.query.filter_by(isbn=isbn).first()
+
+    @staticmethod
+    def add_copy(isbn):
+        """Add a copy to the book with a given isbn in a single UPDATE.
+
+        Returns False if there is no such book"""
+
+        added = Book.query.filter_by(isbn=isbn).update(
+            {Book.available: Book.available + 1, Book.modified: clock.now()},
+            synchronize_session=False)
+        db.session.commit()
+        if added:
+            catalogue_cache.invalidate()
+        return bool(added)
+
     def serialize(self):
         """Returns a dictionary containing book information"""
 
-        return {
-            column.key: str(getattr(self, column.key))
-            for column in self.__table__.columns
-        }
+        return book_serializer(self)
 
     def __repr__(self):
         return '<Book: {}>'.format(self.title)
 
 
+class BookTerm(db.Model):
+    """class containing the inverted search index used without full-text search"""
+
+    __tablename__ = 'book_terms'
+
+    term = db.Column(db.String, primary_key=True)
+    book_id = db.Column(db.Integer, primary_key=True, index=True)
+    weight = db.Column(db.Integer)
+
+
 class User(db.Model):
     """class containing all the user information"""
 
@@ -91,17 +124,22 @@ class User(db.Model):
     email = db.Column(db.String, unique=True)
     password = db.Column(db.String)
     is_admin = db.Column(db.Boolean, default=False)
-    borrowed_books = db.relationship('BorrowLog', backref='user')
+    borrowed_books = db.relationship('BorrowLog', backref='user', lazy='dynamic')
 
     def set_password(self, password):
         """Generate a password hash"""
 
-        self.password = generate_password_hash(password)
+        self.password = hasher.hash(password)
 
     def check_password(self, password):
         """Check if the entered password and the stored password are the same"""
 
-        return check_password_hash(self.password, password)
+        return hasher.verify(self.password, password)
+
+    def password_needs_rehash(self):
+        """Check if the stored hash was made with outdated parameters"""
+
+        return hasher.needs_rehash(self.password)
 
     def save(self):
         """Save to database"""
@@ -110,50 +148,65 @@ class User(db.Model):
         db.session.commit()
 
     def borrow_book(self, book):
-        """Borrow a book"""
+        """Borrow a book.
+
+        The book's available count is decremented with a conditional UPDATE in
+        the same transaction as the borrowing record, so concurrent borrowers
+        can never take more copies than exist. Returns None if no copy was left.
+        """
+
+        record = self.checkout(book)
+        if record is None:
+            db.session.rollback()
+            return None
+        db.session.commit()
+        catalogue_cache.invalidate()
+        return record.details()
+
+    def checkout(self, book):
+        """Take a copy of book and add its borrowing record to the session.
+
+        Nothing is committed, so several books can be borrowed in one
+        transaction. Returns None, changing nothing, if no copy was left."""
+
+        period = current_app.config['BOOK_RETURN_PERIOD']
+        if current_app.config['DATABASE_TIMESTAMPS']:
+            # borrow_timestamp is left to its server default
+            now, return_time = utcnow(), utcnow(days=period)
+        else:
+            now = clock.now()
+            return_time = now + datetime.timedelta(days=period)
+
+        taken = Book.query.filter(Book.id == book.id, Book.available > 0).update(
+            {Book.available: Book.available - 1, Book.modified: now},
+            synchronize_session=False)
+        if not taken:
+            return None
 
-        return_time = now + datetime.timedelta(
-            days=current_app.config['BOOK_RETURN_PERIOD'])
         record = BorrowLog(
             borrow_id=generate_uuid(),
             user_id=self.id,
             book_id=book.id,
             book_title=book.title,
-            borrow_timestamp=now,
             expected_return=return_time,
             returned=False
         )
-        book.available -= 1
-        book.save()
-        record.save()
-        return {
-            'borrow_id': record.borrow_id,
-            'borrowed_on': record.borrow_timestamp,
-            'expected_return': record.expected_return
-        }
+        if not current_app.config['DATABASE_TIMESTAMPS']:
+            record.borrow_timestamp = now
+        db.session.add(record)
+        LoanStats.record_loan(book, self)
+        return record
 
     def get_unreturned(self):
-        """Retrieve all books not yet returned"""
+        """Return a query for all books not yet returned"""
 
-        unreturned = [record.book_id
-                for record in self.borrowed_books
-                if record.user_id == self.id and not record.returned]
-        return [Book().get_by_id(id).serialize() for id in unreturned]
+        return Book.query.join(BorrowLog, BorrowLog.book_id == Book.id).filter(
+            BorrowLog.user_id == self.id, BorrowLog.returned == false())
 
     def get_borrowing_history(self):
-        """Get the user's borrowing history"""
+        """Return a query for the user's borrowing history"""
 
-        if not self.borrowed_books:
-            return False
-        else:
-            return [{
-                'borrow_id': record.borrow_id,
-                'book_id': record.book_id,
-                'title': record.book_title,
-                'borrowed_on': record.borrow_timestamp,
-                'return_status': record.returned,
-                'returned_on': record.return_timestamp
-            } for record in self.borrowed_books]
+        return self.borrowed_books
 
     @staticmethod
     def get_by_email(email):
@@ -172,22 +225,271 @@ class BorrowLog(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     book_id = db.Column(db.Integer)
     book_title = db.Column(db.String)
-    borrow_timestamp = db.Column(db.DateTime)
+    borrow_timestamp = db.Column(db.DateTime, server_default=utcnow())
     expected_return = db.Column(db.DateTime)
     return_timestamp = db.Column(db.DateTime)
     returned = db.Column(db.Boolean)
 
     def serialize(self):
-        return {
-            'borrow_id': self.borrow_id,
-            'user_id': self.user_id,
-            'book_id': self.book_id,
-            'borrowed': self.borrow_timestamp,
-            'expected_return': self.expected_return,
-            'returned': self.returned,
-            'returned_on:': self.return_timestamp
-        }
+        return borrow_log_serializer(self)
+
+    @staticmethod
+    def open_records(book_id, user_id=None):
+        """Return a query for the un-returned records of a book, optionally for one user"""
+
+        query = BorrowLog.query.filter(BorrowLog.book_id == book_id, BorrowLog.returned == false())
+        if user_id is not None:
+            query = query.filter(BorrowLog.user_id == user_id)
+        return query
+
+    @staticmethod
+    def history_rows(serializer, user_id=None):
+        """Return a query for serializer's columns of the borrowing records in
+        borrow_log and in the archive, optionally only those of one user.
+
+        Filters and ordering on BorrowLog columns added to the query apply to
+        the records of both tables."""
+
+        query, archived = BorrowLog.query, ArchivedLoan.query
+        if user_id is not None:
+            query = query.filter(BorrowLog.user_id == user_id)
+            archived = archived.filter(ArchivedLoan.user_id == user_id)
+        return serializer.rows(query).union_all(archived.with_entities(
+            *(getattr(ArchivedLoan, column.key) for column in serializer.columns)))
+
+    @staticmethod
+    def overdue(now):
+        """Return a query for the un-returned records due back before now"""
+
+        return BorrowLog.query.filter(BorrowLog.returned == false(),
+                                      BorrowLog.expected_return <= now)
+
+    def details(self):
+        """Returns the record as shown to a user who has just borrowed the book"""
+
+        return borrow_details_serializer(self)
+
+    def history(self):
+        """Returns the record as shown in a user's borrowing history"""
+
+        return borrow_history_serializer(self)
 
     def save(self):
         db.session.add(self)
         db.session.commit()
+
+
+book_serializer = Serializer((column.key, column) for column in Book.__table__.columns)
+borrow_log_serializer = Serializer([
+    ('borrow_id', BorrowLog.borrow_id),
+    ('user_id', BorrowLog.user_id),
+    ('book_id', BorrowLog.book_id),
+    ('borrowed', BorrowLog.borrow_timestamp),
+    ('expected_return', BorrowLog.expected_return),
+    ('returned', BorrowLog.returned),
+    ('returned_on:', BorrowLog.return_timestamp),
+])
+borrow_details_serializer = Serializer([
+    ('borrow_id', BorrowLog.borrow_id),
+    ('borrowed_on', BorrowLog.borrow_timestamp),
+    ('expected_return', BorrowLog.expected_return),
+])
+borrow_history_serializer = Serializer([
+    ('borrow_id', BorrowLog.borrow_id),
+    ('book_id', BorrowLog.book_id),
+    ('title', BorrowLog.book_title),
+    ('borrowed_on', BorrowLog.borrow_timestamp),
+    ('return_status', BorrowLog.returned),
+    ('returned_on', BorrowLog.return_timestamp),
+])
+
+# history pages are keyset scans in borrowing order, of one user or of
+# everyone; borrowing and returning only ever look for records that are still open
+db.Index('ix_borrow_log_user_history', BorrowLog.user_id, BorrowLog.borrow_timestamp,
+         BorrowLog.borrow_id)
+db.Index('ix_borrow_log_history', BorrowLog.borrow_timestamp, BorrowLog.borrow_id)
+db.Index('ix_borrow_log_open_user_book', BorrowLog.user_id, BorrowLog.book_id,
+         postgresql_where=BorrowLog.returned == false(),
+         sqlite_where=BorrowLog.returned == false())
+db.Index('ix_borrow_log_open_book', BorrowLog.book_id,
+         postgresql_where=BorrowLog.returned == false(),
+         sqlite_where=BorrowLog.returned == false())
+# overdue scans walk open records in (expected_return, borrow_id) order
+db.Index('ix_borrow_log_overdue', BorrowLog.returned, BorrowLog.expected_return,
+         BorrowLog.borrow_id)
+# archiving picks the records returned longest ago
+db.Index('ix_borrow_log_closed', BorrowLog.return_timestamp,
+         postgresql_where=BorrowLog.returned == true(),
+         sqlite_where=BorrowLog.returned == true())
+
+
+class ArchivedLoan(db.Model):
+    """class containing returned borrowing records moved out of borrow_log"""
+
+    __tablename__ = 'borrow_log_archive'
+
+    borrow_id = db.Column(db.String, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    book_id = db.Column(db.Integer)
+    book_title = db.Column(db.String)
+    borrow_timestamp = db.Column(db.DateTime)
+    expected_return = db.Column(db.DateTime)
+    return_timestamp = db.Column(db.DateTime)
+    returned = db.Column(db.Boolean)
+
+
+db.Index('ix_borrow_log_archive_user_history', ArchivedLoan.user_id,
+         ArchivedLoan.borrow_timestamp, ArchivedLoan.borrow_id)
+db.Index('ix_borrow_log_archive_history', ArchivedLoan.borrow_timestamp, ArchivedLoan.borrow_id)
+
+
+class LoanStats(db.Model):
+    """class containing running loan counts per book, category and user.
+
+    The counts are updated in the transaction that borrows or returns a book,
+    so reports read a few rows instead of the whole borrowing log. Totals are
+    spread over TOTAL_SHARDS rows so that every loan does not wait for the
+    same row lock."""
+
+    __tablename__ = 'loan_stats'
+
+    TOTAL_SHARDS = 8
+
+    dimension = db.Column(db.String, primary_key=True)  # book, category, user or total
+    key = db.Column(db.String, primary_key=True)
+    label = db.Column(db.String)
+    loans = db.Column(db.Integer, default=0)
+    active = db.Column(db.Integer, default=0)
+    returns = db.Column(db.Integer, default=0)
+    loan_seconds = db.Column(db.Float, default=0)
+
+    @staticmethod
+    def count(dimension, key, label=None, **increments):
+        """Add increments to the counts of a row, creating it if needed"""
+
+        table = LoanStats.__table__
+        values = {name: table.c[name] + amount for name, amount in increments.items()}
+        if label is not None:
+            values['label'] = label
+        row = dict(dimension=dimension, key=str(key), label=label, loans=0, active=0,
+                   returns=0, loan_seconds=0)
+        row.update(increments)
+
+        if db.engine.dialect.name == 'postgresql':
+            statement = postgresql.insert(table).values(row)
+            db.session.execute(statement.on_conflict_do_update(
+                index_elements=[table.c.dimension, table.c.key], set_=values))
+            return
+        updated = db.session.execute(table.update().where(and_(
+            table.c.dimension == dimension, table.c.key == str(key))).values(values))
+        if not updated.rowcount:
+            db.session.execute(table.insert().values(row))
+
+    @staticmethod
+    def record_loan(book, user):
+        LoanStats.count('book', book.id, book.title, loans=1, active=1)
+        LoanStats.count('category', book.category or '', book.category, loans=1)
+        LoanStats.count('user', user.id, user.email, loans=1, active=1)
+        LoanStats.count('total', user.id % LoanStats.TOTAL_SHARDS, loans=1, active=1)
+
+    @staticmethod
+    def record_return(record, returned_on):
+        seconds = (returned_on - record.borrow_timestamp).total_seconds() \
+            if record.borrow_timestamp else 0
+        closed = dict(active=-1, returns=1, loan_seconds=seconds)
+        LoanStats.count('book', record.book_id, **closed)
+        LoanStats.count('user', record.user_id, **closed)
+        LoanStats.count('total', record.user_id % LoanStats.TOTAL_SHARDS, **closed)
+
+
+db.Index('ix_loan_stats_loans', LoanStats.dimension, LoanStats.loans)
+db.Index('ix_loan_stats_active', LoanStats.dimension, LoanStats.active)
+
+
+class RevokedToken(db.Model):
+    """class containing the ids of revoked tokens"""
+
+    __tablename__ = 'revoked_tokens'
+
+    jti = db.Column(db.String, primary_key=True)
+    expires = db.Column(db.DateTime, index=True)
+
+
+class OutgoingMail(db.Model):
+    """class containing emails waiting to be delivered"""
+
+    __tablename__ = 'mail_outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String)
+    recipients = db.Column(db.String)
+    subject = db.Column(db.String)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    queued = db.Column(db.DateTime)
+    next_attempt = db.Column(db.DateTime, index=True)
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.String)
+    sent = db.Column(db.DateTime)
+
+
+class JobState(db.Model):
+    """class containing the schedule and progress of background jobs"""
+
+    __tablename__ = 'job_state'
+
+    name = db.Column(db.String, primary_key=True)
+    last_run = db.Column(db.DateTime)
+    next_run = db.Column(db.DateTime)
+    # high-water mark of jobs scanning a table in key order
+    mark_time = db.Column(db.DateTime)
+    mark_id = db.Column(db.String)
+
+
+class PasswordReset(db.Model):
+    """class containing password resets waiting to be confirmed"""
+
+    __tablename__ = 'password_resets'
+
+    token_hash = db.Column(db.String(64), primary_key=True)
+    email = db.Column(db.String)
+    password = db.Column(db.String)
+    expires = db.Column(db.DateTime, index=True)
+
+    @staticmethod
+    def hash_token(jti):
+        """Only a hash of the reset token id is stored"""
+
+        return hashlib.sha256(jti.encode()).hexdigest()
+
+    @staticmethod
+    def create(email, password_hash, jti, expires):
+        """Store a pending reset, purging the ones that have expired"""
+
+        PasswordReset.purge()
+        reset = PasswordReset(token_hash=PasswordReset.hash_token(jti), email=email,
+                              password=password_hash, expires=expires)
+        db.session.add(reset)
+        db.session.commit()
+        return reset
+
+    @staticmethod
+    def pop(jti):
+        """Remove and return the unexpired reset for a token id, if any"""
+
+        reset = PasswordReset.query.filter(
+            PasswordReset.token_hash == PasswordReset.hash_token(jti),
+            PasswordReset.expires > datetime.datetime.utcnow()).first()
+        if reset:
+            db.session.delete(reset)
+        return reset
+
+    @staticmethod
+    def purge(now=None):
+        """Delete expired resets. Returns the number removed"""
+
+        removed = PasswordReset.query.filter(
+            PasswordReset.expires < (now or datetime.datetime.utcnow())
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return removed
@@ -0,0 +1,90 @@
+"""Password hashing with a bounded number of concurrent hashes.
+
+PBKDF2 is deliberately slow, and a burst of logins all hashing at once
+leaves no CPU for other requests. Hashes are computed on the request thread,
+but a semaphore lets only PASSWORD_HASH_WORKERS of them run at the same
+time, and a second one lets at most PASSWORD_HASH_QUEUE more requests wait
+for their turn. A request that cannot get a place within
+PASSWORD_HASH_TIMEOUT seconds is answered with 503 Service Unavailable.
+
+Stored hashes record their method and salt. ``needs_rehash`` tells when they
+were made with other parameters than PASSWORD_HASH_METHOD and
+PASSWORD_SALT_LENGTH, so logins can upgrade them.
+"""
+
+import threading
+from flask import jsonify
+from werkzeug.security import check_password_hash, generate_password_hash
+from app.instrumentation import instrumentation
+
+
+class HashingBusy(Exception):
+    """Raised when no place to hash became free in time"""
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords with the configured parameters"""
+
+    def __init__(self, app=None):
+        self.method = 'pbkdf2:sha256:50000'
+        self.salt_length = 8
+        self.running = None
+        self.slots = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.configure(app.config)
+        app.extensions['password_hasher'] = self
+        app.register_error_handler(HashingBusy, busy)
+
+    def configure(self, config):
+        """Take the hashing parameters and limits from config"""
+
+        self.method = config['PASSWORD_HASH_METHOD']
+        self.salt_length = config['PASSWORD_SALT_LENGTH']
+        self.timeout = config['PASSWORD_HASH_TIMEOUT']
+        workers = config['PASSWORD_HASH_WORKERS']
+        if workers:
+            self.running = threading.BoundedSemaphore(workers)
+            self.slots = threading.BoundedSemaphore(workers + config['PASSWORD_HASH_QUEUE'])
+        else:
+            self.running = self.slots = None
+
+    def run(self, function, *args):
+        """Run function once a place is free, or right away without limits"""
+
+        with instrumentation.timed('hashing'):
+            if self.slots is None:
+                return function(*args)
+            if not self.slots.acquire(timeout=self.timeout):
+                raise HashingBusy()
+            try:
+                with self.running:
+                    return function(*args)
+            finally:
+                self.slots.release()
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash, password):
+        return self.run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Check if pwhash was made with other parameters than the configured ones"""
+
+        if pwhash.count('$') < 2:
+            return True
+        method, salt, _ = pwhash.split('$', 2)
+        return method != self.method or len(salt) != self.salt_length
+
+
+def busy(error):
+    response = jsonify(msg='The server is busy, please try again shortly')
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,128 @@
+"""Read replica routing.
+
+Views decorated with ``read_from_replica`` run their queries on one of the
+SQLALCHEMY_REPLICA_URIS databases (see ``app.database.RoutingSession``), while
+writes and every other view use the primary. Replicas are health checked at
+most every REPLICA_CHECK_INTERVAL seconds, and one that fails a check or a
+query is skipped until it passes again. A user who has just written is
+served from the primary for READ_YOUR_WRITES_SECONDS so that they see their
+own changes.
+"""
+
+import itertools
+import time
+from flask import current_app, g, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request_optional
+from sqlalchemy.exc import SQLAlchemyError
+from app.cache import RedisCache, TTLCache
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class Replicas:
+    """Chooses a healthy replica for read-only views"""
+
+    def __init__(self, app=None, timer=time.monotonic):
+        self.names = []
+        self.timer = timer
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        binds = dict(app.config['SQLALCHEMY_BINDS'] or {})
+        self.names = []
+        for index, uri in enumerate(app.config['SQLALCHEMY_REPLICA_URIS']):
+            name = 'replica{}'.format(index)
+            binds[name] = uri
+            self.names.append(name)
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+        self.interval = app.config['REPLICA_CHECK_INTERVAL']
+        self.max_lag = app.config['REPLICA_MAX_LAG']
+        self.health = {name: (True, None) for name in self.names}
+        self.rotation = itertools.cycle(self.names)
+        window = app.config['READ_YOUR_WRITES_SECONDS']
+        if app.config['READ_YOUR_WRITES_BACKEND'] == 'redis':
+            self.writers = RedisCache(app.config['CATALOGUE_CACHE_REDIS_URL'], ttl=window)
+        else:
+            self.writers = TTLCache(maxsize=app.config['READ_YOUR_WRITES_SIZE'], ttl=window)
+        app.extensions['replicas'] = self
+        if self.names:
+            app.after_request(self.remember_writer)
+
+    @property
+    def enabled(self):
+        return bool(self.names)
+
+    def remember_writer(self, response):
+        """Send the reads of a user who changed something to the primary for a while"""
+
+        if request.method not in READ_METHODS and response.status_code < 400:
+            identity = get_jwt_identity()
+            if identity:
+                self.writers.set('writer:{}'.format(identity), True)
+        return response
+
+    def wrote_recently(self):
+        """Check if the user making the request has written within the window"""
+
+        try:
+            # anonymous views have not read the token yet
+            verify_jwt_in_request_optional()
+        except Exception:
+            return False
+        identity = get_jwt_identity()
+        return bool(identity and self.writers.get('writer:{}'.format(identity)))
+
+    def engine(self):
+        """Return the engine of the replica serving this request, or None for the primary.
+
+        Every query of a request goes to the same replica."""
+
+        if 'replica' not in g:
+            g.replica = self.choose()
+        if not g.replica:
+            return None
+        return current_app.extensions['sqlalchemy'].db.get_engine(current_app, bind=g.replica)
+
+    def choose(self):
+        for _ in self.names:
+            name = next(self.rotation)
+            if self.is_healthy(name):
+                return name
+        return None
+
+    def is_healthy(self, name):
+        healthy, checked = self.health[name]
+        if checked is None or self.timer() - checked >= self.interval:
+            healthy = self.check(name)
+            self.health[name] = (healthy, self.timer())
+        return healthy
+
+    def check(self, name):
+        """Check that a replica answers and is not lagging too far behind"""
+
+        engine = current_app.extensions['sqlalchemy'].db.get_engine(current_app, bind=name)
+        try:
+            with engine.connect() as connection:
+                connection.execute('SELECT 1')
+                if self.max_lag and engine.dialect.name == 'postgresql':
+                    caught_up, lag = connection.execute(
+                        'SELECT pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn(), '
+                        'EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())').first()
+                    # the last replayed transaction gets older while the primary is idle
+                    if not caught_up and lag is not None and lag > self.max_lag:
+                        current_app.logger.warning('Replica %s is %.1fs behind', name, lag)
+                        return False
+        except SQLAlchemyError as error:
+            current_app.logger.warning('Replica %s failed its health check: %s', name, error)
+            return False
+        return True
+
+    def mark_unhealthy(self, name):
+        """Skip a replica until its next health check"""
+
+        self.health[name] = (False, self.timer())
+
+
+replicas = Replicas()
@@ -0,0 +1,106 @@
+"""Access token revocation store"""
+
+import datetime
+import time
+from app.app import db
+from app.cache import TTLCache
+from app.models import RevokedToken
+
+
+class DatabaseRevocationStore:
+    """Keeps revoked token ids in the revoked_tokens table, shared by all workers"""
+
+    def revoke(self, jti, expires):
+        db.session.merge(RevokedToken(jti=jti, expires=expires))
+        db.session.commit()
+
+    def is_revoked(self, jti):
+        return db.session.query(RevokedToken.jti).filter_by(jti=jti).first() is not None
+
+    def purge(self, now):
+        """Delete entries for tokens that have expired. Returns the number removed"""
+
+        removed = RevokedToken.query.filter(RevokedToken.expires < now).delete(
+            synchronize_session=False)
+        db.session.commit()
+        return removed
+
+
+class MemoryRevocationStore:
+    """Keeps revoked token ids in process. Only suitable for a single worker"""
+
+    def __init__(self):
+        self.revoked = {}
+
+    def revoke(self, jti, expires):
+        self.revoked[jti] = expires
+
+    def is_revoked(self, jti):
+        return jti in self.revoked
+
+    def purge(self, now):
+        expired = [jti for jti, expires in self.revoked.items() if expires and expires < now]
+        for jti in expired:
+            del self.revoked[jti]
+        return len(expired)
+
+
+class TokenBlacklist:
+    """Revoked token lookups through a bounded TTL cache in front of a store.
+
+    Revoked entries are cached until the token itself expires. Tokens found
+    not to be revoked are only cached for TOKEN_REVOCATION_CACHE_TTL seconds,
+    the longest a revocation made by another worker may go unnoticed.
+    """
+
+    stores = {
+        'database': DatabaseRevocationStore,
+        'memory': MemoryRevocationStore
+    }
+
+    def __init__(self, app=None):
+        self.store = None
+        self.cache = None
+        self.negative_ttl = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.store = self.stores[app.config['TOKEN_REVOCATION_BACKEND']]()
+        self.cache = TTLCache(maxsize=app.config['TOKEN_REVOCATION_CACHE_SIZE'])
+        self.negative_ttl = app.config['TOKEN_REVOCATION_CACHE_TTL']
+        app.extensions['token_blacklist'] = self
+
+    def revoke(self, jti, exp=None):
+        """Revoke the token with id jti that expires at the timestamp exp"""
+
+        expires = datetime.datetime.utcfromtimestamp(exp) if exp else None
+        self.store.revoke(jti, expires)
+        self.cache.set(jti, True, ttl=self.remaining(exp))
+
+    def is_revoked(self, jti, exp=None):
+        """Check whether the token with id jti has been revoked"""
+
+        revoked = self.cache.get(jti)
+        if revoked is not None:
+            return revoked
+        revoked = self.store.is_revoked(jti)
+        if revoked:
+            self.cache.set(jti, True, ttl=self.remaining(exp))
+        elif self.negative_ttl:
+            self.cache.set(jti, False, ttl=self.negative_ttl)
+        return revoked
+
+    @staticmethod
+    def remaining(exp):
+        """Seconds until the timestamp exp, None if the token never expires"""
+
+        return max(exp - time.time(), 0) if exp else None
+
+    def purge(self, now=None):
+        """Remove stored entries for tokens that have already expired"""
+
+        return self.store.purge(now or datetime.datetime.utcnow())
+
+
+blacklist = TokenBlacklist()
@@ -0,0 +1,84 @@
+"""A small scheduler running periodic background jobs.
+
+Jobs are registered with ``scheduler.job`` (see ``app.jobs``) and run by
+``python manage.py worker``. When a job is due it is claimed with a
+conditional UPDATE of its job_state row, so several workers can run side by
+side and every run still happens in one worker only.
+"""
+
+import datetime
+import time
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from app.app import db
+from app.clock import clock
+from app.models import JobState
+
+
+class Scheduler:
+    """Runs registered jobs every so many seconds"""
+
+    def __init__(self):
+        self.jobs = OrderedDict()
+
+    def job(self, name, interval_key):
+        """Decorator registering function(now, state) to run every
+        config[interval_key] seconds. state is the job's JobState row"""
+
+        def register(function):
+            self.jobs[name] = (function, interval_key)
+            return function
+        return register
+
+    def claim(self, name, now):
+        """Take the run of a job due at now. Returns False if it is not due
+        or another worker took it first"""
+
+        if JobState.query.get(name) is None:
+            db.session.add(JobState(name=name))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+
+        interval = datetime.timedelta(seconds=current_app.config[self.jobs[name][1]])
+        claimed = JobState.query.filter(
+            JobState.name == name,
+            or_(JobState.next_run.is_(None), JobState.next_run <= now)
+        ).update({JobState.last_run: now, JobState.next_run: now + interval},
+                 synchronize_session=False)
+        db.session.commit()
+        return bool(claimed)
+
+    def run_pending(self, now=None):
+        """Run the jobs due at now. Returns a dict of their results by name"""
+
+        now = now or clock.now()
+        results = {}
+        for name, (function, _) in self.jobs.items():
+            if not self.claim(name, now):
+                continue
+            try:
+                results[name] = function(now, JobState.query.get(name))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                current_app.logger.exception('Job %s failed', name)
+        return results
+
+    def run(self, app, stop=None, clock=clock.now, sleep=time.sleep):
+        """Keep running due jobs until stop (a threading.Event) is set"""
+
+        while not (stop and stop.is_set()):
+            with app.app_context():
+                try:
+                    for name, result in self.run_pending(clock()).items():
+                        app.logger.info('Job %s: %s', name, result)
+                finally:
+                    db.session.remove()
+            sleep(app.config['SCHEDULER_TICK'])
+
+
+scheduler = Scheduler()
@@ -0,0 +1,165 @@
+"""Full-text and faceted search over the book catalogue.
+
+On PostgreSQL books are matched against a weighted ``tsvector`` expression
+backed by a GIN index. Other databases (SQLite in development and tests) use
+the book_terms table, an inverted index kept up to date as books are saved.
+"""
+
+import re
+from sqlalchemy import DDL, and_, case, event, func, literal_column, or_
+from app.app import db
+from app.models import Book, BookTerm
+
+# field weights used by the inverted index, mirroring the tsvector weights below
+WEIGHTS = (
+    ('title', 8),
+    ('author', 4),
+    ('category', 2),
+    ('subcategory', 2),
+    ('publisher', 1),
+    ('description', 1),
+)
+
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(author, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(category, '') || ' ' || "
+    "coalesce(subcategory, '')), 'C') || "
+    "setweight(to_tsvector('simple', coalesce(publisher, '') || ' ' || "
+    "coalesce(description, '')), 'D')"
+)
+
+event.listen(
+    Book.__table__, 'after_create',
+    DDL('CREATE INDEX IF NOT EXISTS ix_books_search ON books '
+        'USING gin ((' + SEARCH_VECTOR + '))').execute_if(dialect='postgresql')
+)
+
+
+def tokenize(text):
+    """Split text into distinct lower case words, keeping their order"""
+
+    seen = []
+    for word in re.findall(r'\w+', (text or '').lower()):
+        if word not in seen:
+            seen.append(word)
+    return seen
+
+
+def uses_full_text(bind):
+    return bind.dialect.name == 'postgresql'
+
+
+def book_terms(book):
+    """Return a {term: weight} mapping for the searchable fields of book"""
+
+    terms = {}
+    for field, weight in WEIGHTS:
+        for term in tokenize(str(getattr(book, field) or '')):
+            terms[term] = terms.get(term, 0) + weight
+    return terms
+
+
+def index_books(connection, books):
+    """Replace the inverted index entries of books"""
+
+    ids = [book.id for book in books]
+    connection.execute(BookTerm.__table__.delete().where(BookTerm.book_id.in_(ids)))
+    rows = [{'term': term, 'book_id': book.id, 'weight': weight}
+            for book in books for term, weight in book_terms(book).items()]
+    if rows:
+        connection.execute(BookTerm.__table__.insert(), rows)
+
+
+@event.listens_for(Book, 'after_insert')
+@event.listens_for(Book, 'after_update')
+def index_book(mapper, connection, book):
+    if not uses_full_text(connection):
+        index_books(connection, [book])
+
+
+@event.listens_for(Book, 'after_delete')
+def unindex_book(mapper, connection, book):
+    if not uses_full_text(connection):
+        connection.execute(BookTerm.__table__.delete().where(BookTerm.book_id == book.id))
+
+
+def reindex(batch_size=1000):
+    """Rebuild the inverted index for the whole catalogue"""
+
+    connection = db.session.connection()
+    if uses_full_text(connection):
+        return 0
+    connection.execute(BookTerm.__table__.delete())
+    count = 0
+    last_id = 0
+    while True:
+        books = Book.query.filter(Book.id > last_id).order_by(Book.id).limit(batch_size).all()
+        if not books:
+            break
+        index_books(connection, books)
+        count += len(books)
+        last_id = books[-1].id
+    db.session.commit()
+    return count
+
+
+def matching_books(terms):
+    """Return a query of (book_id, score) for books containing every term as a prefix"""
+
+    if uses_full_text(db.session.connection()):
+        tsquery = func.to_tsquery('simple', ' & '.join(term + ':*' for term in terms))
+        vector = literal_column(SEARCH_VECTOR)
+        return db.session.query(
+            Book.id.label('book_id'), func.ts_rank(vector, tsquery).label('score')
+        ).filter(vector.op('@@')(tsquery))
+
+    # prefix matching as a range scan over the (term, book_id) primary key
+    matches = [and_(BookTerm.term >= term, BookTerm.term < term + '\U0010ffff')
+               for term in terms]
+    query = db.session.query(
+        BookTerm.book_id.label('book_id'), func.sum(BookTerm.weight).label('score')
+    ).filter(or_(*matches)).group_by(BookTerm.book_id)
+    if len(matches) > 1:
+        query = query.having(
+            and_(*[func.sum(case([(match, 1)], else_=0)) > 0 for match in matches]))
+    return query
+
+
+def search(text, category=None, subcategory=None, limit=20, offset=0):
+    """Search the catalogue.
+
+    Returns a (books, total, facets) tuple where books is the requested page
+    of matches, best first, total the number of matches and facets the number
+    of matches per category and subcategory."""
+
+    terms = tokenize(text)
+    filters = []
+    if category:
+        filters.append(Book.category == category)
+    if subcategory:
+        filters.append(Book.subcategory == subcategory)
+
+    if terms:
+        matches = matching_books(terms).subquery()
+        order = (matches.c.score.desc(), Book.id)
+
+        def restrict(query):
+            return query.join(matches, matches.c.book_id == Book.id).filter(*filters)
+    else:
+        order = (Book.id,)
+
+        def restrict(query):
+            return query.filter(*filters)
+
+    # the total and both facets come from a single grouped pass over the matches
+    total = 0
+    facets = {'category': {}, 'subcategory': {}}
+    groups = restrict(db.session.query(Book.category, Book.subcategory, func.count(Book.id)))
+    for category, subcategory, count in groups.group_by(Book.category, Book.subcategory):
+        total += count
+        for field, value in (('category', category), ('subcategory', subcategory)):
+            facets[field][str(value)] = facets[field].get(str(value), 0) + count
+
+    books = restrict(db.session.query(Book)).order_by(*order).offset(offset).limit(limit).all()
+    return books, total, facets
@@ -0,0 +1,58 @@
+"""Precompiled serializers turning model instances and rows into JSON ready dictionaries"""
+
+import datetime
+import decimal
+from operator import attrgetter
+from flask.json import JSONEncoder as BaseJSONEncoder
+from sqlalchemy import Date, DateTime
+
+
+class Serializer:
+    """Serializes the given columns of model instances or row tuples.
+
+    fields is a sequence of (output name, column) pairs. Everything that can
+    be worked out from the columns is done once here, so serializing a row is
+    a single attribute lookup pass and a dict(zip()) with the date columns
+    converted to ISO-8601 strings. Other values keep their JSON types."""
+
+    def __init__(self, fields):
+        fields = list(fields)
+        self.names = tuple(name for name, _ in fields)
+        self.columns = tuple(column for _, column in fields)
+        self.getter = attrgetter(*(column.key for column in self.columns))
+        self.dates = tuple(name for name, column in fields
+                           if isinstance(column.type, (Date, DateTime)))
+        if len(fields) == 1:
+            getter = self.getter
+            self.getter = lambda obj: (getter(obj),)
+
+    def __call__(self, obj):
+        """Serialize a model instance"""
+
+        return self.from_row(self.getter(obj))
+
+    def rows(self, query):
+        """Restrict an ORM query to self.columns, so that it yields plain row tuples"""
+
+        return query.with_entities(*self.columns)
+
+    def from_row(self, row):
+        """Serialize a tuple of values selected in the order of self.columns"""
+
+        data = dict(zip(self.names, row))
+        for name in self.dates:
+            value = data[name]
+            if value is not None:
+                data[name] = value.isoformat()
+        return data
+
+
+class JSONEncoder(BaseJSONEncoder):
+    """JSON encoder writing dates as ISO-8601 instead of HTTP dates"""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.date)):
+            return o.isoformat()
+        if isinstance(o, decimal.Decimal):
+            return str(o)
+        return super().default(o)
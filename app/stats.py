@@ -0,0 +1,100 @@
+"""Circulation reports read from the loan_stats table"""
+
+from sqlalchemy import func, select, union_all
+from app.app import db
+from app.models import ArchivedLoan, Book, BorrowLog, LoanStats, User
+
+
+def popular_books(limit):
+    """The most borrowed books"""
+
+    rows = LoanStats.query.filter_by(dimension='book').order_by(
+        LoanStats.loans.desc(), LoanStats.key).limit(limit)
+    return [{'book_id': int(row.key), 'title': row.label, 'loans': row.loans,
+             'active': row.active} for row in rows]
+
+
+def category_loans(limit):
+    """Loans per book category"""
+
+    rows = LoanStats.query.filter_by(dimension='category').order_by(
+        LoanStats.loans.desc(), LoanStats.key).limit(limit)
+    return [{'category': row.label, 'loans': row.loans} for row in rows]
+
+
+def active_borrowers(limit):
+    """The users with the most books out"""
+
+    rows = LoanStats.query.filter(LoanStats.dimension == 'user', LoanStats.active > 0).order_by(
+        LoanStats.active.desc(), LoanStats.key).limit(limit)
+    return [{'user_id': int(row.key), 'email': row.label, 'active': row.active,
+             'loans': row.loans} for row in rows]
+
+
+def loan_summary(limit=None):
+    """Total, active and returned loans and the average loan duration"""
+
+    loans, active, returns, seconds = db.session.query(
+        func.sum(LoanStats.loans), func.sum(LoanStats.active), func.sum(LoanStats.returns),
+        func.sum(LoanStats.loan_seconds)).filter(LoanStats.dimension == 'total').one()
+    return {
+        'loans': loans or 0,
+        'active': active or 0,
+        'returns': returns or 0,
+        'average_loan_days': round(seconds / returns / 86400, 2) if returns else None
+    }
+
+
+REPORTS = {
+    'popular': popular_books,
+    'categories': category_loans,
+    'borrowers': active_borrowers,
+    'summary': loan_summary,
+}
+
+
+def rebuild(connection, batch_size=1000):
+    """Recompute loan_stats from the borrowing log and its archive.
+
+    Used to fill the table for loans made before it existed, or to correct
+    it after the log was changed by hand. Loans made while it runs may be
+    missed, so run it while the library is closed."""
+
+    books = Book.__table__
+    users = User.__table__
+    rows = {}
+
+    def count(dimension, key, label=None, **increments):
+        row = rows.setdefault((dimension, str(key)), dict(
+            dimension=dimension, key=str(key), label=label, loans=0, active=0, returns=0,
+            loan_seconds=0))
+        for name, amount in increments.items():
+            row[name] += amount
+
+    loans = union_all(*(
+        select([log.c.book_id, log.c.user_id, log.c.borrow_timestamp, log.c.returned,
+                log.c.return_timestamp, books.c.title, books.c.category, users.c.email]
+               ).select_from(log.outerjoin(books, books.c.id == log.c.book_id)
+                             .outerjoin(users, users.c.id == log.c.user_id))
+        for log in (BorrowLog.__table__, ArchivedLoan.__table__)))
+    result = connection.execution_options(stream_results=True).execute(loans)
+    for loan in iter(lambda: result.fetchmany(batch_size), []):
+        for book_id, user_id, borrowed, returned, returned_on, title, category, email in loan:
+            opened = dict(loans=1, active=0 if returned else 1)
+            count('book', book_id, title, **opened)
+            count('category', category or '', category, loans=1)
+            count('user', user_id, email, **opened)
+            count('total', user_id % LoanStats.TOTAL_SHARDS, **opened)
+            if returned:
+                seconds = (returned_on - borrowed).total_seconds() \
+                    if returned_on and borrowed else 0
+                for dimension, key in (('book', book_id), ('user', user_id),
+                                       ('total', user_id % LoanStats.TOTAL_SHARDS)):
+                    count(dimension, key, returns=1, loan_seconds=seconds)
+
+    table = LoanStats.__table__
+    connection.execute(table.delete())
+    values = list(rows.values())
+    for start in range(0, len(values), batch_size):
+        connection.execute(table.insert(), values[start:start + batch_size])
+    return len(values)
@@ -1,64 +1,317 @@
 """Useful functions"""
 
-from math import ceil
+import base64
 import datetime
-from app.models import BorrowLog
+import json
+from flask import g, request, jsonify, json as flask_json, current_app, \
+    Response, stream_with_context
+from sqlalchemy import false, tuple_
+from werkzeug.urls import url_encode
+from app.app import db
+from app.cache import catalogue_cache
+from app.clock import clock
+from app.models import Book, BorrowLog, LoanStats
 
+NEXT = 'next'
+PREVIOUS = 'prev'
+NDJSON = 'application/x-ndjson'
+CURSOR_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
 
-def group(list_obj, group_len):
-    """Group objects in a list into lists with length group_len"""
 
-    for i in range(0, len(list_obj), group_len):
-        yield list_obj[i:i + group_len]
+def encode_cursor(value, direction):
+    """Encode a keyset position into an opaque, url-safe cursor token"""
 
+    raw = json.dumps({'k': value, 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
 
-def get_paginated(limit_param, results, url, page_param):
-    """Return paginated results"""
 
-    page = int(page_param)
-    limit = int(limit_param)
-    page_count = ceil(len(results) / limit)
-    paginated = {}
-    if page == 1:
-        paginated['previous'] = 'None'
-    else:
-        paginated['previous'] = url + '?page={}&limit={}'.format(page - 1, limit)
+def decode_cursor(token):
+    """Decode a cursor token into a (value, direction) tuple.
 
-    if page < page_count:
-        paginated['next'] = url + '?page={}&limit={}'.format(page + 1, limit)
-    elif page > page_count:
-        return False
+    Raises ValueError if the token was not produced by encode_cursor"""
+
+    padded = token + '=' * (-len(token) % 4)
+    try:
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        value, direction = data['k'], data['d']
+    except (TypeError, KeyError, ValueError):
+        raise ValueError('Invalid cursor')
+    if direction not in (NEXT, PREVIOUS):
+        raise ValueError('Invalid cursor')
+    return value, direction
+
+
+def page_url(cursor):
+    """Return the current url pointing at the page identified by cursor"""
+
+    args = request.args.to_dict()
+    args.pop('page', None)
+    args['cursor'] = cursor
+    return request.path + '?' + url_encode(args, sort=True)
+
+
+def page_number_url(page):
+    """Return the current url pointing at the given page number"""
+
+    args = request.args.to_dict()
+    args['page'] = page
+    return request.path + '?' + url_encode(args, sort=True)
+
+
+def requested_stream_format():
+    """Return the streaming format requested by the client, or None.
+
+    NDJSON is chosen with ``Accept: application/x-ndjson`` or ``?stream=ndjson``,
+    a chunked JSON array with ``?stream=1``"""
+
+    stream = request.args.get('stream')
+    accept = request.accept_mimetypes
+    if stream == 'ndjson' or accept[NDJSON] > accept['application/json']:
+        return NDJSON
+    if stream in ('1', 'true'):
+        return 'application/json'
+    return None
+
+
+def stream_results(query, keys, serialize, mimetype):
+    """Stream the results of query as they are read from the database.
+
+    Rows are fetched through a server-side cursor in batches of
+    STREAM_BATCH_SIZE and written out one batch at a time, so memory use
+    does not grow with the size of the result set"""
+
+    batch_size = current_app.config['STREAM_BATCH_SIZE']
+    rows = query.order_by(*keys).execution_options(stream_results=True).yield_per(batch_size)
+
+    def generate():
+        chunk = []
+        first = True
+        if mimetype != NDJSON:
+            yield '['
+        for row in rows:
+            item = flask_json.dumps(serialize(row))
+            if mimetype == NDJSON:
+                chunk.append(item + '\n')
+            else:
+                chunk.append(item if first else ',' + item)
+                first = False
+            if len(chunk) >= batch_size:
+                yield ''.join(chunk)
+                chunk = []
+        if chunk:
+            yield ''.join(chunk)
+        if mimetype != NDJSON:
+            yield ']\n'
+
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+def cursor_position(row, keys):
+    """Return the JSON-serializable keyset position of row"""
+
+    values = [getattr(row, column.key) for column in keys]
+    values = [value.strftime(CURSOR_TIME_FORMAT) if isinstance(value, datetime.datetime)
+              else value for value in values]
+    return values if len(keys) > 1 else values[0]
+
+
+def keyset_values(position, keys):
+    """Return the column values of a decoded cursor position for keys.
+
+    Raises ValueError if the position does not fit the keys"""
+
+    values = position if len(keys) > 1 else [position]
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError('Invalid cursor')
+    return [datetime.datetime.strptime(value, CURSOR_TIME_FORMAT)
+            if isinstance(column.type, db.DateTime) and value is not None else value
+            for column, value in zip(keys, values)]
+
+
+def get_paginated(query, key, serialize, empty_msg=None):
+    """Return a response containing the results of query.
+
+    When a limit is given only that page is loaded from the database. Pages
+    are selected with a keyset predicate on key, a unique, sortable column or
+    a tuple of columns ending in a unique one
+    (``WHERE key > :cursor ORDER BY key LIMIT :limit``), so the cost of a page
+    does not depend on how deep into the results it is. The legacy ``page``
+    parameter is still honoured using an offset.
+
+    Without a limit all results are returned, streamed if the client asked
+    for it (see requested_stream_format).
+    """
+
+    keys = tuple(key) if isinstance(key, (tuple, list)) else (key,)
+    position = keys[0] if len(keys) == 1 else tuple_(*keys)
+    params = g.get('pagination') or {}
+    limit = params.get('limit')
+
+    if not limit:
+        stream_format = requested_stream_format()
+        if stream_format:
+            return stream_results(query, keys, serialize, stream_format)
+        results = [serialize(item) for item in query.order_by(*keys)]
+        if not results and empty_msg:
+            return jsonify(msg=empty_msg), 404
+        return jsonify(results), 200
+
+    cursor = params.get('cursor')
+    page = params.get('page', 1)
+    if cursor:
+        value, direction = cursor
+        try:
+            values = keyset_values(value, keys)
+        except (TypeError, ValueError):
+            return jsonify(msg='Please make sure that the cursor parameter is valid'), 400
+        value = values[0] if len(keys) == 1 else tuple_(*values)
+        if direction == NEXT:
+            rows = query.filter(position > value).order_by(
+                *(column.asc() for column in keys)).limit(limit + 1).all()
+            has_next, has_previous = len(rows) > limit, True
+            rows = rows[:limit]
+        else:
+            rows = query.filter(position < value).order_by(
+                *(column.desc() for column in keys)).limit(limit + 1).all()
+            has_next, has_previous = True, len(rows) > limit
+            rows = rows[:limit][::-1]
     else:
-        paginated['next'] = 'None'
+        rows = query.order_by(*keys).offset((page - 1) * limit).limit(limit + 1).all()
+        has_next, has_previous = len(rows) > limit, page > 1
+        rows = rows[:limit]
+
+    if not rows:
+        if not cursor and page == 1:
+            if empty_msg:
+                return jsonify(msg=empty_msg), 404
+        else:
+            return jsonify(msg='The requested page was not found'), 404
+
+    paginated = {
+        'previous': 'None',
+        'next': 'None',
+        'results': [serialize(item) for item in rows]
+    }
+    if rows and has_previous:
+        paginated['previous'] = page_url(encode_cursor(cursor_position(rows[0], keys), PREVIOUS))
+    if rows and has_next:
+        paginated['next'] = page_url(encode_cursor(cursor_position(rows[-1], keys), NEXT))
+    if params.get('count'):
+        paginated['count'] = query.order_by(None).count()
+    return jsonify(paginated), 200
 
-    for i, value in enumerate(group(results, limit)):
-        if i == (page - 1):
-            paginated['results'] = value
-            break
 
-    return paginated
+def close_loan(book_record, now):
+    """Mark a borrowing record returned and restock its book without committing.
+
+    Returns False, changing nothing, if the record had already been returned."""
+
+    # only the request that flips the record to returned may restock the book
+    closed = BorrowLog.query.filter(BorrowLog.borrow_id == book_record.borrow_id,
+                                    BorrowLog.returned == false()).update(
+        {BorrowLog.returned: True, BorrowLog.return_timestamp: now},
+        synchronize_session=False)
+    if not closed:
+        return False
+    Book.query.filter_by(id=book_record.book_id).update(
+        {Book.available: Book.available + 1, Book.modified: now}, synchronize_session=False)
+    LoanStats.record_return(book_record, now)
+    return True
 
 
 def return_book(user, book):
     """Return a borrowed book to the library"""
 
-    book_record = BorrowLog.query.filter_by(user_id=user.id, book_id=book.id, returned=False).first()
     if user.is_admin:
-        book_record = BorrowLog.query.filter_by(book_id=book.id, returned=False).first()
+        book_record = BorrowLog.open_records(book.id).first()
+    else:
+        book_record = BorrowLog.open_records(book.id, user.id).first()
     if not book_record:
         return {'message': 'Borrowing record not found. Make sure you have borrowed this book',
                 'status_code': 404}
-    if book_record.returned:
+
+    now = clock.now()
+    if not close_loan(book_record, now):
+        db.session.rollback()
         return dict(message='This book has already been returned',
                     status_code=409)
-
-    now = datetime.datetime.utcnow()
-    book_record.return_timestamp = now
-    book_record.returned = True
-    book_record.save()
-    book.available += 1
-    book.save()
+    db.session.commit()
+    catalogue_cache.invalidate()
     return {
-        'message': 'Book successfully returned on {}'.format(book_record.return_timestamp),
+        'message': 'Book successfully returned on {}'.format(now),
         'status_code': 200
     }
+
+
+def borrow_books(user, book_ids):
+    """Borrow several books in one transaction.
+
+    Each book is checked as by a single borrow; the returned list holds one
+    outcome per requested id, in order."""
+
+    books = {book.id: book for book in Book.query.filter(Book.id.in_(book_ids))}
+    borrowed = {book_id for book_id, in db.session.query(BorrowLog.book_id).filter(
+        BorrowLog.user_id == user.id, BorrowLog.returned == false(),
+        BorrowLog.book_id.in_(book_ids))}
+
+    # copies taken by this request, which the loaded rows do not reflect
+    taken = {}
+    outcomes = []
+    for book_id in book_ids:
+        book = books.get(book_id)
+        if not book:
+            outcome = {'message': 'The requested book was not found', 'status_code': 404}
+        elif book.available - taken.get(book_id, 0) < 1:
+            outcome = {'message': 'This book has already been borrowed', 'status_code': 409}
+        elif book_id in borrowed:
+            outcome = {'message': 'You cannot borrow the same book twice', 'status_code': 403}
+        else:
+            record = user.checkout(book)
+            if record is None:
+                outcome = {'message': 'This book has already been borrowed', 'status_code': 409}
+            else:
+                borrowed.add(book_id)
+                taken[book_id] = taken.get(book_id, 0) + 1
+                outcome = {'message': 'You have successfully borrowed this book',
+                           'status_code': 200, 'details': record.details()}
+        outcomes.append(dict(outcome, book_id=book_id))
+
+    db.session.commit()
+    if any(outcome['status_code'] == 200 for outcome in outcomes):
+        catalogue_cache.invalidate()
+    return outcomes
+
+
+def return_books(user, book_ids):
+    """Return several borrowed books in one transaction.
+
+    The returned list holds one outcome per requested id, in order."""
+
+    found = {book_id for book_id, in db.session.query(Book.id).filter(Book.id.in_(book_ids))}
+    query = BorrowLog.query.filter(BorrowLog.book_id.in_(book_ids), BorrowLog.returned == false())
+    if not user.is_admin:
+        query = query.filter(BorrowLog.user_id == user.id)
+    records = {}
+    for book_record in query:
+        records.setdefault(book_record.book_id, []).append(book_record)
+
+    now = clock.now()
+    outcomes = []
+    for book_id in book_ids:
+        if book_id not in found:
+            outcome = {'message': 'The requested book was not found', 'status_code': 404}
+        elif not records.get(book_id):
+            outcome = {'message': 'Borrowing record not found. '
+                                  'Make sure you have borrowed this book',
+                       'status_code': 404}
+        elif not close_loan(records[book_id].pop(), now):
+            outcome = {'message': 'This book has already been returned', 'status_code': 409}
+        else:
+            outcome = {'message': 'Book successfully returned on {}'.format(now),
+                       'status_code': 200}
+        outcomes.append(dict(outcome, book_id=book_id))
+
+    db.session.commit()
+    if any(outcome['status_code'] == 200 for outcome in outcomes):
+        catalogue_cache.invalidate()
+    return outcomes
@@ -0,0 +1,28 @@
+"""Benchmarks for the Hellobooks API"""
+
+import os
+from app.app import create_app
+
+
+def create_bench_app(database_url=None):
+    """Create an application bound to the benchmark database.
+
+    The database defaults to the BENCH_DATABASE_URL environment variable and
+    then to a SQLite file in the current directory."""
+
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = (
+        database_url or os.environ.get('BENCH_DATABASE_URL') or 'sqlite:///bench.db')
+    app.config['MAIL_OUTBOX_EAGER'] = False
+    return app
+
+
+def percentiles(samples):
+    """Return the p50, p95 and p99 of samples, in milliseconds"""
+
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return round(ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] * 1000, 3)
+
+    return {'p50': at(0.50), 'p95': at(0.95), 'p99': at(0.99)}
@@ -0,0 +1,338 @@
+"""API throughput and latency benchmark.
+
+Seeds the benchmark database with users, books and borrowing records and
+drives the real endpoints, either in process through the Flask test client or
+over HTTP against a running server or a gunicorn started for the run. Reports
+p50/p95/p99 latency, requests per second and (in process) SQL statements per
+request for every endpoint:
+
+    python -m benchmarks.api --users 1000 --books 100000 --loans 200000 --output before.json
+    python -m benchmarks.api --gunicorn 4 --concurrency 8 --baseline before.json
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+from sqlalchemy import event
+from app.app import db
+from app.models import Book, BorrowLog, User
+from benchmarks import create_bench_app, percentiles
+from benchmarks.seed import seed_books, seed_loans, seed_users, user_email
+
+PASSWORD = 'bench-password'
+PHASES = ('login', 'list_books', 'paginate', 'borrow', 'return', 'history')
+
+
+class ClientDriver:
+    """Sends requests in process through the Flask test client"""
+
+    mode = 'client'
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self.count_statement)
+
+    def count_statement(self, *args):
+        self.local.statements = getattr(self.local, 'statements', 0) + 1
+
+    def request(self, method, path, body=None, token=None):
+        """Return the status, decoded body and SQL statement count of a request"""
+
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        headers = {'content-type': 'application/json'}
+        if token:
+            headers['Authorization'] = 'Bearer {}'.format(token)
+        self.local.statements = 0
+        response = self.local.client.open(path, method=method, headers=headers,
+                                          data=json.dumps(body) if body is not None else None)
+        return response.status_code, decode(response.data), self.local.statements
+
+
+class HTTPDriver:
+    """Sends requests over HTTP, one connection per thread"""
+
+    mode = 'http'
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, token=None):
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = http.client.HTTPConnection(self.host, self.port)
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = 'Bearer {}'.format(token)
+        connection = self.local.connection
+        try:
+            connection.request(method, path, json.dumps(body) if body is not None else None,
+                               headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            # the server dropped a kept-alive connection; retry on a new one
+            connection.close()
+            connection.request(method, path, json.dumps(body) if body is not None else None,
+                               headers)
+            response = connection.getresponse()
+            data = response.read()
+        return response.status, decode(data), None
+
+
+def decode(data):
+    try:
+        return json.loads(data.decode('utf-8'))
+    except ValueError:
+        return None
+
+
+class VirtualUser:
+    """A patron sending requests from its own thread"""
+
+    def __init__(self, driver, number, book_ids, iterations, rng):
+        self.driver = driver
+        self.email = user_email(number)
+        self.token = None
+        self.next_page = None
+        # distinct books, so that a patron never borrows the same book twice
+        self.to_borrow = rng.sample(book_ids, min(iterations, len(book_ids)))
+        self.borrowed = []
+
+    def login(self):
+        status, body, statements = self.driver.request(
+            'POST', '/api/v1/auth/login', {'email': self.email, 'password': PASSWORD})
+        if status == 200:
+            self.token = body['access_token']
+        return status, statements
+
+    def list_books(self):
+        status, _, statements = self.driver.request('GET', '/api/v1/books?limit=20')
+        return status, statements
+
+    def paginate(self):
+        status, body, statements = self.driver.request(
+            'GET', self.next_page or '/api/v1/books?limit=20')
+        link = body.get('next') if isinstance(body, dict) else None
+        self.next_page = link if link and link != 'None' else None
+        return status, statements
+
+    def borrow(self):
+        if not self.to_borrow:
+            return None
+        book_id = self.to_borrow.pop()
+        status, _, statements = self.driver.request(
+            'POST', '/api/v1/users/books/{}'.format(book_id), token=self.token)
+        if status == 200:
+            self.borrowed.append(book_id)
+        return status, statements
+
+    def return_(self):
+        if not self.borrowed:
+            return None
+        status, _, statements = self.driver.request(
+            'PUT', '/api/v1/users/books/{}'.format(self.borrowed.pop()), token=self.token)
+        return status, statements
+
+    def history(self):
+        status, _, statements = self.driver.request(
+            'GET', '/api/v1/users/books?limit=20', token=self.token)
+        return status, statements
+
+    def run(self, phase):
+        return getattr(self, 'return_' if phase == 'return' else phase)()
+
+
+def run_phase(phase, patrons, iterations):
+    """Run iterations of one phase on every patron concurrently"""
+
+    samples = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(patrons) + 1)
+
+    def work(patron):
+        local = []
+        barrier.wait()
+        for _ in range(iterations):
+            start = time.perf_counter()
+            outcome = patron.run(phase)
+            if outcome is None:
+                break
+            local.append((time.perf_counter() - start,) + outcome)
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=work, args=(patron,)) for patron in patrons]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples, elapsed):
+    """Return the latency, throughput and SQL statistics of a phase"""
+
+    if not samples:
+        return {'requests': 0}
+    statuses = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    statements = [count for _, _, count in samples if count is not None]
+    latencies = [latency for latency, _, _ in samples]
+    return dict(
+        percentiles(latencies),
+        requests=len(samples),
+        errors=sum(1 for _, status, _ in samples if status >= 500),
+        statuses=statuses,
+        mean=round(sum(latencies) / len(latencies) * 1000, 3),
+        rps=round(len(samples) / elapsed, 1),
+        sql_per_request=round(sum(statements) / len(statements), 2) if statements else None
+    )
+
+
+def seed(app, users, books, loans):
+    """Top the benchmark database up to the requested numbers of rows"""
+
+    with app.app_context():
+        db.create_all()
+        existing = User.query.count()
+        if existing < users:
+            print('seeding {} users'.format(users - existing))
+            seed_users(users - existing, PASSWORD, start=existing)
+        existing = Book.query.count()
+        if existing < books:
+            print('seeding {} books'.format(books - existing))
+            seed_books(books - existing, seed=existing)
+        existing = BorrowLog.query.count()
+        if existing < loans:
+            print('seeding {} borrowing records'.format(loans - existing))
+            seed_loans(loans - existing, seed=existing)
+        return [book_id for book_id, in db.session.query(Book.id)]
+
+
+def start_gunicorn(workers, database_url):
+    """Start gunicorn serving the benchmark database and return (process, url)"""
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    env = dict(os.environ, BENCH_DATABASE_URL=database_url)
+    process = subprocess.Popen(['gunicorn', '-w', str(workers), '-b', '127.0.0.1:{}'.format(port),
+                                'benchmarks.wsgi:app'], env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, 'http://127.0.0.1:{}'.format(port)
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('gunicorn did not start')
+
+
+def compare(result, baseline):
+    """Print the change in p95 latency and throughput against a previous run"""
+
+    print('{:<12} {:>12} {:>12} {:>10} {:>10}'.format(
+        'endpoint', 'p95 before', 'p95 after', 'rps before', 'rps after'))
+    for phase in PHASES:
+        before = baseline['endpoints'].get(phase, {})
+        after = result['endpoints'].get(phase, {})
+        if 'p95' in before and 'p95' in after:
+            print('{:<12} {:>12} {:>12} {:>10} {:>10}'.format(
+                phase, before['p95'], after['p95'], before['rps'], after['rps']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='database url (default: BENCH_DATABASE_URL)')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--loans', type=int, default=20000)
+    parser.add_argument('--iterations', type=int, default=50, help='requests per patron and phase')
+    parser.add_argument('--concurrency', type=int, default=1, help='patrons sending requests at once')
+    parser.add_argument('--phases', default=','.join(PHASES),
+                        help='comma separated subset of ' + ', '.join(PHASES))
+    parser.add_argument('--url', help='benchmark a running server instead of the test client')
+    parser.add_argument('--gunicorn', type=int, metavar='WORKERS',
+                        help='start gunicorn with this many workers and benchmark it over HTTP')
+    parser.add_argument('--seed', type=int, default=7, help='random seed for the request mix')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='compare with the JSON results of an earlier run')
+    args = parser.parse_args(argv)
+
+    phases = [phase for phase in args.phases.split(',') if phase]
+    unknown = set(phases) - set(PHASES)
+    if unknown:
+        parser.error('unknown phases: ' + ', '.join(sorted(unknown)))
+    if args.concurrency > args.users:
+        parser.error('--concurrency cannot exceed --users')
+
+    app = create_bench_app(args.database)
+    database_url = app.config['SQLALCHEMY_DATABASE_URI']
+    book_ids = seed(app, args.users, args.books, args.loans)
+
+    server = None
+    if args.gunicorn:
+        server, args.url = start_gunicorn(args.gunicorn, database_url)
+    driver = HTTPDriver(args.url) if args.url else ClientDriver(app)
+
+    rng = random.Random(args.seed)
+    patrons = [VirtualUser(driver, number, book_ids, args.iterations, rng)
+               for number in range(args.concurrency)]
+    endpoints = {}
+    try:
+        if 'login' not in phases:
+            for patron in patrons:
+                patron.login()
+        for phase in phases:
+            samples, elapsed = run_phase(phase, patrons, args.iterations)
+            endpoints[phase] = summarize(samples, elapsed)
+            print('{:<12} {}'.format(phase, json.dumps(endpoints[phase])))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    result = {
+        'started': datetime.datetime.utcnow().isoformat(),
+        'mode': driver.mode,
+        'database': database_url.split('://')[0],
+        'python': platform.python_version(),
+        'users': args.users,
+        'books': len(book_ids),
+        'loans': args.loans,
+        'concurrency': args.concurrency,
+        'iterations': args.iterations,
+        'gunicorn_workers': args.gunicorn,
+        'endpoints': endpoints,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(result, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            compare(result, json.load(baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
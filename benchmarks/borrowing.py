@@ -0,0 +1,129 @@
+"""Concurrent borrowing benchmark.
+
+Sends simultaneous borrows of one book from many threads and compares the
+conditional UPDATE used by ``User.borrow_book`` with the read-modify-write it
+replaced (decrement in Python, then one commit for the book and one for the
+borrowing record). Reports borrows per second and how many loans were
+recorded beyond the copies that exist:
+
+    BENCH_DATABASE_URL=postgresql://localhost/bench_db python -m benchmarks.borrowing --borrowers 50
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from app.app import db
+from app.clock import clock
+from app.models import Book, BorrowLog, LoanStats, User, generate_uuid
+from benchmarks import create_bench_app
+
+
+def read_modify_write(user, book):
+    """Borrow book the way it was done before conditional updates"""
+
+    if not book.is_available():
+        return None
+    now = clock.now()
+    book.available -= 1
+    db.session.add(book)
+    db.session.commit()
+    record = BorrowLog(borrow_id=generate_uuid(), user_id=user.id, book_id=book.id,
+                       book_title=book.title, borrow_timestamp=now,
+                       expected_return=now, returned=False)
+    db.session.add(record)
+    db.session.commit()
+    return record
+
+
+def conditional_update(user, book):
+    return user.borrow_book(book)
+
+
+VERSIONS = [('read_modify_write', read_modify_write),
+            ('conditional_update', conditional_update)]
+
+
+def run(app, borrow, book_id, user_ids):
+    """Borrow the book once per user, all at the same time"""
+
+    barrier = threading.Barrier(len(user_ids))
+    outcomes = []
+
+    def attempt(user_id):
+        with app.app_context():
+            user, book = User.query.get(user_id), Book.get_by_id(book_id)
+            barrier.wait()
+            try:
+                outcomes.append('borrowed' if borrow(user, book) else 'refused')
+            except Exception:
+                db.session.rollback()
+                outcomes.append('failed')
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=attempt, args=(user_id,)) for user_id in user_ids]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, outcomes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='database url (default: BENCH_DATABASE_URL)')
+    parser.add_argument('--copies', type=int, default=10)
+    parser.add_argument('--borrowers', type=int, default=40, help='simultaneous borrows per round')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    app = create_bench_app(args.database)
+    results = {'copies': args.copies, 'borrowers': args.borrowers, 'rounds': args.rounds}
+    with app.app_context():
+        db.create_all()
+        book = Book(title='Benchmark Book', available=args.copies)
+        db.session.add(book)
+        users = [User(email='borrower{}@bench.test'.format(number), first_name='Bench',
+                      last_name='Borrower') for number in range(args.borrowers)]
+        db.session.add_all(users)
+        db.session.commit()
+        book_id, user_ids = book.id, [user.id for user in users]
+
+        for name, borrow in VERSIONS:
+            elapsed, outcomes, oversold = 0.0, [], 0
+            for _ in range(args.rounds):
+                BorrowLog.query.filter_by(book_id=book_id).delete()
+                Book.query.filter_by(id=book_id).update({Book.available: args.copies})
+                db.session.commit()
+                seconds, round_outcomes = run(app, borrow, book_id, user_ids)
+                elapsed += seconds
+                outcomes += round_outcomes
+                oversold += max(BorrowLog.query.filter_by(book_id=book_id).count() - args.copies, 0)
+            results[name] = {
+                'borrows_per_second': round(len(outcomes) / elapsed, 1),
+                'borrowed': outcomes.count('borrowed'),
+                'refused': outcomes.count('refused'),
+                'failed': outcomes.count('failed'),
+                'oversold': oversold,
+            }
+            print(name, json.dumps(results[name]))
+
+        BorrowLog.query.filter_by(book_id=book_id).delete()
+        LoanStats.query.delete()
+        Book.query.filter_by(id=book_id).delete()
+        User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+        db.session.commit()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
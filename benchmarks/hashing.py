@@ -0,0 +1,112 @@
+"""Login storm benchmark.
+
+Runs logins and catalogue reads side by side in process and reports the
+login throughput and the catalogue latency for every limit on concurrent
+hashes, so the effect of PASSWORD_HASH_WORKERS can be compared (0 for no
+limit):
+
+    python -m benchmarks.hashing --workers 0,1,2 --logins 16 --readers 4 --output hashing.json
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from app.app import db
+from app.models import Book, User
+from app.passwords import hasher
+from benchmarks import create_bench_app, percentiles
+from benchmarks.seed import seed_books, seed_users, user_email
+
+PASSWORD = 'bench-password'
+
+
+def hammer(client, request, deadline, samples, statuses):
+    """Send request through client until deadline, recording latencies and status codes"""
+
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = request(client)
+        samples.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+def run(app, users, logins, readers, duration):
+    """Run logins and catalogue reads for duration seconds and summarise them"""
+
+    rng = random.Random(1)
+
+    def login(client):
+        body = {'email': user_email(rng.randrange(users)), 'password': PASSWORD}
+        return client.post('/api/v1/auth/login', data=json.dumps(body),
+                           headers={'content-type': 'application/json'})
+
+    def read(client):
+        return client.get('/api/v1/books?limit=20')
+
+    results = {'login': ([], {}), 'catalogue': ([], {})}
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=hammer, args=(app.test_client(), login, deadline)
+                                + results['login']) for _ in range(logins)]
+    threads += [threading.Thread(target=hammer, args=(app.test_client(), read, deadline)
+                                 + results['catalogue']) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    summary = {}
+    for name, (samples, statuses) in results.items():
+        summary[name] = dict(percentiles(samples) if samples else {},
+                             requests=len(samples),
+                             per_second=round(statuses.get(200, 0) / duration, 1),
+                             statuses=statuses)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='database url (default: BENCH_DATABASE_URL)')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--workers', default='0,2', help='comma separated limits on concurrent hashes')
+    parser.add_argument('--logins', type=int, default=16, help='threads logging in')
+    parser.add_argument('--readers', type=int, default=4, help='threads reading the catalogue')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per limit')
+    parser.add_argument('--method', help='PASSWORD_HASH_METHOD (default: the configured one)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    app = create_bench_app(args.database)
+    if args.method:
+        app.config['PASSWORD_HASH_METHOD'] = args.method
+    results = {'method': app.config['PASSWORD_HASH_METHOD'], 'logins': args.logins,
+               'readers': args.readers, 'runs': {}}
+    with app.app_context():
+        db.create_all()
+        hasher.configure(app.config)
+        if not User.query.count():
+            seed_users(args.users, PASSWORD)
+        existing = Book.query.count()
+        if existing < args.books:
+            seed_books(args.books - existing, seed=existing)
+        db.session.remove()
+
+        for workers in [int(size) for size in args.workers.split(',')]:
+            app.config['PASSWORD_HASH_WORKERS'] = workers
+            hasher.configure(app.config)
+            results['runs'][workers] = run(app, args.users, args.logins, args.readers,
+                                           args.duration)
+            print(workers, json.dumps(results['runs'][workers]))
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
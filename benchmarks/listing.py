@@ -0,0 +1,91 @@
+"""Listing read path benchmark.
+
+Compares the time and peak memory of serializing whole listings of books and
+borrowing records through ORM instances and through plain row tuples:
+
+    python -m benchmarks.listing --books 100000 --loans 100000 --output listing.json
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from app.app import db
+from app.models import Book, BorrowLog, User, book_serializer, borrow_log_serializer
+from benchmarks import create_bench_app
+from benchmarks.seed import seed_books, seed_loans, seed_users
+
+
+def legacy_serialize(obj):
+    """The serializer the models used before, stringifying every column"""
+
+    return {column.key: str(getattr(obj, column.key)) for column in obj.__table__.columns}
+
+
+def read_paths(model, serializer):
+    """Return the (name, function) pairs producing a serialized listing of model"""
+
+    return [
+        ('orm_legacy', lambda: [legacy_serialize(obj) for obj in model.query]),
+        ('orm', lambda: [serializer(obj) for obj in model.query]),
+        ('rows', lambda: [serializer.from_row(row) for row in serializer.rows(model.query)]),
+    ]
+
+
+def measure(function, repeat):
+    """Return the best time and the peak memory of producing and encoding a listing"""
+
+    timings = []
+    for _ in range(repeat):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        json.dumps(function(), default=str)
+        timings.append(time.perf_counter() - start)
+
+    db.session.expunge_all()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': round(min(timings), 4), 'peak_mb': round(peak / 2 ** 20, 2)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='database url (default: BENCH_DATABASE_URL)')
+    parser.add_argument('--books', type=int, default=50000)
+    parser.add_argument('--loans', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    app = create_bench_app(args.database)
+    results = {}
+    with app.app_context():
+        db.create_all()
+        if not User.query.count():
+            seed_users(10, 'bench-password')
+        existing = Book.query.count()
+        if existing < args.books:
+            seed_books(args.books - existing, seed=existing)
+        existing = BorrowLog.query.count()
+        if existing < args.loans:
+            seed_loans(args.loans - existing, seed=existing)
+
+        for name, model, serializer in (('books', Book, book_serializer),
+                                        ('borrow_log', BorrowLog, borrow_log_serializer)):
+            results[name] = {'rows': model.query.count()}
+            for path, function in read_paths(model, serializer):
+                results[name][path] = measure(function, args.repeat)
+                print(name, path, results[name][path])
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""Search latency benchmark.
+
+Seeds the benchmark database with generated books (1M by default) and fails
+with a non-zero exit status if the p95 search latency exceeds the target:
+
+    BENCH_DATABASE_URL=postgresql://localhost/bench_db python -m benchmarks.search
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from app.app import db
+from app.models import Book
+from benchmarks import create_bench_app, percentiles
+from benchmarks.seed import seed_books, vocabulary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='database url (default: BENCH_DATABASE_URL)')
+    parser.add_argument('--books', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--target-ms', type=float, default=100.0, help='p95 latency target')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    app = create_bench_app(args.database)
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        existing = Book.query.count()
+        if existing < args.books:
+            print('seeding {} books'.format(args.books - existing))
+            seed_books(args.books - existing, seed=existing)
+        words = vocabulary(20000, random.Random(42))
+
+        rng = random.Random(7)
+        queries = []
+        for _ in range(args.queries):
+            kind = rng.random()
+            if kind < 0.4:
+                queries.append('q=' + rng.choice(words))
+            elif kind < 0.7:
+                queries.append('q=' + rng.choice(words)[:3])
+            elif kind < 0.9:
+                queries.append('q={}+{}'.format(rng.choice(words), rng.choice(words)[:4]))
+            else:
+                queries.append('q={}&category=fiction'.format(rng.choice(words)[:4]))
+
+        samples = []
+        for query in queries:
+            start = time.perf_counter()
+            response = client.get('/api/v1/books/search?' + query)
+            samples.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.data
+
+    result = dict(percentiles(samples), books=args.books, queries=len(samples),
+                  database=app.config['SQLALCHEMY_DATABASE_URI'].split('://')[0],
+                  target_p95=args.target_ms)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(result, output, indent=2)
+    return 0 if result['p95'] <= args.target_ms else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
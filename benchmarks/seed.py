@@ -0,0 +1,129 @@
+"""Generate benchmark data"""
+
+import datetime
+import random
+import uuid
+from types import SimpleNamespace
+from app.app import db
+from app.models import Book, BorrowLog, User
+from app.passwords import hasher
+from app.search import index_books, uses_full_text
+
+CATEGORIES = {
+    'fiction': ['fantasy', 'science fiction', 'crime', 'romance', 'horror'],
+    'history': ['ancient', 'medieval', 'modern', 'military'],
+    'science': ['physics', 'biology', 'chemistry', 'astronomy'],
+    'computing': ['programming', 'databases', 'networks', 'security'],
+    'arts': ['music', 'painting', 'film', 'photography'],
+}
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'ten', 'sha', 'vor', 'el', 'dun', 'qui', 'bar', 'zo',
+             'nek', 'ti', 'fal', 'gor', 'hun', 'ja', 'pel', 'stro']
+
+
+def vocabulary(size, rng):
+    """Return size made-up words"""
+
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def generate_books(count, rng, words):
+    """Yield count book dictionaries"""
+
+    for _ in range(count):
+        category = rng.choice(sorted(CATEGORIES))
+        yield {
+            'title': ' '.join(rng.choice(words) for _ in range(rng.randint(1, 5))).title(),
+            'author': '{} {}'.format(rng.choice(words), rng.choice(words)).title(),
+            'publisher': '{} Press'.format(rng.choice(words[:200]).title()),
+            'publication_year': str(rng.randint(1900, 2018)),
+            'edition': str(rng.randint(1, 5)),
+            'isbn': None,
+            'category': category,
+            'subcategory': rng.choice(CATEGORIES[category]),
+            'description': ' '.join(rng.choice(words) for _ in range(12)),
+            'available': rng.randint(1, 3),
+        }
+
+
+def seed_books(count, batch_size=5000, seed=42):
+    """Insert count generated books, one batch per transaction"""
+
+    rng = random.Random(seed)
+    words = vocabulary(20000, rng)
+    connection = db.session.connection()
+    index = not uses_full_text(connection)
+    next_id = (db.session.query(db.func.max(Book.id)).scalar() or 0) + 1
+    batch = []
+    for book in generate_books(count, rng, words):
+        book['id'] = next_id
+        next_id += 1
+        batch.append(book)
+        if len(batch) == batch_size:
+            insert_books(batch, index)
+            batch = []
+    if batch:
+        insert_books(batch, index)
+    return words
+
+
+def insert_books(books, index):
+    connection = db.session.connection()
+    connection.execute(Book.__table__.insert(), books)
+    if index:
+        index_books(connection, [SimpleNamespace(**book) for book in books])
+    db.session.commit()
+
+
+def user_email(number):
+    return 'reader{}@bench.example.com'.format(number)
+
+
+def seed_users(count, password, start=0, batch_size=5000):
+    """Insert count users numbered from start, all sharing one password"""
+
+    # hashing is deliberately slow, so every user gets the same hash
+    hashed = hasher.hash(password)
+    connection = db.session.connection()
+    for first in range(start, start + count, batch_size):
+        last = min(first + batch_size, start + count)
+        connection.execute(User.__table__.insert(), [
+            {'email': user_email(number), 'first_name': 'Reader', 'last_name': str(number),
+             'password': hashed, 'is_admin': False}
+            for number in range(first, last)
+        ])
+        db.session.commit()
+        connection = db.session.connection()
+
+
+def seed_loans(count, seed=42, batch_size=5000):
+    """Insert count returned borrowing records spread over the existing users and books"""
+
+    rng = random.Random(seed)
+    user_ids = [user_id for user_id, in db.session.query(User.id)]
+    book_ids = [book_id for book_id, in db.session.query(Book.id)]
+    start = datetime.datetime(2018, 1, 1)
+    connection = db.session.connection()
+    batch = []
+    for _ in range(count):
+        borrowed = start + datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+        batch.append({
+            'borrow_id': uuid.UUID(int=rng.getrandbits(128)).hex,
+            'user_id': rng.choice(user_ids),
+            'book_id': rng.choice(book_ids),
+            'book_title': None,
+            'borrow_timestamp': borrowed,
+            'expected_return': borrowed + datetime.timedelta(days=14),
+            'return_timestamp': borrowed + datetime.timedelta(days=rng.randint(1, 20)),
+            'returned': True,
+        })
+        if len(batch) == batch_size:
+            connection.execute(BorrowLog.__table__.insert(), batch)
+            db.session.commit()
+            connection = db.session.connection()
+            batch = []
+    if batch:
+        connection.execute(BorrowLog.__table__.insert(), batch)
+        db.session.commit()
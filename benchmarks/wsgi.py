@@ -0,0 +1,5 @@
+"""WSGI application serving the benchmark database, used by ``benchmarks.api --gunicorn``"""
+
+from benchmarks import create_bench_app
+
+app = create_bench_app()
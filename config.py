@@ -13,12 +13,69 @@ class Config:
     JWT_ACCESS_TOKEN_EXPIRES = datetime.timedelta(minutes=60)
     JWT_BLACKLIST_ENABLED = True
     JWT_BLACKLIST_TOKEN_CHECKS = ['access']
+    TOKEN_REVOCATION_BACKEND = 'database'  # or 'memory' for a single worker
+    TOKEN_REVOCATION_CACHE_SIZE = 10000
+    TOKEN_REVOCATION_CACHE_TTL = 0  # seconds a non-revoked lookup is cached
     JWT_TOKEN_LOCATION = ['headers', 'query_string']
     JWT_QUERY_STRING_NAME = 'token'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # engine and pool options; every worker process holds up to
+    # SQLALCHEMY_POOL_SIZE + SQLALCHEMY_MAX_OVERFLOW connections
+    SQLALCHEMY_POOL_SIZE = None  # library default (5) for server databases
+    SQLALCHEMY_MAX_OVERFLOW = None  # library default (10)
+    SQLALCHEMY_POOL_TIMEOUT = None  # seconds to wait for a connection, default 30
+    SQLALCHEMY_POOL_RECYCLE = None  # seconds after which connections are replaced
+    SQLALCHEMY_POOL_PRE_PING = False  # test connections before use
+    SQLALCHEMY_STATEMENT_TIMEOUT = None  # milliseconds, PostgreSQL only
+    SQLALCHEMY_ENGINE_OPTIONS = {}  # any other create_engine arguments, e.g. connect_args
+
+    # read replicas serving the read-only views, comma separated in DATABASE_REPLICA_URLS
+    SQLALCHEMY_REPLICA_URIS = [url for url in
+                               os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+    REPLICA_CHECK_INTERVAL = 5  # seconds between health checks of a replica
+    REPLICA_MAX_LAG = 10  # seconds of replication lag tolerated, PostgreSQL only
+    READ_YOUR_WRITES_SECONDS = 30  # users read from the primary this long after a write
+    READ_YOUR_WRITES_BACKEND = 'memory'  # or 'redis' to share recent writers between workers
+    READ_YOUR_WRITES_SIZE = 10000
     ADMIN = ['jomo@user.com']
+    ADMIN_REVALIDATE = False  # look users up instead of trusting the is_admin claim
     BOOK_RETURN_PERIOD = 14  # days
+    DATABASE_TIMESTAMPS = False  # let the database stamp borrowing records (see app.clock)
+    BATCH_MAX_BOOKS = 50  # books borrowed or returned in one batch request
+    PASSWORD_RESET_EXPIRES = datetime.timedelta(minutes=10)
+
+    # password hashing (see app.passwords); stored hashes made with other
+    # parameters are replaced at the next login
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:50000'  # always include the iteration count
+    PASSWORD_SALT_LENGTH = 8
+    PASSWORD_HASH_WORKERS = 2  # hashes computed at the same time, 0 for no limit
+    PASSWORD_HASH_QUEUE = 8  # hashes waiting for their turn
+    PASSWORD_HASH_TIMEOUT = 5  # seconds to wait for a place before answering 503
     DOMAIN = 'http://127.0.0.1:5000'
+    STREAM_BATCH_SIZE = 1000  # rows fetched per round trip when streaming
+    SEARCH_MAX_LIMIT = 100
+    SEARCH_STATEMENT_TIMEOUT = 5000  # milliseconds
+    REPORT_MAX_LIMIT = 100  # rows in a circulation report
+    # compact, unsorted JSON lets the json module use its C encoder
+    JSONIFY_PRETTYPRINT_REGULAR = False
+    JSON_SORT_KEYS = False
+    BULK_IMPORT_BATCH_SIZE = 500  # books written per transaction
+    BULK_IMPORT_STATEMENT_TIMEOUT = 60000  # milliseconds
+
+    # request instrumentation, served at /api/v1/metrics when enabled
+    INSTRUMENTATION_ENABLED = os.environ.get('INSTRUMENTATION_ENABLED') == '1'
+    SLOW_REQUEST_THRESHOLD = 1.0  # seconds
+    SLOW_QUERY_THRESHOLD = 0.25  # seconds
+    PROFILE_SAMPLE_RATE = 0  # fraction of all requests profiled with cProfile
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')  # defaults to the temporary directory
+
+    # catalogue read cache: 'memory' (per worker), 'redis' (shared) or None
+    CATALOGUE_CACHE_BACKEND = 'memory'
+    CATALOGUE_CACHE_SIZE = 10000
+    CATALOGUE_CACHE_TTL = 30  # seconds; bounds staleness across workers with 'memory'
+    CATALOGUE_CACHE_REDIS_URL = os.environ.get('REDIS_URL')
 
     # mail configuration
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_SENDER')
@@ -28,6 +85,21 @@ class Config:
     MAIL_USE_SSL = False
     MAIL_USERNAME = os.environ.get('MAIL_USER')
     MAIL_PASSWORD = os.environ.get('MAIL_PASS')
+    MAIL_OUTBOX_EAGER = False  # deliver on enqueue instead of in the worker
+    MAIL_OUTBOX_BATCH_SIZE = 50
+    MAIL_MAX_ATTEMPTS = 5
+    MAIL_RETRY_BACKOFF = 30  # seconds, doubled after every failed attempt
+    MAIL_RETRY_MAX_DELAY = 3600  # seconds
+    MAIL_WORKER_INTERVAL = 5  # seconds between polls of an empty outbox
+
+    # background jobs run by `python manage.py worker`
+    SCHEDULER_TICK = 30  # seconds between checks for due jobs
+    OVERDUE_SCAN_INTERVAL = 3600  # seconds
+    OVERDUE_SCAN_BATCH_SIZE = 500  # loans read per transaction
+    PURGE_INTERVAL = 3600  # seconds between purges of expired tokens and resets
+    ARCHIVE_INTERVAL = 86400  # seconds between moves of old loans to the archive
+    ARCHIVE_AFTER_DAYS = 365  # returned loans older than this are archived
+    ARCHIVE_BATCH_SIZE = 1000  # loans moved per transaction
 
     @staticmethod
     def init_app(app):
@@ -45,10 +117,25 @@ class TestingConfig(Config):
 
     TESTING = True
     DEBUG = True
+    MAIL_OUTBOX_EAGER = True
     SQLALCHEMY_DATABASE_URI = 'postgresql://localhost/test_db'
 
 
+class ProductionConfig(Config):
+    """Production configurations"""
+
+    SQLALCHEMY_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+    SQLALCHEMY_POOL_TIMEOUT = 10
+    SQLALCHEMY_POOL_RECYCLE = 1800
+    SQLALCHEMY_POOL_PRE_PING = True
+    SQLALCHEMY_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 30000))
+    CATALOGUE_CACHE_BACKEND = 'redis' if os.environ.get('REDIS_URL') else 'memory'
+    READ_YOUR_WRITES_BACKEND = 'redis' if os.environ.get('REDIS_URL') else 'memory'
+
+
 app_config = {
     'development': DevelopmentConfig,
-    'testing': TestingConfig
+    'testing': TestingConfig,
+    'production': ProductionConfig
 }
@@ -1,8 +1,9 @@
+import os
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 from app.app import create_app, db
 
-app = create_app('development')
+app = create_app(os.environ.get('APP_SETTINGS', 'development'))
 migrate = Migrate(app, db)
 manager = Manager(app)
 
@@ -19,5 +20,77 @@ def drop_db():
     db.drop_all()
 
 
+@manager.command
+def purge_tokens():
+    """Remove revoked tokens and password resets that have already expired"""
+
+    from app.models import PasswordReset
+    from app.revocation import blacklist
+    print('Removed {} expired tokens'.format(blacklist.purge()))
+    print('Removed {} expired password resets'.format(PasswordReset.purge()))
+
+
+@manager.command
+def import_books(path, fmt=None):
+    """Import books from a JSON, NDJSON or CSV file"""
+
+    from app import importer
+    with open(path, newline='', encoding='utf-8') as lines:
+        rows = importer.read_rows(lines, fmt or importer.format_for_path(path))
+        summary = importer.import_books(rows, batch_size=app.config['BULK_IMPORT_BATCH_SIZE'])
+    for error in summary['errors']:
+        print('Row {row}: {error}'.format(**error))
+    print('Added {created} new books and {updated} copies of existing books, '
+          '{failed} rows failed'.format(**summary))
+
+
+@manager.option('-d', '--days', dest='days', type=int,
+                help='archive loans returned more than this many days ago')
+def archive_loans(days=None):
+    """Move loans returned long ago to the archive table"""
+
+    from app import archive
+    from app.clock import clock
+    print('Archived {} loans'.format(archive.archive_loans(clock.now(), days)))
+
+
+@manager.command
+def rebuild_stats():
+    """Recompute the circulation statistics from the borrowing log"""
+
+    from app.stats import rebuild
+    with db.engine.begin() as connection:
+        print('Rebuilt {} statistics rows'.format(rebuild(connection)))
+
+
+@manager.command
+def reindex_books():
+    """Rebuild the search index of every book (databases without full-text search)"""
+
+    from app.search import reindex
+    print('Indexed {} books'.format(reindex()))
+
+
+@manager.command
+def mail_worker():
+    """Deliver queued emails until interrupted"""
+
+    from app.mailer import run_worker
+    run_worker(app)
+
+
+@manager.command
+def worker(once=False):
+    """Run the scheduled background jobs until interrupted, or the due ones once"""
+
+    from app import jobs  # registers the jobs
+    from app.scheduler import scheduler
+    if once:
+        for name, result in scheduler.run_pending().items():
+            print('{}: {}'.format(name, result))
+    else:
+        scheduler.run(app)
+
+
 if __name__ == '__main__':
     manager.run()
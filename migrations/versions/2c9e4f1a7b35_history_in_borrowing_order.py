@@ -0,0 +1,40 @@
+"""indexes for borrowing history pages in borrowing order
+
+Revision ID: 2c9e4f1a7b35
+Revises: c07eb61dba2d
+Create Date: 2018-07-18 09:12:40.118293
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2c9e4f1a7b35'
+down_revision = 'c07eb61dba2d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_borrow_log_user_history', 'borrow_log',
+                    ['user_id', 'borrow_timestamp', 'borrow_id'], unique=False)
+    op.create_index('ix_borrow_log_history', 'borrow_log',
+                    ['borrow_timestamp', 'borrow_id'], unique=False)
+    op.create_index('ix_borrow_log_archive_user_history', 'borrow_log_archive',
+                    ['user_id', 'borrow_timestamp', 'borrow_id'], unique=False)
+    op.create_index('ix_borrow_log_archive_history', 'borrow_log_archive',
+                    ['borrow_timestamp', 'borrow_id'], unique=False)
+    op.drop_index('ix_borrow_log_archive_user_id_borrow_id', table_name='borrow_log_archive')
+    op.drop_index('ix_borrow_log_user_id_borrow_id', table_name='borrow_log')
+
+
+def downgrade():
+    op.create_index('ix_borrow_log_user_id_borrow_id', 'borrow_log',
+                    ['user_id', 'borrow_id'], unique=False)
+    op.create_index('ix_borrow_log_archive_user_id_borrow_id', 'borrow_log_archive',
+                    ['user_id', 'borrow_id'], unique=False)
+    op.drop_index('ix_borrow_log_archive_history', table_name='borrow_log_archive')
+    op.drop_index('ix_borrow_log_archive_user_history', table_name='borrow_log_archive')
+    op.drop_index('ix_borrow_log_history', table_name='borrow_log')
+    op.drop_index('ix_borrow_log_user_history', table_name='borrow_log')
@@ -0,0 +1,122 @@
+"""revoked tokens, mail outbox, password resets and search index
+
+Revision ID: 444629b742b6
+Revises: 5b5a353d96cb
+Create Date: 2018-07-02 10:14:05.640117
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '444629b742b6'
+down_revision = '5b5a353d96cb'
+branch_labels = None
+depends_on = None
+
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(author, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(category, '') || ' ' || "
+    "coalesce(subcategory, '')), 'C') || "
+    "setweight(to_tsvector('simple', coalesce(publisher, '') || ' ' || "
+    "coalesce(description, '')), 'D')"
+)
+SEARCH_WEIGHTS = (
+    ('title', 8),
+    ('author', 4),
+    ('category', 2),
+    ('subcategory', 2),
+    ('publisher', 1),
+    ('description', 1),
+)
+
+books = sa.table('books', sa.column('id', sa.Integer),
+                 *(sa.column(field, sa.String) for field, _ in SEARCH_WEIGHTS))
+book_terms = sa.table('book_terms',
+    sa.column('term', sa.String),
+    sa.column('book_id', sa.Integer),
+    sa.column('weight', sa.Integer),
+)
+
+
+def upgrade():
+    op.create_table('revoked_tokens',
+    sa.Column('jti', sa.String(), nullable=False),
+    sa.Column('expires', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('jti')
+    )
+    op.create_index(op.f('ix_revoked_tokens_expires'), 'revoked_tokens', ['expires'], unique=False)
+    op.create_table('mail_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('sender', sa.String(), nullable=True),
+    sa.Column('recipients', sa.String(), nullable=True),
+    sa.Column('subject', sa.String(), nullable=True),
+    sa.Column('body', sa.Text(), nullable=True),
+    sa.Column('html', sa.Text(), nullable=True),
+    sa.Column('queued', sa.DateTime(), nullable=True),
+    sa.Column('next_attempt', sa.DateTime(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=True),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.Column('sent', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_mail_outbox_next_attempt'), 'mail_outbox', ['next_attempt'], unique=False)
+    op.create_table('password_resets',
+    sa.Column('token_hash', sa.String(length=64), nullable=False),
+    sa.Column('email', sa.String(), nullable=True),
+    sa.Column('password', sa.String(), nullable=True),
+    sa.Column('expires', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('token_hash')
+    )
+    op.create_index(op.f('ix_password_resets_expires'), 'password_resets', ['expires'], unique=False)
+    op.create_table('book_terms',
+    sa.Column('term', sa.String(), nullable=False),
+    sa.Column('book_id', sa.Integer(), nullable=False),
+    sa.Column('weight', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('term', 'book_id')
+    )
+    op.create_index(op.f('ix_book_terms_book_id'), 'book_terms', ['book_id'], unique=False)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE INDEX IF NOT EXISTS ix_books_search ON books '
+                   'USING gin ((' + SEARCH_VECTOR + '))')
+    else:
+        index_existing_books(op.get_bind())
+
+
+def index_existing_books(connection, batch_size=1000):
+    """Fill book_terms for the books already in the catalogue"""
+
+    last_id = 0
+    while True:
+        rows = connection.execute(sa.select([books]).where(books.c.id > last_id)
+                                  .order_by(books.c.id).limit(batch_size)).fetchall()
+        if not rows:
+            break
+        terms = []
+        for row in rows:
+            weights = {}
+            for field, weight in SEARCH_WEIGHTS:
+                for term in set(re.findall(r'\w+', (row[field] or '').lower())):
+                    weights[term] = weights.get(term, 0) + weight
+            terms.extend({'term': term, 'book_id': row['id'], 'weight': weight}
+                         for term, weight in weights.items())
+        if terms:
+            connection.execute(book_terms.insert(), terms)
+        last_id = rows[-1]['id']
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_books_search')
+    op.drop_index(op.f('ix_book_terms_book_id'), table_name='book_terms')
+    op.drop_table('book_terms')
+    op.drop_index(op.f('ix_password_resets_expires'), table_name='password_resets')
+    op.drop_table('password_resets')
+    op.drop_index(op.f('ix_mail_outbox_next_attempt'), table_name='mail_outbox')
+    op.drop_table('mail_outbox')
+    op.drop_index(op.f('ix_revoked_tokens_expires'), table_name='revoked_tokens')
+    op.drop_table('revoked_tokens')
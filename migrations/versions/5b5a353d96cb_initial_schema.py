@@ -0,0 +1,67 @@
+"""initial schema
+
+Databases created with 'manage.py create_db' before migrations were added
+already have these tables; mark them as migrated with
+'manage.py db stamp 5b5a353d96cb' before upgrading.
+
+Revision ID: 5b5a353d96cb
+Revises:
+Create Date: 2018-07-02 10:12:41.118302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b5a353d96cb'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('books',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(), nullable=True),
+    sa.Column('author', sa.String(), nullable=True),
+    sa.Column('publisher', sa.String(), nullable=True),
+    sa.Column('publication_year', sa.String(), nullable=True),
+    sa.Column('edition', sa.String(), nullable=True),
+    sa.Column('isbn', sa.String(), nullable=True),
+    sa.Column('category', sa.String(), nullable=True),
+    sa.Column('subcategory', sa.String(), nullable=True),
+    sa.Column('description', sa.String(), nullable=True),
+    sa.Column('added', sa.DateTime(), nullable=True),
+    sa.Column('modified', sa.DateTime(), nullable=True),
+    sa.Column('available', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('first_name', sa.String(), nullable=True),
+    sa.Column('last_name', sa.String(), nullable=True),
+    sa.Column('email', sa.String(), nullable=True),
+    sa.Column('password', sa.String(), nullable=True),
+    sa.Column('is_admin', sa.Boolean(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email')
+    )
+    op.create_table('borrow_log',
+    sa.Column('borrow_id', sa.String(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('book_id', sa.Integer(), nullable=True),
+    sa.Column('book_title', sa.String(), nullable=True),
+    sa.Column('borrow_timestamp', sa.DateTime(), nullable=True),
+    sa.Column('expected_return', sa.DateTime(), nullable=True),
+    sa.Column('return_timestamp', sa.DateTime(), nullable=True),
+    sa.Column('returned', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('borrow_id')
+    )
+
+
+def downgrade():
+    op.drop_table('borrow_log')
+    op.drop_table('users')
+    op.drop_table('books')
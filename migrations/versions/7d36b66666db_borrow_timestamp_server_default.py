@@ -0,0 +1,45 @@
+"""server side default for borrow_log.borrow_timestamp
+
+SQLite has to copy the table to change a default, and the copy loses the
+WHERE clause of the partial indexes, so they are created again.
+
+Revision ID: 7d36b66666db
+Revises: bd8dfc944f81
+Create Date: 2018-07-13 11:26:40.918233
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d36b66666db'
+down_revision = 'bd8dfc944f81'
+branch_labels = None
+depends_on = None
+
+returned = sa.column('returned', sa.Boolean())
+# the current UTC time, as app.clock.utcnow compiled when this revision was written
+UTCNOW = {'postgresql': "TIMEZONE('utc', CURRENT_TIMESTAMP)"}
+PARTIAL_INDEXES = [('ix_borrow_log_open_user_book', ['user_id', 'book_id']),
+                   ('ix_borrow_log_open_book', ['book_id'])]
+
+
+def set_default(server_default):
+    with op.batch_alter_table('borrow_log') as batch_op:
+        batch_op.alter_column('borrow_timestamp', existing_type=sa.DateTime(),
+                              server_default=server_default)
+    if op.get_bind().dialect.name == 'sqlite':
+        for name, columns in PARTIAL_INDEXES:
+            op.drop_index(name, table_name='borrow_log')
+            op.create_index(name, 'borrow_log', columns, unique=False,
+                            sqlite_where=returned == sa.false())
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    set_default(sa.text(UTCNOW.get(dialect, 'CURRENT_TIMESTAMP')))
+
+
+def downgrade():
+    set_default(None)
@@ -0,0 +1,47 @@
+"""indexes for borrowing, returning, history and isbn lookups
+
+Empty ISBNs are cleared before the unique constraint is added. Books that
+share an ISBN must be merged by hand first.
+
+Revision ID: 99eebd56b6a7
+Revises: 444629b742b6
+Create Date: 2018-07-02 10:21:37.502281
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '99eebd56b6a7'
+down_revision = '444629b742b6'
+branch_labels = None
+depends_on = None
+
+returned = sa.column('returned', sa.Boolean())
+
+
+def upgrade():
+    op.execute("UPDATE books SET isbn = NULL WHERE isbn = '' OR isbn = 'None'")
+    with op.batch_alter_table('books') as batch_op:
+        batch_op.create_unique_constraint('uq_books_isbn', ['isbn'])
+        batch_op.create_index(batch_op.f('ix_books_added'), ['added'], unique=False)
+        batch_op.create_index(batch_op.f('ix_books_modified'), ['modified'], unique=False)
+    op.create_index('ix_borrow_log_user_id_borrow_id', 'borrow_log',
+                    ['user_id', 'borrow_id'], unique=False)
+    op.create_index('ix_borrow_log_open_user_book', 'borrow_log', ['user_id', 'book_id'],
+                    unique=False, postgresql_where=returned == sa.false(),
+                    sqlite_where=returned == sa.false())
+    op.create_index('ix_borrow_log_open_book', 'borrow_log', ['book_id'],
+                    unique=False, postgresql_where=returned == sa.false(),
+                    sqlite_where=returned == sa.false())
+
+
+def downgrade():
+    op.drop_index('ix_borrow_log_open_book', table_name='borrow_log')
+    op.drop_index('ix_borrow_log_open_user_book', table_name='borrow_log')
+    op.drop_index('ix_borrow_log_user_id_borrow_id', table_name='borrow_log')
+    with op.batch_alter_table('books') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_books_modified'))
+        batch_op.drop_index(batch_op.f('ix_books_added'))
+        batch_op.drop_constraint('uq_books_isbn', type_='unique')
@@ -0,0 +1,34 @@
+"""background job state and the overdue loans index
+
+Revision ID: b3e3d8b67530
+Revises: 99eebd56b6a7
+Create Date: 2018-07-09 09:42:18.114506
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e3d8b67530'
+down_revision = '99eebd56b6a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job_state',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('last_run', sa.DateTime(), nullable=True),
+    sa.Column('next_run', sa.DateTime(), nullable=True),
+    sa.Column('mark_time', sa.DateTime(), nullable=True),
+    sa.Column('mark_id', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_index('ix_borrow_log_overdue', 'borrow_log',
+                    ['returned', 'expected_return', 'borrow_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_borrow_log_overdue', table_name='borrow_log')
+    op.drop_table('job_state')
@@ -0,0 +1,98 @@
+"""running loan statistics, filled from the borrowing log
+
+Revision ID: bd8dfc944f81
+Revises: b3e3d8b67530
+Create Date: 2018-07-11 14:05:52.377160
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bd8dfc944f81'
+down_revision = 'b3e3d8b67530'
+branch_labels = None
+depends_on = None
+
+TOTAL_SHARDS = 8
+
+borrow_log = sa.table('borrow_log',
+    sa.column('book_id', sa.Integer),
+    sa.column('user_id', sa.Integer),
+    sa.column('borrow_timestamp', sa.DateTime),
+    sa.column('return_timestamp', sa.DateTime),
+    sa.column('returned', sa.Boolean),
+)
+books = sa.table('books',
+    sa.column('id', sa.Integer),
+    sa.column('title', sa.String),
+    sa.column('category', sa.String),
+)
+users = sa.table('users',
+    sa.column('id', sa.Integer),
+    sa.column('email', sa.String),
+)
+loan_stats = sa.table('loan_stats',
+    sa.column('dimension', sa.String),
+    sa.column('key', sa.String),
+    sa.column('label', sa.String),
+    sa.column('loans', sa.Integer),
+    sa.column('active', sa.Integer),
+    sa.column('returns', sa.Integer),
+    sa.column('loan_seconds', sa.Float),
+)
+
+
+def upgrade():
+    op.create_table('loan_stats',
+    sa.Column('dimension', sa.String(), nullable=False),
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('label', sa.String(), nullable=True),
+    sa.Column('loans', sa.Integer(), nullable=True),
+    sa.Column('active', sa.Integer(), nullable=True),
+    sa.Column('returns', sa.Integer(), nullable=True),
+    sa.Column('loan_seconds', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('dimension', 'key')
+    )
+    op.create_index('ix_loan_stats_loans', 'loan_stats', ['dimension', 'loans'], unique=False)
+    op.create_index('ix_loan_stats_active', 'loan_stats', ['dimension', 'active'], unique=False)
+    fill_loan_stats(op.get_bind().dialect.name)
+
+
+def fill_loan_stats(dialect):
+    """Count the loans already in the borrowing log per book, category, user and shard"""
+
+    borrowed, returned_on = borrow_log.c.borrow_timestamp, borrow_log.c.return_timestamp
+    if dialect == 'postgresql':
+        duration = sa.extract('epoch', returned_on - borrowed)
+    else:
+        duration = (sa.func.julianday(returned_on) - sa.func.julianday(borrowed)) * 86400
+    loans = sa.func.count()
+    active = sa.func.sum(sa.case([(borrow_log.c.returned, 0)], else_=1))
+    returns = sa.func.sum(sa.case([(borrow_log.c.returned, 1)], else_=0))
+    seconds = sa.func.sum(sa.case([(borrow_log.c.returned, sa.func.coalesce(duration, 0))],
+                                  else_=0))
+    category = sa.func.coalesce(books.c.category, '')
+    shard = borrow_log.c.user_id % TOTAL_SHARDS
+
+    loans_by = [
+        ('book', borrow_log.c.book_id, sa.func.max(books.c.title), loans, active, returns, seconds),
+        ('category', category, sa.func.max(books.c.category), loans,
+         sa.literal(0), sa.literal(0), sa.literal(0)),
+        ('user', borrow_log.c.user_id, sa.func.max(users.c.email), loans, active, returns, seconds),
+        ('total', shard, sa.null(), loans, active, returns, seconds),
+    ]
+    loans_with_names = borrow_log.outerjoin(books, books.c.id == borrow_log.c.book_id) \
+        .outerjoin(users, users.c.id == borrow_log.c.user_id)
+    for dimension, key, label, *counts in loans_by:
+        rows = sa.select([sa.literal(dimension), sa.cast(key, sa.String), label] + counts) \
+            .select_from(loans_with_names).group_by(key)
+        op.execute(loan_stats.insert().from_select(
+            ['dimension', 'key', 'label', 'loans', 'active', 'returns', 'loan_seconds'], rows))
+
+
+def downgrade():
+    op.drop_index('ix_loan_stats_active', table_name='loan_stats')
+    op.drop_index('ix_loan_stats_loans', table_name='loan_stats')
+    op.drop_table('loan_stats')
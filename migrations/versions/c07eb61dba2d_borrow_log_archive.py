@@ -0,0 +1,44 @@
+"""archive table for returned loans
+
+Revision ID: c07eb61dba2d
+Revises: 7d36b66666db
+Create Date: 2018-07-16 10:48:03.550914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c07eb61dba2d'
+down_revision = '7d36b66666db'
+branch_labels = None
+depends_on = None
+
+returned = sa.column('returned', sa.Boolean())
+
+
+def upgrade():
+    op.create_table('borrow_log_archive',
+    sa.Column('borrow_id', sa.String(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('book_id', sa.Integer(), nullable=True),
+    sa.Column('book_title', sa.String(), nullable=True),
+    sa.Column('borrow_timestamp', sa.DateTime(), nullable=True),
+    sa.Column('expected_return', sa.DateTime(), nullable=True),
+    sa.Column('return_timestamp', sa.DateTime(), nullable=True),
+    sa.Column('returned', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('borrow_id')
+    )
+    op.create_index('ix_borrow_log_archive_user_id_borrow_id', 'borrow_log_archive',
+                    ['user_id', 'borrow_id'], unique=False)
+    op.create_index('ix_borrow_log_closed', 'borrow_log', ['return_timestamp'],
+                    unique=False, postgresql_where=returned == sa.true(),
+                    sqlite_where=returned == sa.true())
+
+
+def downgrade():
+    op.drop_index('ix_borrow_log_closed', table_name='borrow_log')
+    op.drop_index('ix_borrow_log_archive_user_id_borrow_id', table_name='borrow_log_archive')
+    op.drop_table('borrow_log_archive')
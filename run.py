@@ -1,7 +1,8 @@
+import os
 from app.app import create_app
 from flask_cors import CORS
 
-config_name = 'development'
+config_name = os.environ.get('APP_SETTINGS', 'development')
 app = create_app(config_name)
 CORS(app)
 
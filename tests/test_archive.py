@@ -0,0 +1,113 @@
+"""Contains tests for archiving returned loans"""
+
+import unittest
+import datetime
+import json
+from flask import g
+from flask_jwt_extended import create_access_token
+from app.app import create_app, db
+from app.archive import archive_loans
+from app.endpoints import Main
+from app.models import ArchivedLoan, Book, BorrowLog, User
+
+NOW = datetime.datetime(2018, 7, 1, 8, 0)
+
+
+class ArchiveTestCase(unittest.TestCase):
+    """Tests for moving returned loans to the archive table"""
+
+    def setUp(self):
+        """Actions to be performed before each test"""
+
+        self.app = create_app('testing')
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.book = Book(title='American Gods', available=1)
+        self.book.save()
+        user = User(email='reader@somewhere.com', first_name='Jane', last_name='Doe')
+        user.save()
+        self.headers = {'Authorization': 'Bearer ' + create_access_token(identity=user.email)}
+        for borrow_id, returned_days_ago in [('a', 400), ('b', 100), ('c', 20), ('d', None)]:
+            borrowed = NOW - datetime.timedelta(days=(returned_days_ago or 0) + 10)
+            returned = returned_days_ago is not None
+            BorrowLog(borrow_id=borrow_id, user_id=user.id, book_id=self.book.id,
+                      book_title=self.book.title, borrow_timestamp=borrowed,
+                      expected_return=borrowed + datetime.timedelta(days=14),
+                      return_timestamp=NOW - datetime.timedelta(days=returned_days_ago)
+                      if returned else None,
+                      returned=returned).save()
+        g.pop('users', None)
+
+    def tearDown(self):
+        """Actions to be performed after each test"""
+
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def history(self, **params):
+        """Return the borrow ids of every page of the user's history"""
+
+        response = self.client.get(Main.BORROWING_HISTORY, headers=self.headers,
+                                   query_string=params)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        if 'limit' not in params:
+            return [record['borrow_id'] for record in data]
+        pages = [[record['borrow_id'] for record in data['results']]]
+        while data['next'] != 'None':
+            data = json.loads(self.client.get(data['next'], headers=self.headers).data)
+            pages.append([record['borrow_id'] for record in data['results']])
+        return pages
+
+    def test_archive_loans(self):
+        """Test whether only loans returned long enough ago are moved, in batches"""
+
+        self.assertEqual(archive_loans(NOW, older_than_days=30, batch_size=1), 2)
+        self.assertEqual(sorted(loan.borrow_id for loan in BorrowLog.query), ['c', 'd'])
+        self.assertEqual(sorted(loan.borrow_id for loan in ArchivedLoan.query), ['a', 'b'])
+        self.assertEqual(archive_loans(NOW, older_than_days=30), 0)
+
+    def test_history_includes_archive(self):
+        """Test whether the history merges both tables and pages across them"""
+
+        archive_loans(NOW, older_than_days=30)
+        self.assertEqual(self.history(), ['a', 'b', 'c', 'd'])
+        self.assertEqual(self.history(limit=3), [['a', 'b', 'c'], ['d']])
+        self.assertEqual(self.history(limit=1, count='true'), [['a'], ['b'], ['c'], ['d']])
+
+        response = self.client.get(Main.UNRETURNED, headers=self.headers,
+                                   query_string={'returned': 'false'})
+        self.assertEqual(len(json.loads(response.data)), 1)
+
+
+    def test_history_in_borrowing_order(self):
+        """Test whether history pages follow borrowing time rather than borrow ids"""
+
+        BorrowLog.query.delete()
+        user = User.query.first()
+        for borrow_id, days_ago in [('z', 50), ('m', 40), ('x', 30), ('a', 30), ('b', 20)]:
+            borrowed = NOW - datetime.timedelta(days=days_ago)
+            BorrowLog(borrow_id=borrow_id, user_id=user.id, book_id=self.book.id,
+                      book_title=self.book.title, borrow_timestamp=borrowed,
+                      expected_return=borrowed + datetime.timedelta(days=14),
+                      return_timestamp=borrowed + datetime.timedelta(days=1),
+                      returned=True).save()
+        archive_loans(NOW, older_than_days=35)
+
+        expected = ['z', 'm', 'a', 'x', 'b']
+        self.assertEqual(self.history(), expected)
+        self.assertEqual(sum(self.history(limit=2), []), expected)
+
+        response = self.client.get(Main.BORROWING_HISTORY, headers=self.headers,
+                                   query_string={'limit': 2})
+        data = json.loads(self.client.get(json.loads(response.data)['next'],
+                                          headers=self.headers).data)
+        previous = json.loads(self.client.get(data['previous'], headers=self.headers).data)
+        self.assertEqual([record['borrow_id'] for record in previous['results']], ['z', 'm'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,14 @@
 """Contains all authentication tests"""
 
 import unittest
+import datetime
 import json
 import re
 from app.app import create_app, db, mail
 from app.endpoints import Auth
+from flask_jwt_extended import get_jti
+from app.models import RevokedToken, PasswordReset
+from app.revocation import blacklist
 
 
 class AuthTestCase(unittest.TestCase):
@@ -152,3 +156,41 @@ class AuthTestCase(unittest.TestCase):
         msg = json.loads(rv.data)['message']
         self.assertEqual(rv.status_code, 403)
         self.assertEqual(msg, 'You do not have permission to perform this action')
+
+    def test_revoked_token_persists(self):
+        """Test that a revoked token stays revoked for every worker"""
+
+        user = dict(self.user, confirm_password='user_pass', first_name='Jane', last_name='Doe')
+        self.register_user(user)
+        access_token = json.loads(self.login_user(user).data)['access_token']
+        headers = {'Authorization': 'Bearer {}'.format(access_token)}
+        logout = self.client.post(Auth.LOGOUT, headers=headers)
+        self.assertEqual(logout.status_code, 200)
+        self.assertEqual(RevokedToken.query.count(), 1)
+
+        # another worker has nothing cached for this token
+        blacklist.cache.clear()
+        logout = self.client.post(Auth.LOGOUT, headers=headers)
+        self.assertEqual(logout.status_code, 401)
+
+        # entries are purged once the token has expired
+        later = datetime.datetime.utcnow() + self.app.config['JWT_ACCESS_TOKEN_EXPIRES']
+        self.assertEqual(blacklist.purge(later + datetime.timedelta(seconds=1)), 1)
+
+    def test_reset_link_used_once(self):
+        """Test that a pending reset is stored hashed and can only be confirmed once"""
+
+        user = dict(self.user, confirm_password='user_pass', first_name='Jane', last_name='Doe')
+        self.register_user(user)
+        with mail.record_messages() as outbox:
+            self.client.post(Auth.RESET_PASSWORD,
+                             data=dict(email='user@somewhere.com', password='new_pass'))
+            reset_link = re.findall(r'/api/v1/auth/reset-password\?token=[a-zA-Z0-9._-]+',
+                                    outbox[0].html)[0]
+        token = reset_link.split('token=')[1]
+        reset = PasswordReset.query.one()
+        self.assertEqual(reset.token_hash, PasswordReset.hash_token(get_jti(token)))
+
+        self.assertEqual(self.client.post(reset_link).status_code, 200)
+        self.assertEqual(PasswordReset.query.count(), 0)
+        self.assertEqual(self.client.post(reset_link).status_code, 400)
@@ -0,0 +1,105 @@
+"""Contains tests for borrowing and returning several books at once"""
+
+import unittest
+import json
+from flask import g
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+from app.app import create_app, db
+from app.endpoints import Main
+from app.models import Book, BorrowLog, User
+
+
+class BatchBorrowTestCase(unittest.TestCase):
+    """Tests for the batch borrow and return endpoint"""
+
+    def setUp(self):
+        """Actions to be performed before each test"""
+
+        self.app = create_app('testing')
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.book_ids = []
+        for title, available in [('American Gods', 1), ('Anansi Boys', 2), ('Stardust', 1)]:
+            book = Book(title=title, available=available)
+            book.save()
+            self.book_ids.append(book.id)
+        user = User(email='user@somewhere.com', first_name='Jane', last_name='Doe')
+        user.save()
+        self.headers = {'content-type': 'application/json',
+                        'Authorization': 'Bearer {}'.format(create_access_token(identity=user.email))}
+
+    def tearDown(self):
+        """Actions to be performed after each test"""
+
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def send(self, method, book_ids):
+        response = getattr(self.client, method)(Main.BATCH_BORROW,
+                                                data=json.dumps({'book_ids': book_ids}),
+                                                headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return [(outcome['book_id'], outcome['status_code'])
+                for outcome in json.loads(response.data)['results']]
+
+    def test_batch_borrow(self):
+        """Test whether each book in a batch is borrowed or refused like a single borrow"""
+
+        american_gods, anansi_boys, stardust = self.book_ids
+        self.client.post('/api/v1/users/books/{}'.format(stardust), headers=self.headers)
+
+        outcomes = self.send('post', [american_gods, anansi_boys, anansi_boys, stardust, 999])
+        self.assertEqual(outcomes, [(american_gods, 200), (anansi_boys, 200), (anansi_boys, 403),
+                                    (stardust, 409), (999, 404)])
+        self.assertEqual(Book.get_by_id(anansi_boys).available, 1)
+        self.assertEqual(BorrowLog.query.count(), 3)
+
+        response = self.client.post(Main.BATCH_BORROW, data=json.dumps({'book_ids': 'all'}),
+                                    headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_return(self):
+        """Test whether a batch of books is returned in one request"""
+
+        american_gods, anansi_boys, stardust = self.book_ids
+        self.send('post', [american_gods, anansi_boys])
+
+        outcomes = self.send('put', [american_gods, anansi_boys, anansi_boys, stardust, 999])
+        self.assertEqual(outcomes, [(american_gods, 200), (anansi_boys, 200), (anansi_boys, 404),
+                                    (stardust, 404), (999, 404)])
+        self.assertEqual([Book.get_by_id(book_id).available for book_id in self.book_ids],
+                         [1, 2, 1])
+        self.assertEqual(BorrowLog.query.filter_by(returned=False).count(), 0)
+
+    def test_batch_lookups(self):
+        """Test whether books and open loans are looked up once per batch"""
+
+        selects = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                selects.append(statement)
+
+        def borrow(book_ids):
+            # start each request as a fresh one would, without cached rows
+            del selects[:]
+            db.session.remove()
+            g.pop('users', None)
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                self.send('post', book_ids)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+            return len(selects)
+
+        one = borrow(self.book_ids[:1])
+        self.send('put', self.book_ids[:1])
+        self.assertEqual(borrow(self.book_ids), one)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""Contains tests for the timestamps written when borrowing and returning books"""
+
+import unittest
+import datetime
+from app.app import create_app, db
+from app.clock import FakeClock, clock
+from app.models import Book, BorrowLog, User
+from app.utils import return_book
+
+START = datetime.datetime(2018, 7, 1, 8, 0)
+
+
+class ClockTestCase(unittest.TestCase):
+    """Tests for borrowing timestamps taken from the application clock"""
+
+    def setUp(self):
+        """Actions to be performed before each test"""
+
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.book = Book(title='American Gods', available=2)
+        self.book.save()
+        self.user = User(email='reader@somewhere.com', first_name='Jane', last_name='Doe')
+        self.user.save()
+
+    def tearDown(self):
+        """Actions to be performed after each test"""
+
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_borrow_timestamps(self):
+        """Test whether every borrow and return is stamped with the time it happened"""
+
+        with clock.use(FakeClock(START)) as fake:
+            first = self.user.borrow_book(self.book)
+            fake.advance(hours=2)
+            second = self.user.borrow_book(self.book)
+            fake.advance(days=3)
+            return_book(self.user, self.book)
+
+        self.assertEqual(first['borrowed_on'], START.isoformat())
+        self.assertEqual(first['expected_return'],
+                         (START + datetime.timedelta(days=14)).isoformat())
+        self.assertEqual(second['borrowed_on'], (START + datetime.timedelta(hours=2)).isoformat())
+        returned = BorrowLog.query.filter_by(returned=True).one()
+        self.assertEqual(returned.return_timestamp, START + datetime.timedelta(days=3, hours=2))
+        self.assertEqual(Book.get_by_id(self.book.id).modified, returned.return_timestamp)
+
+    def test_database_timestamps(self):
+        """Test whether the database can stamp borrowing records itself"""
+
+        self.app.config['DATABASE_TIMESTAMPS'] = True
+        before = datetime.datetime.utcnow().replace(microsecond=0)
+        with clock.use(FakeClock(START)):
+            details = self.user.borrow_book(self.book)
+
+        record = BorrowLog.query.get(details['borrow_id'])
+        self.assertGreaterEqual(record.borrow_timestamp, before)
+        self.assertLess(record.borrow_timestamp - before, datetime.timedelta(minutes=1))
+        self.assertEqual(record.expected_return - record.borrow_timestamp,
+                         datetime.timedelta(days=14))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+"""Contains concurrent borrowing and returning tests"""
+
+import unittest
+import json
+import threading
+from flask_jwt_extended import create_access_token
+from app.app import create_app, db
+from app.models import Book, BorrowLog, User
+
+
+class ConcurrencyTestCase(unittest.TestCase):
+    """Stress tests for the book inventory counters"""
+
+    copies = 5
+    borrowers = 20
+
+    def setUp(self):
+        """Actions to be performed before each test"""
+
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        book = Book(title='Ready Player One', available=self.copies)
+        book.save()
+        self.book_id = book.id
+        self.tokens = []
+        for i in range(self.borrowers):
+            user = User(email='user{}@somewhere.com'.format(i), first_name='Jane', last_name='Doe')
+            user.save()
+            self.tokens.append(create_access_token(identity=user.email))
+
+    def tearDown(self):
+        """Actions to be performed after each test"""
+
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def run_concurrently(self, method, tokens, url=None, body=None):
+        """Send one request per token at the same time and return the status codes"""
+
+        url = url or '/api/v1/users/books/{}'.format(self.book_id)
+        barrier = threading.Barrier(len(tokens))
+        statuses = []
+
+        def send(token):
+            client = self.app.test_client()
+            barrier.wait()
+            response = getattr(client, method)(
+                url, data=json.dumps(body) if body else None,
+                content_type='application/json',
+                headers={'Authorization': 'Bearer {}'.format(token)})
+            statuses.append(response.status_code)
+
+        threads = [threading.Thread(target=send, args=(token,)) for token in tokens]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return statuses
+
+    def test_no_overselling(self):
+        """Test that concurrent borrowers cannot take more copies than exist"""
+
+        statuses = self.run_concurrently('post', self.tokens)
+        self.assertEqual(statuses.count(200), self.copies)
+        self.assertEqual(statuses.count(409), self.borrowers - self.copies)
+        db.session.expire_all()
+        self.assertEqual(Book.get_by_id(self.book_id).available, 0)
+        self.assertEqual(BorrowLog.query.count(), self.copies)
+
+    def test_single_return(self):
+        """Test that a loan returned concurrently only restocks the book once"""
+
+        client = self.app.test_client()
+        token = self.tokens[0]
+        borrow = client.post('/api/v1/users/books/{}'.format(self.book_id),
+                             headers={'Authorization': 'Bearer {}'.format(token)})
+        self.assertEqual(json.loads(borrow.data)['msg'], 'You have successfully borrowed this book')
+
+        statuses = self.run_concurrently('put', [token] * 4)
+        self.assertEqual(statuses.count(200), 1)
+        db.session.expire_all()
+        self.assertEqual(Book.get_by_id(self.book_id).available, self.copies)
+
+    def test_concurrent_creates(self):
+        """Test that creating the same new book concurrently adds copies instead of failing"""
+
+        admin = User(email='admin@somewhere.com', first_name='Jane', last_name='Doe',
+                     is_admin=True)
+        admin.save()
+        token = create_access_token(identity=admin.email)
+        book = {'title': 'Snow Crash', 'isbn': '9780553380958'}
+
+        statuses = self.run_concurrently('post', [token] * 4, url='/api/v1/books', body=book)
+        self.assertEqual(statuses, [201] * 4)
+        db.session.expire_all()
+        self.assertEqual(Book.get_by_isbn(book['isbn']).available, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,13 @@
 """Contains all book CRUD tests"""
 
 import unittest
+import datetime
 import json
 from flask import current_app
 from app.endpoints import Main
 from app.app import create_app, db
+from app.models import Book
+from app.search import reindex
 
 
 class CRUDTestCase(unittest.TestCase):
@@ -149,23 +152,36 @@ class CRUDTestCase(unittest.TestCase):
         p_results = json.loads(p.data)['results']
         self.assertEqual(p.status_code, 200)
         self.assertEqual(p_prev, 'None')
-        self.assertEqual(p_next, '/api/v1/books?page=2&limit={}'.format(limit))
+        self.assertIn('cursor=', p_next)
+        self.assertIn('limit={}'.format(limit), p_next)
         self.assertEqual(len(p_results), limit)
-        
+
         # get the next page
-        np = self.client.get('/api/v1/books?page=2&limit={}'.format(limit),
-                             headers={'Authorization': 'Bearer {}'.format(access_token)})
+        np = self.client.get(p_next, headers={'Authorization': 'Bearer {}'.format(access_token)})
         np_prev = json.loads(np.data)['previous']
         np_next = json.loads(np.data)['next']
         np_results = json.loads(np.data)['results']
         self.assertEqual(np.status_code, 200)
-        self.assertEqual(np_prev, '/api/v1/books?page=1&limit={}'.format(limit))
+        self.assertIn('cursor=', np_prev)
         self.assertEqual(np_next, 'None')
         self.assertEqual(len(np_results), total-limit)
+        self.assertEqual(np_results[0]['title'], 'Book {}'.format(limit + 1))
 
         # previous page
         prev = self.client.get(np_prev, headers={'Authorization': 'Bearer {}'.format(access_token)})
         self.assertEqual(prev.status_code, 200)
+        self.assertEqual(json.loads(prev.data)['results'], p_results)
+
+        # legacy page numbers and result counts
+        second = self.client.get('/api/v1/books?page=2&limit={}&count=true'.format(limit),
+                                 headers={'Authorization': 'Bearer {}'.format(access_token)})
+        self.assertEqual(json.loads(second.data)['results'], np_results)
+        self.assertEqual(json.loads(second.data)['count'], total)
+
+        # invalid cursor
+        invalid = self.client.get('/api/v1/books?cursor=abc&limit={}'.format(limit),
+                                  headers={'Authorization': 'Bearer {}'.format(access_token)})
+        self.assertEqual(invalid.status_code, 400)
 
         # invalid page number
         invalid = self.client.get('/api/v1/books?page=5&limit={}'.format(limit),
@@ -174,6 +190,239 @@ class CRUDTestCase(unittest.TestCase):
         self.assertEqual(msg, 'The requested page was not found')
         self.assertEqual(invalid.status_code, 404)
 
+    def test_stream_books(self):
+        """Test whether the api can stream the whole catalogue"""
+
+        user = dict(self.user, confirm_password='mypass', first_name='Jane', last_name='Doe')
+        access_token = self.get_access_token(user)
+        for i in range(1, 4):
+            self.book['title'] = 'Book {}'.format(i)
+            self.client.post(Main.ADD_BOOK, data=json.dumps(self.book),
+                             headers={'content-type': 'application/json',
+                                      'Authorization': 'Bearer {}'.format(access_token)})
+
+        # chunked json array
+        response = self.client.get('/api/v1/books?stream=1')
+        self.assertEqual(response.status_code, 200)
+        titles = [book['title'] for book in json.loads(response.data)]
+        self.assertEqual(titles, ['Book 1', 'Book 2', 'Book 3'])
+
+        # newline delimited json
+        response = self.client.get('/api/v1/books', headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.data.decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[2])['title'], 'Book 3')
+
+    def test_catalogue_cache(self):
+        """Test that catalogue reads are cached and invalidated by writes"""
+
+        user = dict(self.user, confirm_password='mypass', first_name='Jane', last_name='Doe')
+        headers = {'content-type': 'application/json',
+                   'Authorization': 'Bearer {}'.format(self.get_access_token(user))}
+        response = self.client.post(Main.ADD_BOOK, data=json.dumps(self.book), headers=headers)
+        book_id = json.loads(response.data)['details']['id']
+        book_url = '/api/v1/books/{}'.format(book_id)
+
+        self.client.get(book_url)
+        self.client.get(Main.ALL_BOOKS)
+        self.client.get(book_url)
+        self.client.get(Main.ALL_BOOKS)
+        stats = json.loads(self.client.get(Main.CACHE_STATS, headers=headers).data)
+        self.assertEqual((stats['hits'], stats['misses']), (2, 2))
+
+        # modifying the book must not serve the stale copy
+        self.book['subcategory'] = 'science fiction'
+        self.client.put(book_url, data=json.dumps(self.book), headers=headers)
+        self.assertIn('science fiction', str(self.client.get(book_url).data))
+        self.assertIn('science fiction', str(self.client.get(Main.ALL_BOOKS).data))
+
+        # neither must borrowing it
+        self.client.post('/api/v1/users/books/{}'.format(book_id), headers=headers)
+        self.assertEqual(json.loads(self.client.get(book_url).data)['available'], 0)
+
+    def test_modify_book_isbn(self):
+        """Test that editing a book to another book's ISBN is refused, not a server error"""
+
+        user = dict(self.user, confirm_password='mypass', first_name='Jane', last_name='Doe')
+        headers = {'content-type': 'application/json',
+                   'Authorization': 'Bearer {}'.format(self.get_access_token(user))}
+        urls = []
+        for title, isbn in [('American Gods', '9780380973651'), ('Anansi Boys', '')]:
+            response = self.client.post(Main.ADD_BOOK, data=json.dumps(
+                dict(self.book, title=title, isbn=isbn)), headers=headers)
+            urls.append('/api/v1/books/{}'.format(json.loads(response.data)['details']['id']))
+
+        # blank ISBNs are stored as null, so any number of books may have one
+        response = self.client.put(urls[0], data=json.dumps(dict(self.book, isbn='')),
+                                   headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(json.loads(response.data)['details']['isbn'])
+
+        self.client.put(urls[0], data=json.dumps(dict(self.book, isbn='9780380973651')),
+                        headers=headers)
+        response = self.client.put(urls[1], data=json.dumps(dict(self.book, isbn='9780380973651')),
+                                   headers=headers)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(self.client.get(urls[1]).data)['isbn'], None)
+
+    def test_typed_serialization(self):
+        """Test whether books are returned with typed values"""
+
+        user = dict(self.user, confirm_password='mypass', first_name='Jane', last_name='Doe')
+        headers = {'content-type': 'application/json',
+                   'Authorization': 'Bearer {}'.format(self.get_access_token(user))}
+        self.client.post(Main.ADD_BOOK, data=json.dumps(self.book), headers=headers)
+
+        book = json.loads(self.client.get(Main.ALL_BOOKS).data)[0]
+        self.assertIsInstance(book['id'], int)
+        self.assertEqual(book['available'], 1)
+        self.assertIsNone(book['isbn'])
+        self.assertIsNone(book['modified'])
+        self.assertEqual(datetime.datetime.fromisoformat(book['added']).date(),
+                         datetime.datetime.utcnow().date())
+
+        self.client.post('/api/v1/users/books/{}'.format(book['id']), headers=headers)
+        record = json.loads(self.client.get(Main.BORROWING_HISTORY, headers=headers).data)[0]
+        self.assertIs(record['return_status'], False)
+        self.assertIsNone(record['returned_on'])
+        self.assertIn('T', record['borrowed_on'])
+
+    def test_conditional_get(self):
+        """Test that unchanged books are answered with 304 Not Modified"""
+
+        user = dict(self.user, confirm_password='mypass', first_name='Jane', last_name='Doe')
+        headers = {'content-type': 'application/json',
+                   'Authorization': 'Bearer {}'.format(self.get_access_token(user))}
+        response = self.client.post(Main.ADD_BOOK, data=json.dumps(self.book), headers=headers)
+        book_url = '/api/v1/books/{}'.format(json.loads(response.data)['details']['id'])
+
+        for url in (book_url, Main.ALL_BOOKS):
+            response = self.client.get(url)
+            etag = response.headers['ETag']
+            unchanged = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(unchanged.status_code, 304)
+            self.assertEqual(unchanged.data, b'')
+
+        response = self.client.get(book_url)
+        since = self.client.get(book_url, headers={
+            'If-Modified-Since': response.headers['Last-Modified']})
+        self.assertEqual(since.status_code, 304)
+        # listings have no Last-Modified that deletions could move forward
+        self.assertNotIn('Last-Modified', self.client.get(Main.ALL_BOOKS).headers)
+
+        # borrowing changes both the book and the listing
+        etags = {url: self.client.get(url).headers['ETag'] for url in (book_url, Main.ALL_BOOKS)}
+        self.client.post('/api/v1/users/books/{}'.format(book_url.split('/')[-1]), headers=headers)
+        for url, etag in etags.items():
+            changed = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(changed.status_code, 200)
+
+        # and deleting a book changes the listing
+        self.client.post(Main.ADD_BOOK, data=json.dumps(dict(self.book, title='Other')),
+                         headers=headers)
+        etag = self.client.get(Main.ALL_BOOKS).headers['ETag']
+        self.client.delete(book_url, headers=headers)
+        changed = self.client.get(Main.ALL_BOOKS, headers={'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+
+    def test_search_books(self):
+        """Test whether books can be searched with prefixes, filters and facets"""
+
+        user = dict(self.user, confirm_password='mypass', first_name='Jane', last_name='Doe')
+        headers = {'content-type': 'application/json',
+                   'Authorization': 'Bearer {}'.format(self.get_access_token(user))}
+        books = [
+            {'title': 'American Gods', 'author': 'Neil Gaiman', 'category': 'fiction',
+             'subcategory': 'fantasy'},
+            {'title': 'Anansi Boys', 'author': 'Neil Gaiman', 'category': 'fiction',
+             'subcategory': 'fantasy'},
+            {'title': 'Gods of Rome', 'author': 'Mary Beard', 'category': 'history',
+             'subcategory': 'ancient'},
+        ]
+        for book in books:
+            self.client.post(Main.ADD_BOOK, data=json.dumps(book), headers=headers)
+
+        response = self.client.get(Main.SEARCH + '?q=god')
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.data)
+        self.assertEqual(result['count'], 2)
+        self.assertEqual(result['facets']['category'], {'fiction': 1, 'history': 1})
+
+        result = json.loads(self.client.get(Main.SEARCH + '?q=gaim gods').data)
+        self.assertEqual([book['title'] for book in result['results']], ['American Gods'])
+
+        result = json.loads(self.client.get(Main.SEARCH + '?q=neil&limit=1').data)
+        self.assertEqual(len(result['results']), 1)
+        self.assertIn('page=2', result['next'])
+
+        result = json.loads(self.client.get(Main.SEARCH + '?category=history').data)
+        self.assertEqual(result['results'][0]['title'], 'Gods of Rome')
+
+        # edits are reflected in the index
+        book_id = result['results'][0]['id']
+        self.client.put('/api/v1/books/{}'.format(book_id), data=json.dumps({'title': 'SPQR'}),
+                        headers=headers)
+        result = json.loads(self.client.get(Main.SEARCH + '?q=spqr').data)
+        self.assertEqual(result['count'], 1)
+
+    def test_search_books_inserted_directly(self):
+        """Test whether books written straight to the table are found once reindexed"""
+
+        db.session.execute(Book.__table__.insert(), [
+            {'title': 'Neverwhere', 'author': 'Neil Gaiman', 'available': 1},
+            {'title': 'Stardust', 'author': 'Neil Gaiman', 'available': 1},
+        ])
+        db.session.commit()
+        self.assertEqual(reindex(), 0 if db.engine.dialect.name == 'postgresql' else 2)
+
+        result = json.loads(self.client.get(Main.SEARCH + '?q=neverwh').data)
+        self.assertEqual([book['title'] for book in result['results']], ['Neverwhere'])
+        self.assertEqual(json.loads(self.client.get(Main.SEARCH + '?q=gaiman').data)['count'], 2)
+
+    def test_bulk_import(self):
+        """Test whether books can be imported in bulk as JSON, NDJSON and CSV"""
+
+        user = dict(self.user, confirm_password='mypass', first_name='Jane', last_name='Doe')
+        auth = {'Authorization': 'Bearer {}'.format(self.get_access_token(user))}
+        self.client.post(Main.ADD_BOOK, data=json.dumps(dict(self.book, isbn='111')),
+                         headers=dict(auth, **{'content-type': 'application/json'}))
+
+        books = [
+            {'title': 'Anansi Boys', 'isbn': '222', 'available': 2},
+            {'title': 'American Gods', 'isbn': '111'},
+            {'isbn': '333'},
+            {'title': 'Anansi Boys', 'isbn': '222'},
+        ]
+        response = self.client.post(Main.BULK_ADD_BOOKS, data=json.dumps(books),
+                                    headers=dict(auth, **{'content-type': 'application/json'}))
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.data)
+        self.assertEqual((result['created'], result['updated'], result['failed']), (1, 2, 1))
+        self.assertEqual(result['errors'][0]['row'], 3)
+        available = {book['isbn']: book['available']
+                     for book in json.loads(self.client.get(Main.ALL_BOOKS).data)}
+        self.assertEqual(available, {'111': 2, '222': 3})
+
+        ndjson = '{"title": "Neverwhere", "isbn": "444"}\nnot json\n\n{"title": "Stardust"}\n'
+        response = self.client.post(Main.BULK_ADD_BOOKS, data=ndjson,
+                                    headers=dict(auth, **{'content-type': 'application/x-ndjson'}))
+        result = json.loads(response.data)
+        self.assertEqual((result['created'], result['failed']), (2, 1))
+
+        rows = 'title,isbn,available\nCoraline,555,4\nNeverwhere,444,\nGood Omens,666,none\n'
+        response = self.client.post(Main.BULK_ADD_BOOKS, data=rows,
+                                    headers=dict(auth, **{'content-type': 'text/csv'}))
+        result = json.loads(response.data)
+        self.assertEqual((result['created'], result['updated'], result['failed']), (1, 1, 1))
+        self.assertEqual(len(json.loads(self.client.get(Main.ALL_BOOKS).data)), 5)
+        response = self.client.get(Main.SEARCH + '?q=coraline')
+        self.assertEqual(json.loads(response.data)['count'], 1)
+
+        response = self.client.post(Main.BULK_ADD_BOOKS, data='{}',
+                                    headers=dict(auth, **{'content-type': 'application/json'}))
+        self.assertEqual(response.status_code, 400)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,150 @@
+"""Contains tests for request instrumentation and the metrics endpoint"""
+
+import unittest
+import json
+import os
+from unittest import mock
+from flask import g
+from flask_jwt_extended import create_access_token
+from sqlalchemy.engine.url import make_url
+from app.app import create_app, db
+from app import importer
+from app.database import InstrumentedQueuePool
+from app.endpoints import Main
+from app.instrumentation import instrumentation
+from app.models import Book, User
+
+
+class InstrumentationTestCase(unittest.TestCase):
+    """Tests for the opt-in instrumentation layer"""
+
+    def setUp(self):
+        """Actions to be performed before each test"""
+
+        self.app = create_app('testing')
+        self.app.config['INSTRUMENTATION_ENABLED'] = True
+        self.app.config['SQLALCHEMY_POOL_SIZE'] = 2
+        self.app.config['SQLALCHEMY_POOL_PRE_PING'] = True
+        instrumentation.init_app(self.app)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        admin = User(email='admin@somewhere.com', first_name='Jane', last_name='Doe',
+                     is_admin=True)
+        reader = User(email='reader@somewhere.com', first_name='John', last_name='Doe')
+        reader.set_password('mypass')
+        admin.save()
+        reader.save()
+        self.admin = {'Authorization': 'Bearer ' + create_access_token(identity=admin.email)}
+        self.reader = {'Authorization': 'Bearer ' + create_access_token(identity=reader.email)}
+        g.pop('users', None)
+
+    def tearDown(self):
+        """Actions to be performed after each test"""
+
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        instrumentation.enabled = False
+
+    def test_metrics(self):
+        """Test whether requests, SQL statements and hashing are reported per endpoint"""
+
+        Book(title='American Gods').save()
+        self.client.get(Main.ALL_BOOKS)
+        self.client.post('/api/v1/auth/login',
+                         data=json.dumps({'email': 'reader@somewhere.com', 'password': 'mypass'}),
+                         headers={'content-type': 'application/json'})
+
+        response = self.client.get(Main.METRICS, headers=self.admin)
+        self.assertEqual(response.status_code, 200)
+        metrics = {}
+        for line in response.data.decode().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                metrics[name] = float(value)
+        books = 'endpoint="/api/v1/books",method="GET"'
+        login = 'endpoint="/api/v1/auth/login",method="POST"'
+        self.assertEqual(metrics['hellobooks_requests_total{' + books + ',status="200"}'], 1)
+        self.assertEqual(
+            metrics['hellobooks_request_duration_seconds_bucket{' + books + ',le="+Inf"}'], 1)
+        self.assertGreater(metrics['hellobooks_sql_statements_total{' + books + '}'], 0)
+        self.assertGreater(metrics['hellobooks_json_seconds_total{' + books + '}'], 0)
+        self.assertGreater(metrics['hellobooks_password_hash_seconds_total{' + login + '}'], 0)
+        self.assertEqual(metrics['hellobooks_password_hash_seconds_total{' + books + '}'], 0)
+
+        response = self.client.get(Main.METRICS, headers=self.reader)
+        self.assertEqual(response.status_code, 403)
+
+    def test_pool_metrics(self):
+        """Test whether the configured pool is used and its statistics reported"""
+
+        self.assertEqual(db.engine.pool.size(), 2)
+        self.assertTrue(db.engine.pool._pre_ping)
+        self.client.get(Main.ALL_BOOKS)
+
+        response = self.client.get(Main.METRICS, headers=self.admin)
+        metrics = dict(line.rsplit(' ', 1) for line in response.data.decode().splitlines()
+                       if line.startswith('hellobooks_db_pool'))
+        self.assertEqual(metrics['hellobooks_db_pool_size'], '2')
+        self.assertGreater(int(metrics['hellobooks_db_pool_checkouts_total']), 0)
+        self.assertEqual(metrics['hellobooks_db_pool_timeouts_total'], '0')
+        self.assertIn('hellobooks_db_pool_wait_seconds_total', metrics)
+
+    def test_postgres_engine_options(self):
+        """Test whether PostgreSQL connections get the configured statement timeout"""
+
+        self.app.config['SQLALCHEMY_STATEMENT_TIMEOUT'] = 1500
+        self.app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'options': '-c jit=off'}}
+        options = {}
+        db.apply_driver_hacks(self.app, make_url('postgresql://localhost/db'), options)
+        self.assertEqual(options['connect_args']['options'], '-c jit=off -c statement_timeout=1500')
+        self.assertIs(options['poolclass'], InstrumentedQueuePool)
+        self.assertEqual(self.app.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args']['options'],
+                         '-c jit=off')
+
+    def test_bulk_import_statement_timeout(self):
+        """Test whether the first import batch already runs with the import's timeout"""
+
+        if db.engine.dialect.name != 'postgresql':
+            self.skipTest('statement timeouts are only set on PostgreSQL')
+        self.app.config['BULK_IMPORT_STATEMENT_TIMEOUT'] = 12345
+        timeouts = []
+        upsert_books = importer.upsert_books
+
+        def upsert_and_show_timeout(connection, rows):
+            timeouts.append(connection.execute('SHOW statement_timeout').scalar())
+            return upsert_books(connection, rows)
+
+        with mock.patch('app.importer.upsert_books', upsert_and_show_timeout):
+            response = self.client.post(Main.BULK_ADD_BOOKS, headers=self.admin,
+                                        data=json.dumps([{'title': 'Neverwhere'}]),
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(timeouts, ['12345ms'])
+
+    def test_slow_requests_are_logged(self):
+        """Test whether requests and queries above the thresholds are logged"""
+
+        instrumentation.slow_request = 0
+        instrumentation.slow_query = 0
+        with self.assertLogs(self.app.logger, 'WARNING') as logs:
+            self.client.get(Main.ALL_BOOKS)
+        self.assertTrue(any('Slow request: GET /api/v1/books' in line for line in logs.output))
+        self.assertTrue(any('Slow query' in line for line in logs.output))
+
+    def test_profile_header(self):
+        """Test whether admins can profile a request"""
+
+        response = self.client.get(Main.ALL_BOOKS, headers=dict(self.reader, **{'X-Profile': '1'}))
+        self.assertNotIn('X-Profile-File', response.headers)
+
+        response = self.client.get(Main.ALL_BOOKS, headers=dict(self.admin, **{'X-Profile': '1'}))
+        path = response.headers['X-Profile-File']
+        self.assertTrue(os.path.exists(path))
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
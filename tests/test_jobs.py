@@ -0,0 +1,112 @@
+"""Contains tests for the scheduled background jobs"""
+
+import unittest
+import datetime
+import threading
+import json
+from flask import g
+from flask_jwt_extended import create_access_token
+from app.app import create_app, db
+from app.clock import FakeClock
+from app.endpoints import Main
+from app.jobs import scheduler
+from app.models import BorrowLog, JobState, OutgoingMail, PasswordReset, User
+
+START = datetime.datetime(2018, 7, 1, 8, 0)
+
+
+class JobsTestCase(unittest.TestCase):
+    """Tests for the scheduler and the overdue scan"""
+
+    def setUp(self):
+        """Actions to be performed before each test"""
+
+        self.app = create_app('testing')
+        self.app.config['OVERDUE_SCAN_BATCH_SIZE'] = 2
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(email='reader@somewhere.com', first_name='Jane', last_name='Doe')
+        self.user.save()
+
+    def tearDown(self):
+        """Actions to be performed after each test"""
+
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def lend(self, borrow_id, due_days, returned=False):
+        """Add a loan due due_days after START"""
+
+        BorrowLog(borrow_id=borrow_id, user_id=self.user.id, book_id=1, book_title=borrow_id,
+                  borrow_timestamp=START - datetime.timedelta(days=14),
+                  expected_return=START + datetime.timedelta(days=due_days),
+                  returned=returned).save()
+
+    def reminders(self):
+        return sorted(mail.subject for mail in OutgoingMail.query)
+
+    def test_overdue_scan(self):
+        """Test whether every overdue loan is reminded about once, in batches"""
+
+        for borrow_id, due_days in [('a', -3), ('b', -2), ('c', -2), ('d', -1), ('e', 2)]:
+            self.lend(borrow_id, due_days)
+        self.lend('returned', -2, returned=True)
+
+        self.assertEqual(scheduler.run_pending(START)['overdue_reminders'], 4)
+        self.assertEqual(self.reminders(), ['Overdue book: a', 'Overdue book: b',
+                                            'Overdue book: c', 'Overdue book: d'])
+        state = JobState.query.get('overdue_reminders')
+        self.assertEqual((state.mark_time, state.mark_id), (START - datetime.timedelta(days=1), 'd'))
+
+        # not due again until the interval has passed
+        self.assertNotIn('overdue_reminders', scheduler.run_pending(START))
+        self.lend('f', 1)
+        later = START + datetime.timedelta(days=3)
+        self.assertEqual(scheduler.run_pending(later)['overdue_reminders'], 2)
+        self.assertEqual(len(self.reminders()), 6)
+        self.assertEqual(self.reminders()[-2:], ['Overdue book: e', 'Overdue book: f'])
+
+    def test_worker_with_fake_clock(self):
+        """Test whether the worker runs each job at its interval and purges expired rows"""
+
+        self.app.config['SCHEDULER_TICK'] = 600
+        db.session.add(PasswordReset(token_hash='expired', email=self.user.email,
+                                     expires=START + datetime.timedelta(minutes=30)))
+        db.session.commit()
+        self.lend('a', 0)
+
+        stop = threading.Event()
+        clock = FakeClock(START)
+
+        def sleep(seconds):
+            clock.sleep(seconds)
+            if clock.now() >= START + datetime.timedelta(hours=2):
+                stop.set()
+
+        scheduler.run(self.app, stop=stop, clock=clock.now, sleep=sleep)
+
+        state = JobState.query.get('overdue_reminders')
+        self.assertEqual(state.last_run, START + datetime.timedelta(hours=1))
+        self.assertEqual(self.reminders(), ['Overdue book: a'])
+        self.assertEqual(PasswordReset.query.count(), 0)
+
+    def test_overdue_listing(self):
+        """Test whether admins can list the overdue loans"""
+
+        self.lend('a', -1)
+        self.lend('b', (datetime.datetime.utcnow() - START).days + 10)
+        admin = User(email='admin@somewhere.com', first_name='John', last_name='Doe',
+                     is_admin=True)
+        admin.save()
+        headers = {'Authorization': 'Bearer ' + create_access_token(identity=admin.email)}
+        g.pop('users', None)
+        response = self.client.get(Main.OVERDUE, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([loan['borrow_id'] for loan in json.loads(response.data)], ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
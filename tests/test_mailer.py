@@ -0,0 +1,114 @@
+"""Contains tests for the outgoing mail queue"""
+
+import unittest
+import datetime
+import socketserver
+import threading
+from flask_mail import Message
+from app.app import create_app, db, mail
+from app.mailer import enqueue, deliver_pending
+from app.models import OutgoingMail
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough of SMTP to accept messages"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost ready')
+        in_data = False
+        for line in self.rfile:
+            if in_data:
+                if line == b'.\r\n':
+                    in_data = False
+                    self.server.messages += 1
+                    self.reply('250 OK')
+                continue
+            command = line[:4].upper()
+            if command in (b'EHLO', b'HELO'):
+                self.reply('250 localhost')
+            elif command == b'DATA':
+                in_data = True
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                break
+            else:
+                self.reply('250 OK')
+
+
+class MailQueueTestCase(unittest.TestCase):
+    """Tests for queueing and delivering emails"""
+
+    def setUp(self):
+        """Actions to be performed before each test"""
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPHandler)
+        self.server.connections = 0
+        self.server.messages = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.app = create_app('testing')
+        self.app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=self.server.server_address[1],
+                               MAIL_USE_TLS=False, MAIL_SUPPRESS_SEND=False,
+                               MAIL_DEFAULT_SENDER='library@somewhere.com',
+                               MAIL_OUTBOX_EAGER=False)
+        mail.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        """Actions to be performed after each test"""
+
+        self.server.shutdown()
+        self.server.server_close()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def queue(self, count):
+        """Queue count emails"""
+
+        for i in range(count):
+            message = Message(subject='Message {}'.format(i), recipients=['user@somewhere.com'])
+            message.html = '<p>Hello</p>'
+            enqueue(message)
+
+    def test_delivery_reuses_connection(self):
+        """Test that queued emails are sent over a single connection"""
+
+        self.queue(3)
+        self.assertEqual(self.server.messages, 0)
+        self.assertEqual(deliver_pending(), (3, 0))
+        self.assertEqual(self.server.messages, 3)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(OutgoingMail.query.filter(OutgoingMail.sent.is_(None)).count(), 0)
+        self.assertEqual(deliver_pending(), (0, 0))
+
+    def test_failed_delivery_is_retried(self):
+        """Test that emails are retried with backoff when the server is unreachable"""
+
+        self.queue(1)
+        self.app.config['MAIL_PORT'] = 1
+        mail.init_app(self.app)
+        now = datetime.datetime.utcnow()
+        self.assertEqual(deliver_pending(now), (0, 1))
+        record = OutgoingMail.query.first()
+        self.assertEqual(record.attempts, 1)
+        self.assertTrue(record.last_error)
+        self.assertGreater(record.next_attempt, now)
+
+        # nothing is due until the backoff has passed
+        self.assertEqual(deliver_pending(now), (0, 0))
+        self.app.config['MAIL_PORT'] = self.server.server_address[1]
+        mail.init_app(self.app)
+        self.assertEqual(deliver_pending(record.next_attempt), (1, 0))
+        self.assertEqual(self.server.messages, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
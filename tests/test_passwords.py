@@ -0,0 +1,89 @@
+"""Contains tests for password hashing"""
+
+import unittest
+import json
+from unittest import mock
+from werkzeug.security import generate_password_hash
+from app.app import create_app, db
+from app.endpoints import Auth
+from app.models import User
+from app.passwords import HashingBusy, hasher
+
+
+class PasswordTestCase(unittest.TestCase):
+    """Tests for hashing parameters, rehashing and the limits on concurrent hashes"""
+
+    def setUp(self):
+        """Actions to be performed before each test"""
+
+        self.app = create_app('testing')
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(email='reader@somewhere.com', first_name='Jane', last_name='Doe',
+                         password=generate_password_hash('mypass', 'pbkdf2:sha256:1000'))
+        self.user.save()
+
+    def tearDown(self):
+        """Actions to be performed after each test"""
+
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self, password='mypass'):
+        return self.client.post(Auth.LOGIN, headers={'content-type': 'application/json'},
+                                data=json.dumps({'email': self.user.email, 'password': password}))
+
+    def stored_hash(self):
+        db.session.expire_all()
+        return User.query.get(self.user.id).password
+
+    def test_rehash_on_login(self):
+        """Test whether hashes made with outdated parameters are replaced at login"""
+
+        self.assertEqual(self.login('wrong').status_code, 401)
+        self.assertTrue(self.stored_hash().startswith('pbkdf2:sha256:1000$'))
+
+        self.assertEqual(self.login().status_code, 200)
+        upgraded = self.stored_hash()
+        self.assertTrue(upgraded.startswith(self.app.config['PASSWORD_HASH_METHOD'] + '$'))
+        self.assertFalse(hasher.needs_rehash(upgraded))
+
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(self.stored_hash(), upgraded)
+
+    def test_rehash_skipped_when_busy(self):
+        """Test whether a correct login succeeds when there is no room to rehash"""
+
+        with mock.patch.object(hasher, 'hash', side_effect=HashingBusy):
+            self.assertEqual(self.login().status_code, 200)
+        self.assertTrue(self.stored_hash().startswith('pbkdf2:sha256:1000$'))
+
+    def test_busy_hashing(self):
+        """Test whether logins are turned away when every hashing place is taken"""
+
+        self.app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE=0,
+                               PASSWORD_HASH_TIMEOUT=0.01)
+        hasher.configure(self.app.config)
+        hasher.slots.acquire()
+        try:
+            response = self.login()
+        finally:
+            hasher.slots.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(self.login().status_code, 200)
+
+    def test_unlimited_hashing(self):
+        """Test whether hashing works without limits"""
+
+        self.app.config['PASSWORD_HASH_WORKERS'] = 0
+        hasher.configure(self.app.config)
+        self.assertIsNone(hasher.slots)
+        self.assertEqual(self.login().status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,230 @@
+"""Contains tests guarding against per-row database queries"""
+
+import unittest
+import datetime
+import json
+from flask import current_app
+from sqlalchemy import event, true, tuple_
+from app.app import create_app, db
+from app.models import Book, BorrowLog, User, borrow_history_serializer
+
+
+class QueryCountTestCase(unittest.TestCase):
+    """Tests that list endpoints run a constant number of SQL statements"""
+
+    def setUp(self):
+        """Actions to be performed before each test"""
+
+        self.app = create_app('testing')
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = {
+            'email': current_app.config['ADMIN'][0],
+            'password': 'mypass',
+            'confirm_password': 'mypass',
+            'first_name': 'Jane',
+            'last_name': 'Doe'
+        }
+        self.client.post('/api/v1/auth/register', data=self.user)
+        login = self.client.post('/api/v1/auth/login', data=self.user)
+        self.headers = {
+            'content-type': 'application/json',
+            'Authorization': 'Bearer {}'.format(json.loads(login.data)['access_token'])
+        }
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.record_statement)
+
+    def tearDown(self):
+        """Actions to be performed after each test"""
+
+        event.remove(db.engine, 'before_cursor_execute', self.record_statement)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def record_statement(self, conn, cursor, statement, *args):
+        """Record every statement sent to the database"""
+
+        self.statements.append(statement)
+
+    def borrow_books(self, count):
+        """Add and borrow count books"""
+
+        for i in range(count):
+            res = self.client.post('/api/v1/books', data=json.dumps({'title': 'Book {}'.format(i)}),
+                                   headers=self.headers)
+            book_id = json.loads(res.data)['details']['id']
+            self.client.post('/api/v1/users/books/{}'.format(book_id), headers=self.headers)
+
+    def count_statements(self, url):
+        """Return the number of statements run while serving url"""
+
+        self.statements = []
+        response = self.client.get(url, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return len(self.statements)
+
+    def test_unreturned_query_count(self):
+        """Test that listing un-returned books does not query once per book"""
+
+        self.borrow_books(1)
+        few = self.count_statements('/api/v1/users/books?returned=false')
+        self.borrow_books(10)
+        many = self.count_statements('/api/v1/users/books?returned=false')
+        self.assertEqual(few, many)
+
+    def test_history_query_count(self):
+        """Test that the borrowing history does not query once per record"""
+
+        self.borrow_books(1)
+        few = self.count_statements('/api/v1/users/books')
+        self.borrow_books(10)
+        many = self.count_statements('/api/v1/users/books')
+        self.assertEqual(few, many)
+        self.assertEqual(self.count_statements('/api/v1/users/books?limit=5'), few)
+
+    def test_cached_reads_skip_database(self):
+        """Test that catalogue reads answered from the cache, or with 304, run no query"""
+
+        self.borrow_books(1)
+        for url in ('/api/v1/books/1', '/api/v1/books'):
+            etag = self.client.get(url).headers['ETag']
+            self.statements = []
+            self.assertEqual(self.client.get(url).status_code, 200)
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(self.statements, [])
+
+    def test_single_user_lookup(self):
+        """Test that the current user is looked up at most once per request"""
+
+        res = self.client.post('/api/v1/books', data=json.dumps({'title': 'Book'}),
+                               headers=self.headers)
+        book_id = json.loads(res.data)['details']['id']
+
+        self.statements = []
+        self.client.post('/api/v1/books', data=json.dumps({'title': 'Book'}), headers=self.headers)
+        self.assertEqual(self.user_lookups(), 0)
+
+        self.statements = []
+        self.client.post('/api/v1/users/books/{}'.format(book_id), headers=self.headers)
+        self.assertEqual(self.user_lookups(), 1)
+
+        self.statements = []
+        self.client.post('/api/v1/auth/login', data=self.user)
+        self.assertEqual(self.user_lookups(), 1)
+
+    def test_listings_skip_orm_objects(self):
+        """Test that list endpoints serialize rows without loading model instances"""
+
+        self.borrow_books(3)
+        loaded = []
+
+        def record_load(target, context):
+            loaded.append(target)
+
+        event.listen(Book, 'load', record_load)
+        event.listen(BorrowLog, 'load', record_load)
+        try:
+            db.session.expunge_all()
+            for url in ('/api/v1/books', '/api/v1/books?limit=2', '/api/v1/users/books',
+                        '/api/v1/users/books?returned=false', '/api/v1/users/all/?limit=2'):
+                self.count_statements(url)
+        finally:
+            event.remove(Book, 'load', record_load)
+            event.remove(BorrowLog, 'load', record_load)
+        self.assertEqual(loaded, [])
+
+    def user_lookups(self):
+        """Return the number of recorded statements reading the users table"""
+
+        return len([s for s in self.statements if s.startswith('SELECT') and 'FROM users' in s])
+
+
+class IndexUsageTestCase(unittest.TestCase):
+    """Tests that the hot lookups are served by indexes rather than table scans"""
+
+    def setUp(self):
+        """Actions to be performed before each test"""
+
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(email='user@somewhere.com')
+        self.user.save()
+
+    def tearDown(self):
+        """Actions to be performed after each test"""
+
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def query_plan(self, query):
+        """Return the database's plan for query as text"""
+
+        statement = str(query.statement.compile(dialect=db.engine.dialect,
+                                                compile_kwargs={'literal_binds': True}))
+        if db.engine.dialect.name == 'postgresql':
+            # tiny test tables are always cheaper to scan, so only allow
+            # a sequential scan when no index can serve the query
+            db.session.execute('SET LOCAL enable_seqscan = off')
+            rows = db.session.execute('EXPLAIN ' + statement)
+        else:
+            rows = db.session.execute('EXPLAIN QUERY PLAN ' + statement)
+        return '\n'.join(str(row[-1]) for row in rows)
+
+    def assert_no_table_scan(self, query, table):
+        plan = self.query_plan(query)
+        self.assertNotRegex(plan, r'Seq Scan on {0}\b|SCAN (TABLE )?{0}\b'.format(table), plan)
+
+    def test_open_loan_lookups(self):
+        """Test that borrowing and returning find open records through an index"""
+
+        self.assert_no_table_scan(BorrowLog.open_records(1, self.user.id), 'borrow_log')
+        self.assert_no_table_scan(BorrowLog.open_records(1), 'borrow_log')
+        self.assert_no_table_scan(self.user.get_unreturned(), 'borrow_log')
+
+    def test_history_lookup(self):
+        """Test that a page of borrowing history is read through an index"""
+
+        position = tuple_(BorrowLog.borrow_timestamp, BorrowLog.borrow_id)
+        after = tuple_(datetime.datetime(2018, 7, 1), 'a')
+        page = self.user.get_borrowing_history().filter(position > after).order_by(
+            BorrowLog.borrow_timestamp, BorrowLog.borrow_id).limit(20)
+        self.assert_no_table_scan(page, 'borrow_log')
+        for user_id in (self.user.id, None):
+            page = BorrowLog.history_rows(borrow_history_serializer, user_id).filter(
+                position > after).order_by(BorrowLog.borrow_timestamp, BorrowLog.borrow_id).limit(20)
+            self.assert_no_table_scan(page, 'borrow_log')
+            self.assert_no_table_scan(page, 'borrow_log_archive')
+
+    def test_archive_selection(self):
+        """Test that archiving finds the loans returned longest ago through an index"""
+
+        batch = BorrowLog.query.filter(
+            BorrowLog.returned == true(),
+            BorrowLog.return_timestamp < datetime.datetime(2018, 7, 1)
+        ).order_by(BorrowLog.return_timestamp).limit(1000)
+        self.assert_no_table_scan(batch, 'borrow_log')
+
+    def test_overdue_scan(self):
+        """Test that the overdue scan walks open records through an index"""
+
+        now = datetime.datetime(2018, 7, 1)
+        batch = BorrowLog.overdue(now).filter(
+            BorrowLog.expected_return > now - datetime.timedelta(days=1)).order_by(
+            BorrowLog.expected_return, BorrowLog.borrow_id).limit(500)
+        self.assert_no_table_scan(batch, 'borrow_log')
+
+    def test_isbn_lookup(self):
+        """Test that books are found by isbn through an index"""
+
+        self.assert_no_table_scan(Book.query.filter_by(isbn='9780062059888'), 'books')
+
+
+if __name__ == '__main__':
+    unittest.main()
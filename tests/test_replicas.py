@@ -0,0 +1,131 @@
+"""Contains tests for routing read-only views to database replicas"""
+
+import unittest
+import json
+import os
+import tempfile
+from unittest import mock
+from flask import g
+from flask_jwt_extended import create_access_token
+from app.app import create_app, db
+from app.endpoints import Main
+from app.models import Book, User
+from app.replicas import replicas
+
+
+class ReplicaTestCase(unittest.TestCase):
+    """Tests for read replica routing with a second SQLite database as the replica"""
+
+    def setUp(self):
+        """Actions to be performed before each test"""
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = self.create_app(os.path.join(self.directory.name, 'replica.db'))
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.replica = db.get_engine(self.app, bind='replica0')
+        db.Model.metadata.create_all(bind=self.replica)
+
+        Book(title='Primary Book').save()
+        self.replica.execute(Book.__table__.insert(), title='Replica Book', available=1)
+        reader = User(email='reader@somewhere.com', first_name='Jane', last_name='Doe')
+        writer = User(email='writer@somewhere.com', first_name='John', last_name='Doe')
+        reader.save()
+        writer.save()
+        users = [dict(row) for row in db.session.execute(User.__table__.select())]
+        self.replica.execute(User.__table__.insert(), users)
+        self.reader = {'Authorization': 'Bearer ' + create_access_token(identity=reader.email)}
+        self.writer = {'Authorization': 'Bearer ' + create_access_token(identity=writer.email)}
+        g.pop('users', None)
+
+    def tearDown(self):
+        """Actions to be performed after each test"""
+
+        db.session.remove()
+        db.drop_all(bind=None)
+        self.app_context.pop()
+        self.directory.cleanup()
+
+    def create_app(self, replica_path):
+        app = create_app('testing')
+        app.config['SQLALCHEMY_REPLICA_URIS'] = ['sqlite:///' + replica_path]
+        replicas.init_app(app)
+        return app
+
+    def titles(self, headers=None):
+        response = self.client.get(Main.ALL_BOOKS, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return [book['title'] for book in json.loads(response.data)]
+
+    def test_reads_go_to_replica(self):
+        """Test whether read-only views read from the replica and writes go to the primary"""
+
+        self.assertEqual(self.titles(), ['Replica Book'])
+        self.assertEqual(self.titles(self.reader), ['Replica Book'])
+        response = self.client.get('/api/v1/books/1')
+        self.assertEqual(json.loads(response.data)['title'], 'Replica Book')
+        self.assertEqual(Book.get_by_id(1).title, 'Primary Book')
+
+    def test_read_your_writes(self):
+        """Test whether a user who just borrowed a book reads from the primary"""
+
+        response = self.client.get(Main.BORROWING_HISTORY, headers=self.writer)
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.post('/api/v1/users/books/1', headers=self.writer)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(Main.BORROWING_HISTORY, headers=self.writer)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.titles(self.writer), ['Primary Book'])
+        response = self.client.get('/api/v1/books/1', headers=self.reader)
+        self.assertEqual(json.loads(response.data)['title'], 'Replica Book')
+
+    def test_streamed_reads_go_to_replica(self):
+        """Test whether streamed results are read from the replica"""
+
+        response = self.client.get(Main.ALL_BOOKS + '?stream=ndjson')
+        self.assertEqual(response.status_code, 200)
+        books = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([book['title'] for book in books], ['Replica Book'])
+        response.close()
+        self.assertNotIn('read_replica', g)
+        self.assertEqual(Book.get_by_id(1).title, 'Primary Book')
+
+        response = self.client.get(Main.ALL_BOOKS + '?stream=1', headers=self.reader)
+        self.assertEqual([book['title'] for book in json.loads(response.data)],
+                         ['Replica Book'])
+
+    def test_failover_to_primary(self):
+        """Test whether unreachable or failing replicas are skipped"""
+
+        self.app = self.create_app(os.path.join(self.directory.name, 'missing', 'replica.db'))
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            self.assertEqual(self.titles(), ['Primary Book'])
+
+        # the replica answers its health check but has no tables
+        self.app = self.create_app(os.path.join(self.directory.name, 'empty.db'))
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            with self.assertLogs(self.app.logger, 'WARNING'):
+                self.assertEqual(self.titles(), ['Primary Book'])
+            self.assertEqual(replicas.choose(), None)
+
+    def test_idle_replica_not_lagging(self):
+        """Test whether a caught up replica is healthy however old its last replayed transaction"""
+
+        engine = mock.MagicMock()
+        engine.dialect.name = 'postgresql'
+        execute = engine.connect.return_value.__enter__.return_value.execute
+        with mock.patch.object(db, 'get_engine', return_value=engine):
+            execute.return_value.first.return_value = (True, 3600.0)
+            self.assertTrue(replicas.check('replica0'))
+            execute.return_value.first.return_value = (False, 3600.0)
+            with self.assertLogs(self.app.logger, 'WARNING'):
+                self.assertFalse(replicas.check('replica0'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""Contains tests for the circulation statistics and reports"""
+
+import unittest
+import json
+from flask import g
+from flask_jwt_extended import create_access_token
+from app.app import create_app, db
+from app.models import Book, LoanStats, User
+from app.stats import rebuild
+
+
+class StatsTestCase(unittest.TestCase):
+    """Tests for the loan counts kept by borrowing and returning"""
+
+    def setUp(self):
+        """Actions to be performed before each test"""
+
+        self.app = create_app('testing')
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.book_ids = []
+        for title, category in [('American Gods', 'Fantasy'), ('Anansi Boys', 'Fantasy'),
+                                ('Dune', 'Science Fiction')]:
+            book = Book(title=title, category=category, available=2)
+            book.save()
+            self.book_ids.append(book.id)
+        self.headers = []
+        for email in ['jane@somewhere.com', 'john@somewhere.com']:
+            user = User(email=email, first_name='Jane', last_name='Doe')
+            user.save()
+            self.headers.append(
+                {'Authorization': 'Bearer ' + create_access_token(identity=user.email)})
+        admin = User(email='admin@somewhere.com', first_name='Jim', last_name='Doe',
+                     is_admin=True)
+        admin.save()
+        self.admin = {'Authorization': 'Bearer ' + create_access_token(identity=admin.email)}
+        g.pop('users', None)
+
+    def tearDown(self):
+        """Actions to be performed after each test"""
+
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def report(self, name, **params):
+        response = self.client.get('/api/v1/reports/' + name, headers=self.admin,
+                                   query_string=params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)
+
+    def counts(self):
+        return sorted((row.dimension, row.key, row.label, row.loans, row.active, row.returns)
+                      for row in LoanStats.query)
+
+    def test_reports(self):
+        """Test whether borrowing and returning keep the reports up to date"""
+
+        american_gods, anansi_boys, dune = self.book_ids
+        jane, john = self.headers
+        for headers, book_id in [(jane, american_gods), (john, american_gods), (jane, dune)]:
+            response = self.client.post('/api/v1/users/books/{}'.format(book_id), headers=headers)
+            self.assertEqual(response.status_code, 200)
+        response = self.client.put('/api/v1/users/books/{}'.format(american_gods), headers=john)
+        self.assertEqual(response.status_code, 200)
+
+        popular = self.report('popular', limit=2)
+        self.assertEqual([(book['title'], book['loans'], book['active']) for book in popular],
+                         [('American Gods', 2, 1), ('Dune', 1, 1)])
+        self.assertEqual(self.report('categories'), [{'category': 'Fantasy', 'loans': 2},
+                                                     {'category': 'Science Fiction', 'loans': 1}])
+        self.assertEqual([(user['email'], user['active']) for user in self.report('borrowers')],
+                         [('jane@somewhere.com', 2)])
+        summary = self.report('summary')
+        self.assertEqual((summary['loans'], summary['active'], summary['returns']), (3, 2, 1))
+        self.assertIsNotNone(summary['average_loan_days'])
+
+        response = self.client.get('/api/v1/reports/unknown', headers=self.admin)
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/api/v1/reports/popular', headers=jane)
+        self.assertEqual(response.status_code, 403)
+
+    def test_rebuild(self):
+        """Test whether rebuilding from the borrowing log gives the same counts"""
+
+        jane, john = self.headers
+        self.client.post('/api/v1/users/books/batch', headers=dict(jane, **{
+            'content-type': 'application/json'}), data=json.dumps({'book_ids': self.book_ids}))
+        self.client.post('/api/v1/users/books/{}'.format(self.book_ids[0]), headers=john)
+        self.client.put('/api/v1/users/books/batch', headers=dict(jane, **{
+            'content-type': 'application/json'}), data=json.dumps({'book_ids': self.book_ids[:2]}))
+        counts = self.counts()
+        self.assertIn(('book', str(self.book_ids[0]), 'American Gods', 2, 1, 1), counts)
+
+        db.session.commit()
+        with db.engine.begin() as connection:
+            rebuild(connection)
+        db.session.expire_all()
+        self.assertEqual(self.counts(), counts)
+
+
+if __name__ == '__main__':
+    unittest.main()